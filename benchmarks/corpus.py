@@ -0,0 +1,419 @@
+#!/usr/bin/env python
+""" Synthetic Junos output for benchmarking the jaide parsers.
+
+The generators build replies shaped like those of real devices, at sizes
+well beyond what the mock fleet serves: 'show interfaces extensive' with
+thousands of interfaces, a full 'show route' table, long 'show | compare'
+and unified diff output, large commit replies, set command lists, and the
+parsed health of a large fleet. All of them are deterministic for a given
+seed.
+
+They are used by benchmarks/micro.py, and can be written out to files for
+other tools:
+
+    $ python benchmarks/corpus.py -o /tmp/corpus --interfaces 10000
+"""
+from __future__ import print_function
+# standard modules
+import os
+from os import path
+import random
+# non-standard modules
+import click
+
+JUNOS_NS = 'http://xml.juniper.net/junos/15.1R7/junos'
+NC_NS = 'urn:ietf:params:xml:ns:netconf:base:1.0'
+# physical interface families, in the order they're handed out.
+FAMILIES = ['ge', 'xe', 'et', 'ae', 'fe', 'so', 'irb', 'vlan', 'lo0', 'em',
+            'fxp', 'gr', 'ip', 'lsi', 'pfe', 'vtep']
+INPUT_ERRORS = ['input-errors', 'input-drops', 'framing-errors', 'input-runts',
+                'input-discards', 'input-l3-incompletes',
+                'input-l2-channel-errors', 'input-l2-mismatch-timeouts',
+                'input-fifo-errors', 'input-resource-errors']
+OUTPUT_ERRORS = ['carrier-transitions', 'output-errors', 'output-collisions',
+                 'output-drops', 'aged-packets', 'mtu-errors',
+                 'hs-link-crc-errors', 'output-fifo-errors',
+                 'output-resource-errors']
+MAC_STATISTICS = ['input-bytes', 'output-bytes', 'input-packets',
+                  'output-packets', 'input-unicasts', 'output-unicasts',
+                  'input-broadcasts', 'output-broadcasts',
+                  'input-multicasts', 'output-multicasts', 'input-crc-errors',
+                  'output-crc-errors', 'input-fifo-errors',
+                  'output-fifo-errors', 'input-mac-control-frames',
+                  'output-mac-control-frames', 'input-mac-pause-frames',
+                  'output-mac-pause-frames', 'input-oversized-frames',
+                  'input-jabber-frames', 'input-fragment-frames',
+                  'input-vlan-tagged-frames', 'input-code-violations']
+QUEUES = ['best-effort', 'expedited-forwarding', 'assured-forwarding',
+          'network-control']
+PROTOCOLS = ['BGP', 'BGP', 'BGP', 'BGP', 'OSPF', 'Static', 'Direct', 'Local']
+STANZAS = ['interfaces', 'protocols bgp', 'policy-options', 'firewall',
+           'routing-options', 'class-of-service', 'snmp', 'system']
+
+
+def interface_name(number):
+    """ Return the name of the numbered interface, as the mock does. """
+    family = FAMILIES[number % len(FAMILIES)]
+    slot = number // len(FAMILIES)
+    if family in ('lo0', 'irb', 'vlan', 'em', 'fxp'):
+        return family if slot == 0 else '%s%d' % (family.rstrip('0'), slot)
+    return '%s-%d/%d/%d' % (family, slot // 48, (slot // 12) % 4, slot % 12)
+
+
+def interfaces_extensive(count, error_rate=0.05, units=2, seed=0):
+    """ Build the rpc-reply of 'show interfaces extensive'.
+
+    Purpose: Every physical interface has the statistics, error lists,
+           | MAC statistics and queue counters of the extensive output,
+           | and `units` logical interfaces with their own traffic
+           | statistics. A share (error_rate) of the interfaces have
+           | non-zero error counters.
+
+    @param count: The number of physical interfaces.
+    @type count: int
+    @param error_rate: The fraction of interfaces with errors.
+    @type error_rate: float
+    @param units: The number of logical interfaces per physical interface.
+    @type units: int
+    @param seed: The seed of the random number generator.
+    @type seed: int
+
+    @returns: The xml reply.
+    @rtype: str
+    """
+    rand = random.Random(seed)
+    out = ['<rpc-reply xmlns="%s" xmlns:junos="%s">\n' % (NC_NS, JUNOS_NS),
+           '<interface-information xmlns="http://xml.juniper.net/junos/'
+           '15.1R7/junos-interface" junos:style="extensive">\n']
+    for number in range(count):
+        name = interface_name(number)
+        broken = rand.random() < error_rate
+        out.append(
+            '<physical-interface>\n<name>%s</name>\n'
+            '<admin-status junos:format="Enabled">up</admin-status>\n'
+            '<oper-status>%s</oper-status>\n'
+            '<local-index>%d</local-index>\n<snmp-index>%d</snmp-index>\n'
+            '<description>uplink %d</description>\n'
+            '<link-level-type>Ethernet</link-level-type>\n'
+            '<mtu>1514</mtu>\n<speed>1000mbps</speed>\n'
+            '<current-physical-address>00:05:86:%02x:%02x:%02x'
+            '</current-physical-address>\n'
+            '<interface-flapped junos:seconds="%d">2016-01-01 00:00:00 UTC'
+            '</interface-flapped>\n' %
+            (name, 'down' if broken and rand.random() < .3 else 'up',
+             number + 128, number + 500, number, number >> 16 & 255,
+             number >> 8 & 255, number & 255, rand.randint(0, 10 ** 7)))
+        out.append(_statistics(rand, 'traffic-statistics'))
+        for face, counters in (('input', INPUT_ERRORS),
+                               ('output', OUTPUT_ERRORS)):
+            out.append('<%s-error-list>\n' % face)
+            for counter in counters:
+                value = 0
+                if broken and rand.random() < .25:
+                    value = rand.randint(1, 5000)
+                out.append('<%s>%d</%s>\n' % (counter, value, counter))
+            out.append('</%s-error-list>\n' % face)
+        out.append('<ethernet-mac-statistics junos:style="verbose">\n')
+        for counter in MAC_STATISTICS:
+            out.append('<%s>%d</%s>\n' % (counter, rand.randint(0, 10 ** 9),
+                                          counter))
+        out.append('</ethernet-mac-statistics>\n<queue-counters>\n')
+        for queue_number, queue in enumerate(QUEUES):
+            out.append('<queue>\n<queue-number>%d</queue-number>\n'
+                       '<forwarding-class-name>%s</forwarding-class-name>\n'
+                       '<queue-counters-queued-packets>%d'
+                       '</queue-counters-queued-packets>\n'
+                       '<queue-counters-trans-packets>%d'
+                       '</queue-counters-trans-packets>\n'
+                       '<queue-counters-total-drop-packets>0'
+                       '</queue-counters-total-drop-packets>\n</queue>\n' %
+                       (queue_number, queue, rand.randint(0, 10 ** 9),
+                        rand.randint(0, 10 ** 9)))
+        out.append('</queue-counters>\n')
+        for unit in range(units):
+            out.append('<logical-interface>\n<name>%s.%d</name>\n'
+                       '<local-index>%d</local-index>\n'
+                       '<if-config-flags><iff-snmp-traps/></if-config-flags>\n'
+                       '<encapsulation>ENET2</encapsulation>\n' %
+                       (name, unit, number * units + unit + 1000))
+            out.append(_statistics(rand, 'traffic-statistics'))
+            out.append('<address-family>\n<address-family-name>inet'
+                       '</address-family-name>\n<mtu>1500</mtu>\n'
+                       '<interface-address><ifa-local>10.%d.%d.1</ifa-local>'
+                       '</interface-address>\n</address-family>\n'
+                       '</logical-interface>\n' %
+                       (number >> 8 & 255, number & 255))
+        out.append('</physical-interface>\n')
+    out.append('</interface-information>\n</rpc-reply>\n')
+    return ''.join(out)
+
+
+def route_table(count, seed=0):
+    """ Build the rpc-reply of 'show route', a full table of `count` routes.
+
+    @param count: The number of destinations.
+    @type count: int
+    @param seed: The seed of the random number generator.
+    @type seed: int
+
+    @returns: The xml reply.
+    @rtype: str
+    """
+    rand = random.Random(seed)
+    out = ['<rpc-reply xmlns="%s" xmlns:junos="%s">\n' % (NC_NS, JUNOS_NS),
+           '<route-information xmlns="http://xml.juniper.net/junos/15.1R7/'
+           'junos-routing">\n<route-table>\n'
+           '<table-name>inet.0</table-name>\n'
+           '<destination-count>%d</destination-count>\n'
+           '<total-route-count>%d</total-route-count>\n' % (count, count * 2)]
+    for number in range(count):
+        prefix = '%d.%d.%d.0/24' % (1 + number // 65536 % 223,
+                                    number // 256 % 256, number % 256)
+        out.append('<rt junos:style="brief">\n'
+                   '<rt-destination>%s</rt-destination>\n' % prefix)
+        for entry in range(2):
+            protocol = rand.choice(PROTOCOLS)
+            out.append('<rt-entry>\n<active-tag>%s</active-tag>\n'
+                       '<current-active/>\n<last-active/>\n'
+                       '<protocol-name>%s</protocol-name>\n'
+                       '<preference>%d</preference>\n'
+                       '<age junos:seconds="%d">1w2d 03:04:05</age>\n' %
+                       ('*' if entry == 0 else '', protocol,
+                        170 if protocol == 'BGP' else 10,
+                        rand.randint(0, 10 ** 6)))
+            if protocol == 'BGP':
+                out.append('<local-preference>100</local-preference>\n'
+                           '<learned-from>192.0.2.%d</learned-from>\n'
+                           '<as-path>65%03d %d I</as-path>\n' %
+                           (rand.randint(1, 254), rand.randint(0, 999),
+                            rand.randint(1, 64000)))
+            out.append('<nh>\n<selected-next-hop/>\n<to>192.0.2.%d</to>\n'
+                       '<via>%s.0</via>\n</nh>\n</rt-entry>\n' %
+                       (rand.randint(1, 254),
+                        interface_name(rand.randint(0, 255))))
+        out.append('</rt>\n')
+    out.append('</route-table>\n</route-information>\n</rpc-reply>\n')
+    return ''.join(out)
+
+
+def set_commands(count, seed=0):
+    """ Build a list of set commands, with comments and blank lines.
+
+    @param count: The number of lines.
+    @type count: int
+    @param seed: The seed of the random number generator.
+    @type seed: int
+
+    @returns: The lines, each ending in a newline, as read from a file.
+    @rtype: list
+    """
+    rand = random.Random(seed)
+    lines = []
+    for number in range(count):
+        roll = rand.random()
+        if roll < .05:
+            lines.append('# section %d\n' % number)
+        elif roll < .08:
+            lines.append('   \n')
+        else:
+            lines.append('  set interfaces %s unit 0 description "line %d"\n'
+                         % (interface_name(number), number))
+    return lines
+
+
+def compare_output(count, seed=0):
+    """ Build the text of a large 'show | compare'.
+
+    @param count: The number of changed lines.
+    @type count: int
+    @param seed: The seed of the random number generator.
+    @type seed: int
+
+    @returns: The compare output.
+    @rtype: str
+    """
+    rand = random.Random(seed)
+    out = []
+    for number in range(count):
+        if number % 20 == 0:
+            out.append('[edit %s]\n' % rand.choice(STANZAS))
+        sign = '+' if rand.random() < .6 else '-'
+        out.append('%s    %s unit %d description "line %d";\n' %
+                   (sign, interface_name(number), number % 4, number))
+    return ''.join(out)
+
+
+def compare_reply(count, seed=0):
+    """ Build the rpc-reply of a compare-configuration with `count` lines.
+
+    @param count: The number of changed lines.
+    @type count: int
+    @param seed: The seed of the random number generator.
+    @type seed: int
+
+    @returns: The xml reply.
+    @rtype: str
+    """
+    return ('<rpc-reply xmlns="%s" xmlns:junos="%s">\n'
+            '<configuration-information>\n<configuration-output>\n%s'
+            '</configuration-output>\n</configuration-information>\n'
+            '</rpc-reply>\n' % (NC_NS, JUNOS_NS,
+                                _escape(compare_output(count, seed))))
+
+
+def unified_diff(count, seed=0):
+    """ Build unified diff output as diff_config produces, of `count` lines.
+
+    @param count: The number of lines, context included.
+    @type count: int
+    @param seed: The seed of the random number generator.
+    @type seed: int
+
+    @returns: The diff, newline separated.
+    @rtype: str
+    """
+    rand = random.Random(seed)
+    out = ['--- 192.0.2.1', '+++ 192.0.2.2']
+    line = 1
+    for number in range(count):
+        if number % 30 == 0:
+            out.append('@@ -%d,30 +%d,30 @@' % (line, line))
+        roll = rand.random()
+        sign = '-' if roll < .2 else '+' if roll < .4 else ' '
+        out.append('%sset interfaces %s unit 0 description "line %d"' %
+                   (sign, interface_name(number), number))
+        line += 1
+    return '\n'.join(out)
+
+
+def commit_reply(count, seed=0):
+    """ Build a commit reply carrying `count` warnings from two REs.
+
+    Purpose: Shaped like the reply of a 'commit synchronize' with many
+           | 'statement has no contents' warnings, which is where the
+           | commit result walk spends its time.
+
+    @param count: The number of warnings.
+    @type count: int
+    @param seed: The seed of the random number generator.
+    @type seed: int
+
+    @returns: The xml reply.
+    @rtype: str
+    """
+    rand = random.Random(seed)
+    out = ['<rpc-reply xmlns="%s" xmlns:junos="%s">\n' % (NC_NS, JUNOS_NS),
+           '<commit-results>\n']
+    for engine in ('re0', 're1'):
+        out.append('<routing-engine junos:style="normal">\n'
+                   '<name>%s</name>\n' % engine)
+        for number in range(count // 2):
+            out.append('<rpc-error>\n<error-type>protocol</error-type>\n'
+                       '<error-tag>operation-failed</error-tag>\n'
+                       '<error-severity>warning</error-severity>\n'
+                       '<error-path>[edit %s]</error-path>\n'
+                       '<error-info>\n<bad-element>%s</bad-element>\n'
+                       '</error-info>\n'
+                       '<error-message>\nmgd: statement has no contents; '
+                       'ignored\n</error-message>\n</rpc-error>\n' %
+                       (rand.choice(STANZAS), interface_name(number)))
+        out.append('<commit-check-success/>\n<commit-success/>\n'
+                   '</routing-engine>\n')
+    out.append('</commit-results>\n<ok/>\n</rpc-reply>\n')
+    return ''.join(out)
+
+
+def health_data(count, seed=0):
+    """ Build the health_check_data() dictionaries of `count` devices.
+
+    Purpose: Unlike the other generators, these are the parsed values,
+           | for benchmarking the fleet summaries of jaide.analytics. One
+           | device in a hundred has a second routing engine, and one in
+           | fifty is missing its temperatures, as some platforms are.
+
+    @param count: The number of devices.
+    @type count: int
+    @param seed: The seed of the random number generator.
+    @type seed: int
+
+    @returns: A dictionary per device.
+    @rtype: list
+    """
+    rand = random.Random(seed)
+    devices = []
+    for _ in range(count):
+        engines = []
+        for slot in range(2 if rand.random() < .01 else 1):
+            idle = rand.randint(0, 100)
+            temperature = None if rand.random() < .02 else \
+                rand.randint(25, 70)
+            engines.append({
+                'slot': slot, 'state': 'backup' if slot else 'master',
+                'temperature': temperature,
+                'cpu_temperature': temperature and temperature + 3,
+                'memory': 16384, 'memory_utilization': rand.randint(5, 95),
+                'cpu_user': 100 - idle, 'cpu_background': 0, 'cpu_kernel': 0,
+                'cpu_interrupt': 0, 'cpu_idle': idle,
+                'cpu_utilization': 100 - idle, 'load_average': None,
+                'uptime': rand.randint(0, 10 ** 8)})
+        processes = [{'pid': 11, 'user': 'root', 'size': 0,
+                      'resident': 65536, 'state': 'RUN', 'time': '9000:00',
+                      'cpu': 380.0, 'command': 'idle'}]
+        for pid in range(4):
+            processes.append({'pid': 1000 + pid, 'user': 'root',
+                              'size': 10 ** 8, 'resident': 10 ** 7,
+                              'state': 'select', 'time': '1:00',
+                              'cpu': rand.uniform(0, 100), 'command': 'rpd'})
+        load = rand.uniform(0, 8)
+        devices.append({
+            'chassis_alarms': [{}] * (rand.random() < .05),
+            'system_alarms': [], 'routing_engine': '',
+            'routing_engines': engines, 'processes': [],
+            'top_processes': processes, 'load_average': [load, load, load]})
+    return devices
+
+
+def _statistics(rand, tag):
+    return ('<%s>\n<input-bytes>%d</input-bytes>\n<input-bps>%d</input-bps>\n'
+            '<output-bytes>%d</output-bytes>\n<output-bps>%d</output-bps>\n'
+            '<input-packets>%d</input-packets>\n<input-pps>%d</input-pps>\n'
+            '<output-packets>%d</output-packets>\n<output-pps>%d</output-pps>'
+            '\n</%s>\n' % ((tag,) + tuple(rand.randint(0, 10 ** 12)
+                                          for _ in range(8)) + (tag,)))
+
+
+def _escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+@click.command(context_settings=dict(help_option_names=['-h', '--help']))
+@click.option('-o', '--output', required=True, type=click.Path(
+    file_okay=False), help="The directory to write the corpus to.")
+@click.option('--interfaces', default=10000, help="Physical interfaces in "
+              "the 'show interfaces extensive' reply.")
+@click.option('--routes', default=100000, help="Destinations in the "
+              "'show route' reply.")
+@click.option('--lines', default=100000, help="Lines of compare, diff and "
+              "set command output.")
+@click.option('--seed', default=0, help="The seed of the generators.")
+def main(output, interfaces, routes, lines, seed):
+    """ Write a corpus of synthetic Junos output to a directory. """
+    if not path.isdir(output):
+        os.makedirs(output)
+    files = [
+        ('interfaces-extensive.xml', interfaces_extensive(interfaces,
+                                                          seed=seed)),
+        ('route.xml', route_table(routes, seed=seed)),
+        ('compare.xml', compare_reply(lines, seed=seed)),
+        ('diff.txt', unified_diff(lines, seed=seed)),
+        ('commit.xml', commit_reply(lines // 10, seed=seed)),
+        ('set-commands.txt', ''.join(set_commands(lines, seed=seed))),
+    ]
+    for name, content in files:
+        with open(path.join(output, name), 'wb') as corpus_file:
+            corpus_file.write(content)
+        click.echo('%-26s %10d bytes' % (name, len(content)))
+
+
+if __name__ == '__main__':
+    main()
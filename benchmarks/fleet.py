@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+""" End-to-end benchmarks of the jaide CLI against a simulated fleet.
+
+Every scenario runs one jaide CLI command against N simulated devices from
+testing/mock_junos.py, at each of the requested concurrency levels (-W).
+The CLI runs as a child process with --format jsonl, so that the per-device
+latencies come from its own records, and its CPU time and peak RSS are
+taken from os.wait4().
+
+The results are compared with a stored baseline, and the run fails (exit
+status 1) if any metric regressed more than the threshold allowed for it:
+
+    $ python benchmarks/fleet.py -n 100 -W 1,16,64
+    $ python benchmarks/fleet.py -n 100 -W 1,16,64 --save-baseline
+
+Absolute numbers depend on the machine, so a baseline is only meaningful
+on the machine that recorded it.
+"""
+from __future__ import print_function
+# standard modules
+from collections import OrderedDict
+import json
+import os
+from os import path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+# non-standard modules
+import click
+from jaide.timing import percentile
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+MOCK = path.join(ROOT, 'testing', 'mock_junos.py')
+BASELINE = path.join(path.dirname(path.abspath(__file__)), 'baseline.json')
+
+# scenario name: the CLI command. {second}, {payload} and {scratch} are
+# filled in when running.
+SCENARIOS = OrderedDict([
+    ('operational', ['operational', 'show version, show interfaces terse']),
+    ('health_check', ['health']),
+    ('interface_errors', ['errors']),
+    ('device_info', ['info']),
+    ('commit_check', ['commit', '--check', 'set system host-name bench']),
+    ('diff_config', ['diff', '-i', '{second}', '-m', 'set']),
+    ('pull', ['pull', '/var/log/messages', '{scratch}']),
+    ('push', ['push', '{payload}', '/var/tmp/']),
+])
+# metric: True when higher is better.
+METRICS = OrderedDict([
+    ('devices_per_sec', True),
+    ('p50', False),
+    ('p99', False),
+    ('cpu_seconds', False),
+    ('max_rss_mb', False),
+])
+# the relative change allowed before a metric counts as a regression,
+# unless the baseline file overrides it.
+THRESHOLDS = {
+    'devices_per_sec': 0.20,
+    'p50': 0.30,
+    'p99': 0.50,
+    'cpu_seconds': 0.25,
+    'max_rss_mb': 0.20,
+}
+PAYLOAD_SIZE = 256 * 1024
+
+
+class Fleet(object):
+
+    """ A mock fleet running in its own process. """
+
+    def __init__(self, count, port, latency, workdir):
+        self.hosts_file = path.join(workdir, 'hosts.txt')
+        self.port = port
+        self._command = [sys.executable, MOCK, '-n', str(count), '-P',
+                         str(port), '-l', str(latency), '-H', self.hosts_file]
+        self._log = open(path.join(workdir, 'mock.log'), 'w')
+        self._process = None
+        self.hosts = []
+
+    def __enter__(self):
+        self._process = subprocess.Popen(self._command, stdout=self._log,
+                                         stderr=subprocess.STDOUT)
+        deadline = time.time() + 60
+        while not path.exists(self.hosts_file):
+            if self._process.poll() is not None or time.time() > deadline:
+                raise click.ClickException('The mock fleet did not start, '
+                                           'see %s' % self._log.name)
+            time.sleep(.1)
+        time.sleep(.2)  # let the file be written completely
+        with open(self.hosts_file) as hosts:
+            self.hosts = [line.strip() for line in hosts if line.strip()]
+        return self
+
+    def __exit__(self, *exc):
+        self._process.terminate()
+        self._process.wait()
+        self._log.close()
+
+
+def run_cli(fleet, workers, arguments, workdir, timeout):
+    """ Run the jaide CLI once, and measure it.
+
+    @returns: A dictionary of the metrics of the run.
+    @rtype: dict
+    """
+    command = [sys.executable, '-m', 'jaide.cli', '-i', fleet.hosts_file,
+               '-u', 'jaide', '-p', 'jaide', '-P', str(fleet.port),
+               '-W', str(workers), '--format', 'jsonl',
+               '--job-timeout', str(timeout)] + arguments
+    out_path = path.join(workdir, 'out.jsonl')
+    with open(out_path, 'w') as out, open(os.devnull, 'w') as err:
+        started = time.time()
+        process = subprocess.Popen(command, stdout=out, stderr=err, cwd=ROOT)
+        # wait4 instead of wait() to get the resource usage of the child.
+        _, status, usage = os.wait4(process.pid, 0)
+        elapsed = time.time() - started
+        process.returncode = status
+    latencies = []
+    failures = 0
+    with open(out_path) as out:
+        for line in out:
+            record = json.loads(line)
+            if record['status'] != 'ok':
+                failures += 1
+            elif 'total' in record['timings']:
+                latencies.append(record['timings']['total'])
+    # ru_maxrss is in bytes on OS X, kilobytes elsewhere.
+    maxrss = usage.ru_maxrss / (1024.0 * 1024 if sys.platform == 'darwin'
+                                else 1024.0)
+    return OrderedDict([
+        ('devices', len(latencies) + failures),
+        ('failed', failures),
+        ('seconds', round(elapsed, 3)),
+        ('devices_per_sec', round(len(latencies) / elapsed, 2)),
+        ('p50', _round(percentile(latencies, 50))),
+        ('p99', _round(percentile(latencies, 99))),
+        ('cpu_seconds', round(usage.ru_utime + usage.ru_stime, 3)),
+        ('max_rss_mb', round(maxrss, 1)),
+    ])
+
+
+def compare(results, baseline):
+    """ Compare results with a baseline.
+
+    @returns: A list of regression messages, empty if there are none.
+    @rtype: list
+    """
+    thresholds = dict(THRESHOLDS, **baseline.get('thresholds', {}))
+    regressions = []
+    for key, metrics in results.items():
+        expected = baseline.get('results', {}).get(key)
+        if not expected:
+            continue
+        for metric, higher_is_better in METRICS.items():
+            old, new = expected.get(metric), metrics.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / float(old)
+            worse = -change if higher_is_better else change
+            if worse > thresholds[metric]:
+                regressions.append('%s %s: %s -> %s (%+.0f%%, allowed %.0f%%)'
+                                   % (key, metric, old, new, change * 100,
+                                      thresholds[metric] * 100))
+    return regressions
+
+
+def _round(value):
+    return None if value is None else round(value, 4)
+
+
+@click.command(context_settings=dict(help_option_names=['-h', '--help']))
+@click.option('-n', '--devices', default=20, help="Number of simulated "
+              "devices. Defaults to 20.")
+@click.option('-W', '--workers', default='1,8,32', help="Comma separated "
+              "concurrency levels to run every scenario at.")
+@click.option('-s', '--scenario', 'scenarios', multiple=True,
+              type=click.Choice(list(SCENARIOS)), help="Only run this "
+              "scenario. Can be given more than once. Defaults to all.")
+@click.option('-P', '--port', default=2222, help="Port of the mock fleet.")
+@click.option('-l', '--latency', default=0.02, help="Seconds the mock "
+              "devices wait before replying.")
+@click.option('-t', '--timeout', default=600, help="Job timeout per run.")
+@click.option('-b', '--baseline', default=BASELINE, type=click.Path(),
+              help="The baseline JSON file to compare with.")
+@click.option('--save-baseline', is_flag=True, help="Store these results as "
+              "the baseline instead of comparing.")
+@click.option('-o', '--output', type=click.Path(), help="Also write the "
+              "results to this JSON file.")
+def main(devices, workers, scenarios, port, latency, timeout, baseline,
+         save_baseline, output):
+    """ Benchmark the jaide CLI against a simulated fleet. """
+    levels = [int(level) for level in workers.split(',')]
+    scenarios = scenarios or list(SCENARIOS)
+    workdir = tempfile.mkdtemp(prefix='jaide-bench-')
+    payload = path.join(workdir, 'payload.bin')
+    with open(payload, 'wb') as blob:
+        blob.write(os.urandom(PAYLOAD_SIZE))
+    results = OrderedDict()
+    try:
+        with Fleet(devices, port, latency, workdir) as fleet:
+            click.echo('%-24s %7s %7s %9s %8s %8s %8s %8s' % (
+                'scenario', 'devices', 'failed', 'dev/sec', 'p50', 'p99',
+                'cpu', 'rss MB'))
+            for name in scenarios:
+                for level in levels:
+                    scratch = tempfile.mkdtemp(dir=workdir)
+                    arguments = [arg.format(second=fleet.hosts[0],
+                                            payload=payload, scratch=scratch)
+                                 for arg in SCENARIOS[name]]
+                    key = '%s@%d' % (name, level)
+                    metrics = run_cli(fleet, level, arguments, workdir,
+                                      timeout)
+                    results[key] = metrics
+                    click.echo('%-24s %7d %7d %9.2f %8s %8s %8.2f %8.1f' % (
+                        key, metrics['devices'], metrics['failed'],
+                        metrics['devices_per_sec'], metrics['p50'],
+                        metrics['p99'], metrics['cpu_seconds'],
+                        metrics['max_rss_mb']))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    record = OrderedDict([('devices', devices), ('latency', latency),
+                          ('python', sys.version.split()[0]),
+                          ('results', results)])
+    if output:
+        with open(output, 'w') as out:
+            json.dump(record, out, indent=2)
+    if save_baseline:
+        if path.exists(baseline):
+            with open(baseline) as old:
+                record['thresholds'] = json.load(old).get('thresholds', {})
+        record.setdefault('thresholds', THRESHOLDS)
+        with open(baseline, 'w') as out:
+            json.dump(record, out, indent=2)
+        click.echo('Baseline written to %s' % baseline)
+        return
+    if not path.exists(baseline):
+        click.echo('No baseline at %s, nothing to compare with.' % baseline)
+        return
+    with open(baseline) as stored:
+        stored = json.load(stored)
+    if (stored.get('devices'), stored.get('latency')) != (devices, latency):
+        click.echo('Warning: the baseline was recorded with %s devices and '
+                   '%ss latency.' % (stored.get('devices'),
+                                     stored.get('latency')), err=True)
+    regressions = compare(results, stored)
+    if regressions:
+        click.echo('Regressions against %s:' % baseline, err=True)
+        for regression in regressions:
+            click.echo('  ' + regression, err=True)
+        sys.exit(1)
+    click.echo('No regressions against %s.' % baseline)
+
+
+if __name__ == '__main__':
+    main()
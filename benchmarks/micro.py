@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+""" Microbenchmarks of the jaide parsing hot paths.
+
+Each benchmark runs one parser over synthetic output from
+benchmarks/corpus.py, sized for a large device or a large change. Every
+benchmark runs in a fresh interpreter, so that its memory figures aren't
+skewed by the ones before it. Building the input is not measured.
+
+For each benchmark the best and median time of the repeats are reported,
+along with the memory allocated while it ran: the tracemalloc peak where
+the interpreter has tracemalloc, and otherwise the growth of the peak
+resident size of the process, which only shows allocations beyond the
+memory the process already had.
+
+    $ python benchmarks/micro.py
+    $ python benchmarks/micro.py -b interface_errors -b xpath_interfaces -s 0.1
+    $ python benchmarks/micro.py -o new.json --compare old.json
+"""
+from __future__ import print_function
+# standard modules
+from collections import OrderedDict
+import gc
+import json
+import subprocess
+import sys
+import time
+import xml.etree.ElementTree as ET
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+# non-standard modules
+import click
+from ncclient.devices.junos import JunosDeviceHandler
+from ncclient.operations.rpc import RPCReply
+from ncclient.xml_ import NCElement
+from jaide.analytics import METRICS, FleetAggregator
+from jaide.color_utils import color_diffs
+from jaide.core import Jaide, significant_errors
+from jaide.timing import percentile
+from jaide.utils import clean_lines, xpath
+# benchmarks/ isn't a package, the corpus is imported from the same folder.
+import corpus
+
+# sizes of the inputs at --scale 1.
+INTERFACES = 10000
+ROUTES = 100000
+LINES = 100000
+COMMIT_WARNINGS = 10000
+DEVICES = 10000
+
+
+def junos_reply(raw):
+    """ Wrap raw rpc-reply xml the way ncclient hands it to Jaide. """
+    handler = JunosDeviceHandler({'name': 'junos'})
+    return NCElement(RPCReply(raw), handler.transform_reply())
+
+
+def _device():
+    return Jaide('192.0.2.1', 'bench', 'bench', connect=False)
+
+
+def bench_reply_transform(scale):
+    raw = corpus.interfaces_extensive(int(INTERFACES * scale))
+    return lambda: junos_reply(raw)
+
+
+def bench_xpath_interfaces(scale):
+    raw = corpus.interfaces_extensive(int(INTERFACES * scale))
+    return lambda: xpath(raw, '//physical-interface[oper-status="down"]/name')
+
+
+def bench_xpath_routes(scale):
+    raw = corpus.route_table(int(ROUTES * scale))
+    return lambda: xpath(raw, '//rt[rt-entry/protocol-name="OSPF"]/'
+                              'rt-destination')
+
+
+def bench_clean_lines(scale):
+    lines = corpus.set_commands(int(LINES * scale))
+    return lambda: list(clean_lines(lines))
+
+
+def bench_color_diffs_compare(scale):
+    text = corpus.compare_output(int(LINES * scale))
+    return lambda: color_diffs(text)
+
+
+def bench_color_diffs_diff(scale):
+    text = corpus.unified_diff(int(LINES * scale))
+    return lambda: color_diffs(text)
+
+
+def bench_interface_errors(scale):
+    device = _device()
+    reply = junos_reply(corpus.interfaces_extensive(int(INTERFACES * scale)))
+    return lambda: significant_errors(device._parse_interface_counters(reply))
+
+
+def bench_fleet_summary(scale):
+    aggregator = FleetAggregator(METRICS['health'], {'cpu_utilization': 80},
+                                 top=10)
+    for index, health in enumerate(corpus.health_data(int(DEVICES * scale))):
+        aggregator.add('device-%d' % index, health)
+    return aggregator.summary
+
+
+def bench_commit_walk(scale):
+    device = _device()
+    results = ET.fromstring(corpus.commit_reply(int(COMMIT_WARNINGS * scale)))
+    return lambda: device._commit_output(results, commit=True)
+
+
+def bench_commit_check_walk(scale):
+    device = _device()
+    results = ET.fromstring(corpus.commit_reply(int(COMMIT_WARNINGS * scale)))
+    return lambda: device._commit_output(results)
+
+
+BENCHMARKS = OrderedDict(
+    (function.__name__[len('bench_'):], function) for function in (
+        bench_reply_transform, bench_xpath_interfaces, bench_xpath_routes,
+        bench_clean_lines, bench_color_diffs_compare, bench_color_diffs_diff,
+        bench_interface_errors, bench_fleet_summary, bench_commit_walk,
+        bench_commit_check_walk))
+
+
+def measure(name, scale, repeat):
+    """ Run a benchmark in this process.
+
+    @param name: The benchmark, one of BENCHMARKS.
+    @type name: str
+    @param scale: The size of the input, relative to the defaults.
+    @type scale: float
+    @param repeat: How many times to run it.
+    @type repeat: int
+
+    @returns: The 'best' and 'median' seconds, and the 'allocated' bytes,
+            | with 'allocation_source' saying how they were measured.
+    @rtype: dict
+    """
+    run = BENCHMARKS[name](scale)
+    gc.collect()
+    if tracemalloc is not None:
+        tracemalloc.start()
+    elif resource is not None:
+        start_rss = _maxrss()
+    times = []
+    for _ in range(repeat):
+        started = time.time()
+        run()
+        times.append(time.time() - started)
+    result = {'best': min(times), 'median': percentile(times, 50)}
+    if tracemalloc is not None:
+        result['allocated'] = tracemalloc.get_traced_memory()[1]
+        result['allocation_source'] = 'tracemalloc peak'
+        tracemalloc.stop()
+    elif resource is not None:
+        result['allocated'] = _maxrss() - start_rss
+        result['allocation_source'] = 'peak RSS growth'
+    else:
+        result['allocated'] = None
+        result['allocation_source'] = 'unavailable'
+    return result
+
+
+def _maxrss():
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on OS X, kilobytes elsewhere.
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+def _size(num):
+    if num is None:
+        return '-'
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(num) < 1024.0:
+            return '%.1f %s' % (num, unit)
+        num /= 1024.0
+    return '%.1f TB' % num
+
+
+@click.command(context_settings=dict(help_option_names=['-h', '--help']))
+@click.option('-b', '--benchmark', 'names', multiple=True,
+              type=click.Choice(list(BENCHMARKS)), help="Only run this "
+              "benchmark. Can be given more than once. Defaults to all.")
+@click.option('-s', '--scale', default=1.0, help="The size of the inputs, "
+              "relative to %d interfaces, %d routes, %d lines and %d "
+              "devices." % (INTERFACES, ROUTES, LINES, DEVICES))
+@click.option('-r', '--repeat', default=5, help="Runs per benchmark.")
+@click.option('-o', '--output', type=click.Path(), help="Write the results "
+              "to this JSON file.")
+@click.option('--compare', type=click.Path(exists=True), help="A JSON file "
+              "of earlier results, to show the change against.")
+@click.option('--child', metavar='BENCHMARK', help="Run a single "
+              "benchmark in this process and print its result as JSON.")
+def main(names, scale, repeat, output, compare, child):
+    """ Benchmark the jaide parsers on synthetic Junos output. """
+    if child:
+        click.echo(json.dumps(measure(child, scale, repeat)))
+        return
+    previous = {}
+    if compare:
+        with open(compare) as old:
+            previous = json.load(old)['results']
+    results = OrderedDict()
+    click.echo('%-22s %10s %10s %12s %9s' % ('benchmark', 'best', 'median',
+                                             'allocated', 'change'))
+    for name in names or list(BENCHMARKS):
+        reply = subprocess.check_output([
+            sys.executable, __file__, '--child', name, '-s', str(scale),
+            '-r', str(repeat)])
+        results[name] = result = json.loads(reply)
+        change = ''
+        if previous.get(name):
+            change = '%+.0f%%' % ((result['best'] / previous[name]['best'] -
+                                   1) * 100)
+        click.echo('%-22s %9.4fs %9.4fs %12s %9s' % (
+            name, result['best'], result['median'],
+            _size(result['allocated']), change))
+    if results:
+        source = list(results.values())[0]['allocation_source']
+        click.echo('Allocated memory is the %s.' % source)
+    if output:
+        with open(output, 'w') as out:
+            json.dump(OrderedDict([('scale', scale), ('repeat', repeat),
+                                   ('python', sys.version.split()[0]),
+                                   ('results', results)]), out, indent=2)
+
+
+if __name__ == '__main__':
+    main()
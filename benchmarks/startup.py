@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+""" Startup time of the jaide CLI and library.
+
+Wrapper scripts start jaide many times over, so the time before it does
+any work matters. Each scenario starts a fresh interpreter, repeatedly,
+and reports the best and median wall-clock time and the median CPU time
+of the process (from os.wait4()), along with the heavy third-party
+modules it imported. None of the scenarios talk to a device, so none of
+them should import the device backends (ncclient, paramiko, scp) or lxml;
+the run fails (exit status 1) if one does.
+
+    $ python benchmarks/startup.py
+    $ python benchmarks/startup.py -o new.json --compare old.json
+"""
+from __future__ import print_function
+# standard modules
+from collections import OrderedDict
+import json
+import os
+from os import path
+import subprocess
+import sys
+import tempfile
+import time
+# non-standard modules
+import click
+from jaide.timing import percentile
+
+ROOT = path.dirname(path.dirname(path.abspath(__file__)))
+# the modules that are only worth importing once they are used.
+HEAVY = ('ncclient', 'paramiko', 'scp', 'lxml', 'numpy', 'Crypto')
+# scenario name: the code run in the child, and the command line it sees.
+SCENARIOS = OrderedDict([
+    ('python', ('pass', [])),
+    ('import_jaide', ('import jaide', [])),
+    ('cli_help', ('RUN', ['--help'])),
+    ('command_help', ('RUN', ['-i', '192.0.2.1', '-u', 'bench', '-p',
+                              'bench', 'health', '--help'])),
+    ('bad_option', ('RUN', ['--no-such-option'])),
+])
+# runs the CLI the way the jaide entry point does.
+RUN = ('from jaide.cli import run\n'
+       'try:\n    run()\nexcept SystemExit:\n    pass')
+# appended to the code of every child, to report the modules it imported.
+REPORT = ('\nimport json, sys\nwith open(%r, "w") as report:\n    json.dump(['
+          'name for name in sys.modules if sys.modules[name] is not None and '
+          'name.split(".")[0] in %r], report)\n')
+
+
+def run_child(code, argv, report):
+    """ Start an interpreter running code, and measure it.
+
+    @returns: The wall-clock seconds, the CPU seconds, and the heavy
+            | modules imported.
+    @rtype: tuple
+    """
+    source = (RUN if code == 'RUN' else code) + REPORT % (report, HEAVY)
+    command = [sys.executable, '-c', source] + argv
+    with open(os.devnull, 'w') as null:
+        started = time.time()
+        process = subprocess.Popen(command, stdout=null, stderr=null,
+                                   cwd=ROOT)
+        # wait4 instead of wait() to get the resource usage of the child.
+        _, _, usage = os.wait4(process.pid, 0)
+        elapsed = time.time() - started
+    with open(report) as loaded:
+        modules = json.load(loaded)
+    return elapsed, usage.ru_utime + usage.ru_stime, modules
+
+
+@click.command(context_settings=dict(help_option_names=['-h', '--help']))
+@click.option('-s', '--scenario', 'scenarios', multiple=True,
+              type=click.Choice(list(SCENARIOS)), help="Only run this "
+              "scenario. Can be given more than once. Defaults to all.")
+@click.option('-r', '--repeat', default=20, help="Runs per scenario.")
+@click.option('-o', '--output', type=click.Path(), help="Write the results "
+              "to this JSON file.")
+@click.option('--compare', type=click.Path(exists=True), help="A JSON file "
+              "of earlier results, to show the change against.")
+def main(scenarios, repeat, output, compare):
+    """ Measure the startup time of the jaide CLI and library. """
+    previous = {}
+    if compare:
+        with open(compare) as old:
+            previous = json.load(old)['results']
+    handle, report = tempfile.mkstemp(suffix='.json')
+    os.close(handle)
+    results = OrderedDict()
+    heavy = False
+    click.echo('%-16s %9s %9s %9s %9s  %s' % ('scenario', 'best', 'median',
+                                              'cpu', 'change', 'heavy'))
+    try:
+        for name in scenarios or list(SCENARIOS):
+            code, argv = SCENARIOS[name]
+            runs = [run_child(code, argv, report) for _ in range(repeat)]
+            modules = sorted(set(module.split('.')[0]
+                                 for module in runs[-1][2]))
+            results[name] = result = OrderedDict([
+                ('best', min(run[0] for run in runs)),
+                ('median', percentile([run[0] for run in runs], 50)),
+                ('cpu', percentile([run[1] for run in runs], 50)),
+                ('heavy_modules', modules)])
+            change = ''
+            if previous.get(name):
+                change = '%+.0f%%' % ((result['best'] / previous[name]['best']
+                                       - 1) * 100)
+            click.echo('%-16s %7.1fms %7.1fms %7.1fms %9s  %s' % (
+                name, result['best'] * 1000, result['median'] * 1000,
+                result['cpu'] * 1000, change, ', '.join(modules) or '-'))
+            heavy = heavy or bool(modules)
+    finally:
+        os.remove(report)
+    if output:
+        with open(output, 'w') as out:
+            json.dump(OrderedDict([('repeat', repeat),
+                                   ('python', sys.version.split()[0]),
+                                   ('results', results)]), out, indent=2)
+    if heavy:
+        click.echo('Heavy modules were imported at startup.', err=True)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
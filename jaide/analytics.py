@@ -0,0 +1,288 @@
+""" Fleet wide summaries of the health and errors commands.
+
+A FleetAggregator reads a few numbers from the structured result of each
+device, such as the CPU utilization of its master routing engine, and keeps
+them as one row per device in a flat array of doubles, NaN marking the
+values a device didn't report. When the run is over, the table is
+summarized in one pass per statistic: percentiles across the fleet, the
+top devices for each metric, and the devices over a threshold.
+
+The summary is computed with NumPy when it is installed (pip install
+jaide[analytics]), which handles thousands of devices in a few
+milliseconds. Without it, the same summary is computed in pure Python.
+"""
+# standard modules
+from array import array
+from collections import OrderedDict
+import heapq
+# intra-Jaide imports
+from timing import percentile
+from utils import LazyModule
+# non-standard modules. NumPy is optional, see the module docstring, and is
+# only imported for the first summary.
+numpy = LazyModule('numpy')
+
+_NAN = float('nan')
+
+
+def _master(health):
+    """ The master routing engine of health_check_data(), or the first. """
+    engines = health.get('routing_engines') or [{}]
+    for engine in engines:
+        if engine.get('state') == 'master':
+            return engine
+    return engines[0]
+
+
+def _busiest_process(health):
+    """ The CPU percent of the busiest process, leaving out the idle one. """
+    usage = [process['cpu'] for process in health.get('top_processes', [])
+             if process['cpu'] is not None and process['command'] and
+             process['command'].strip('[]{}') != 'idle']
+    return max(usage) if usage else None
+
+
+def _load_average(health):
+    load = health.get('load_average') or _master(health).get('load_average')
+    return load[0] if load else None
+
+
+def _errors(data):
+    """ The errors of interface_errors_data(), with or without baseline. """
+    return data['errors'] if isinstance(data, dict) else data
+
+
+def _error_count(data):
+    """ The sum of the counters, or of their growth since the baseline. """
+    return sum(error.get('delta', error['count']) for error in _errors(data))
+
+
+def _error_rate(data):
+    """ The errors per second since the baseline, if there is one. """
+    if not isinstance(data, dict) or data['since'] is None:
+        return None
+    return sum(error['rate'] for error in data['errors'])
+
+
+# command: metric name: function reading the metric from the structured
+# data of a device. Each returns a number, or None if it isn't known.
+METRICS = {
+    'health': OrderedDict([
+        ('cpu_utilization', lambda data: _master(data).get('cpu_utilization')),
+        ('memory_utilization',
+         lambda data: _master(data).get('memory_utilization')),
+        ('temperature', lambda data: _master(data).get('temperature')),
+        ('cpu_temperature', lambda data: _master(data).get('cpu_temperature')),
+        ('load_average', _load_average),
+        ('busiest_process', _busiest_process),
+        ('alarms', lambda data: len(data['chassis_alarms']) +
+         len(data['system_alarms'])),
+    ]),
+    'errors': OrderedDict([
+        ('interfaces', lambda data: len(set(error['interface']
+                                            for error in _errors(data)))),
+        ('counters', lambda data: len(_errors(data))),
+        ('errors', _error_count),
+        ('error_rate', _error_rate),
+    ]),
+}
+
+
+class FleetAggregator(object):
+
+    """ Collect numeric metrics of many devices, and summarize them. """
+
+    def __init__(self, metrics, thresholds=None, top=5):
+        """ Initialize the aggregator.
+
+        @param metrics: The metrics to collect: their name, and a function
+                      | reading them from the structured data of a device,
+                      | such as METRICS['health'].
+        @type metrics: collections.OrderedDict
+        @param thresholds: The value above which a device is reported, per
+                         | metric name.
+        @type thresholds: dict
+        @param top: The number of devices listed for each metric.
+        @type top: int
+        """
+        self.metrics = metrics
+        self.names = list(metrics)
+        self.thresholds = thresholds or {}
+        self.top = top
+        self.hosts = []
+        # row-major, one row per host and one column per metric.
+        self.values = array('d')
+
+    def add(self, host, data):
+        """ Add the metrics of a device.
+
+        @param host: The device.
+        @type host: str
+        @param data: The structured data of the device, such as the result
+                   | of Jaide.health_check_data().
+        @type data: dict or list
+
+        @returns: None
+        """
+        row = []
+        for name in self.names:
+            try:
+                value = self.metrics[name](data)
+            except (KeyError, TypeError, ValueError, IndexError):
+                value = None
+            row.append(_NAN if value is None else float(value))
+        self.hosts.append(host)
+        self.values.extend(row)
+
+    def add_result(self, result):
+        """ Add a device job result, skipping failed devices.
+
+        @param result: The result of a device job.
+        @type result: jaide.result.DeviceResult
+
+        @returns: None
+        """
+        if result.ok and result.data is not None:
+            self.add(result.host, result.data)
+
+    def summary(self, percents=(50, 90, 99)):
+        """ Summarize every metric across the devices.
+
+        @param percents: The percentiles to compute.
+        @type percents: tuple
+
+        @returns: A dictionary with the keys 'devices', 'metrics' (a
+                | dictionary per metric, with the keys 'metric', 'devices'
+                | that reported it, 'p<N>' for each percentile, 'max', and
+                | 'top', the (host, value) pairs of the highest devices)
+                | and 'breaches' (a dictionary per device over a
+                | threshold, with the keys 'host', 'metric', 'value' and
+                | 'threshold', highest first for each metric).
+        @rtype: dict
+        """
+        if self.hosts and _have_numpy():
+            rows = self._summary_numpy(percents)
+        else:
+            rows = self._summary_python(percents)
+        breaches = []
+        for row in rows:
+            breaches.extend(row.pop('breaches'))
+        return {'devices': len(self.hosts), 'metrics': rows,
+                'breaches': breaches}
+
+    def _summary_numpy(self, percents):
+        width = len(self.names)
+        table = numpy.frombuffer(self.values, dtype=numpy.float64).reshape(
+            len(self.hosts), width)
+        present = ~numpy.isnan(table)
+        counts = present.sum(axis=0)
+        # sorting each column puts the NaNs last, so the reported values of
+        # column c are ordered[:counts[c], c].
+        ordered = numpy.sort(table, axis=0)
+        columns = numpy.arange(width)
+        last = numpy.maximum(counts - 1, 0)
+        stats = {'max': ordered[last, columns]}
+        for percent in percents:
+            # nearest rank, rounding halves up like timing.percentile().
+            ranks = numpy.floor(percent / 100.0 * last + 0.5).astype(int)
+            stats['p%d' % percent] = ordered[ranks, columns]
+        # highest first; a stable sort keeps ties in the order added.
+        keyed = numpy.where(present, -table, numpy.inf)
+        top = numpy.argsort(keyed, axis=0, kind='mergesort')[:self.top]
+        limits = numpy.array([self.thresholds.get(name, _NAN)
+                              for name in self.names])
+        with numpy.errstate(invalid='ignore'):
+            over = table > limits  # NaN never compares greater
+        rows = []
+        for column, name in enumerate(self.names):
+            count = int(counts[column])
+            row = OrderedDict([('metric', name), ('devices', count)])
+            for key in ['p%d' % percent for percent in percents] + ['max']:
+                row[key] = float(stats[key][column]) if count else None
+            row['top'] = [(self.hosts[index], float(table[index, column]))
+                          for index in top[:count, column]]
+            hits = numpy.nonzero(over[:, column])[0]
+            hits = hits[numpy.argsort(-table[hits, column], kind='mergesort')]
+            row['breaches'] = [self._breach(index, name,
+                                            float(table[index, column]))
+                               for index in hits]
+            rows.append(row)
+        return rows
+
+    def _summary_python(self, percents):
+        width = len(self.names)
+        rows = []
+        for column, name in enumerate(self.names):
+            values = self.values[column::width]
+            reported = [(value, index) for index, value in enumerate(values)
+                        if value == value]  # NaN isn't equal to itself
+            numbers = [value for value, _ in reported]
+            row = OrderedDict([('metric', name), ('devices', len(reported))])
+            for percent in percents:
+                row['p%d' % percent] = percentile(numbers, percent)
+            row['max'] = max(numbers) if numbers else None
+            # highest first, ties in the order added.
+            highest = heapq.nsmallest(self.top, reported,
+                                      key=lambda pair: (-pair[0], pair[1]))
+            row['top'] = [(self.hosts[index], value)
+                          for value, index in highest]
+            limit = self.thresholds.get(name)
+            over = sorted((pair for pair in reported
+                           if limit is not None and pair[0] > limit),
+                          key=lambda pair: (-pair[0], pair[1]))
+            row['breaches'] = [self._breach(index, name, value)
+                               for value, index in over]
+            rows.append(row)
+        return rows
+
+    def _breach(self, index, name, value):
+        return OrderedDict([('host', self.hosts[index]), ('metric', name),
+                            ('value', value),
+                            ('threshold', self.thresholds[name])])
+
+    def render(self, percents=(50, 90, 99)):
+        """ Render the summary as text.
+
+        @param percents: The percentiles to compute.
+        @type percents: tuple
+
+        @returns: A table of the percentiles of each metric, the top
+                | devices for each metric, and the threshold breaches.
+        @rtype: str
+        """
+        summary = self.summary(percents)
+        columns = ['p%d' % percent for percent in percents] + ['max']
+        lines = ['Summary across %d devices:' % summary['devices'],
+                 '%-20s %7s ' % ('metric', 'devices') +
+                 ' '.join('%9s' % column for column in columns)]
+        for row in summary['metrics']:
+            lines.append('%-20s %7d ' % (row['metric'], row['devices']) +
+                         ' '.join('%9s' % _value(row[column])
+                                  for column in columns))
+        lines.append('Top %d devices:' % self.top)
+        for row in summary['metrics']:
+            if row['top']:
+                lines.append('  %s: %s' % (row['metric'], ', '.join(
+                    '%s (%s)' % (host, _value(value))
+                    for host, value in row['top'])))
+        if self.thresholds:
+            lines.append('%d threshold breaches:' % len(summary['breaches']))
+            for breach in summary['breaches']:
+                lines.append('  %s %s %s > %s' % (
+                    breach['host'], breach['metric'],
+                    _value(breach['value']), _value(breach['threshold'])))
+        return '\n'.join(lines) + '\n'
+
+
+def _have_numpy():
+    try:
+        numpy.ndarray
+    except ImportError:
+        return False
+    return True
+
+
+def _value(number):
+    if number is None:
+        return '-'
+    return '%d' % number if number == int(number) else '%.2f' % number
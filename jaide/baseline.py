@@ -0,0 +1,241 @@
+""" Interface error counter baselines, for the errors --baseline option.
+
+Junos error counters only ever grow until they are cleared, so a single
+old burst of errors keeps an interface flagged by interface_errors()
+forever. A baseline keeps the counters of every checked interface from the
+previous run, so that only the counters that grew since then are reported,
+along with their rate per second.
+
+Each device has one snapshot file in the baseline directory. It holds a
+one line JSON header (the time of the snapshot, the interface names and
+the counter names), followed by the counter values as a row-major array
+of doubles in the byte order of the machine, one row per interface.
+Doubles hold every integer up to 2**53 exactly, far beyond any error
+count, and leave NaN for the counters an interface doesn't have.
+"""
+# standard modules
+from array import array
+import json
+import os
+from os import path
+import re
+import tempfile
+import time
+
+# stored in the header, so that snapshots of other versions are ignored.
+VERSION = 1
+_NAN = float('nan')
+
+
+class CounterSnapshot(object):
+
+    """ The error counters of every checked interface of a device. """
+
+    def __init__(self, host, taken, interfaces, counters, values):
+        """ Initialize the snapshot.
+
+        @param host: The device the counters are from.
+        @type host: str
+        @param taken: When the counters were read, in seconds since the epoch.
+        @type taken: float
+        @param interfaces: The interface names, one per row of values.
+        @type interfaces: list
+        @param counters: The 'direction/counter' names, one per column of
+                       | values, such as 'input/input-errors'.
+        @type counters: list
+        @param values: len(interfaces) * len(counters) counter values, NaN
+                     | for counters an interface doesn't have.
+        @type values: array.array
+        """
+        self.host = host
+        self.taken = taken
+        self.interfaces = interfaces
+        self.counters = counters
+        self.values = values
+        self._rows = dict((name, row) for row, name in enumerate(interfaces))
+        self._columns = dict((name, col) for col, name in enumerate(counters))
+
+    @classmethod
+    def from_counters(cls, host, interface_counters, taken=None):
+        """ Build a snapshot from the counters read from a device.
+
+        @param host: The device the counters are from.
+        @type host: str
+        @param interface_counters: The counters, as returned by
+                                 | Jaide.interface_counters().
+        @type interface_counters: list
+        @param taken: When the counters were read. Defaults to now.
+        @type taken: float
+
+        @returns: The snapshot.
+        @rtype: CounterSnapshot
+        """
+        interfaces = []
+        columns = {}
+        for interface in interface_counters:
+            interfaces.append(interface['interface'])
+            for face in ('input', 'output'):
+                for counter, _ in interface[face]:
+                    columns.setdefault(face + '/' + counter, len(columns))
+        counters = sorted(columns, key=columns.get)
+        values = array('d', [_NAN]) * (len(interfaces) * len(counters))
+        width = len(counters)
+        for row, interface in enumerate(interface_counters):
+            for face in ('input', 'output'):
+                for counter, count in interface[face]:
+                    values[row * width + columns[face + '/' + counter]] = count
+        return cls(host, time.time() if taken is None else taken, interfaces,
+                   counters, values)
+
+    def value(self, interface, direction, counter):
+        """ Return the value of a counter, or None if it wasn't recorded.
+
+        @param interface: The interface name.
+        @type interface: str
+        @param direction: 'input' or 'output'.
+        @type direction: str
+        @param counter: The counter name, such as 'input-errors'.
+        @type counter: str
+
+        @returns: The counter value.
+        @rtype: int
+        """
+        row = self._rows.get(interface)
+        col = self._columns.get(direction + '/' + counter)
+        if row is None or col is None:
+            return None
+        count = self.values[row * len(self.counters) + col]
+        return None if count != count else int(count)  # NaN: not recorded
+
+    def growth(self, interface_counters, taken=None):
+        """ Compare newer counters with this snapshot.
+
+        Purpose: Reports every counter that is higher than in the snapshot.
+               | A counter that is lower was cleared, or the device
+               | restarted, in between, so all of its current value is
+               | new. Interfaces and counters that aren't in the snapshot
+               | are not reported, they become part of the next baseline.
+
+        @param interface_counters: The newer counters, as returned by
+                                 | Jaide.interface_counters().
+        @type interface_counters: list
+        @param taken: When the newer counters were read. Defaults to now.
+        @type taken: float
+
+        @returns: A dictionary per counter that grew, with the keys
+                | 'interface', 'status', 'direction', 'counter', 'count'
+                | (the current value), 'delta' and 'rate' (per second).
+        @rtype: list
+        """
+        taken = time.time() if taken is None else taken
+        interval = max(taken - self.taken, 1e-6)
+        output = []
+        for interface in interface_counters:
+            for face in ('input', 'output'):
+                for counter, count in interface[face]:
+                    before = self.value(interface['interface'], face, counter)
+                    if before is None or count == before:
+                        continue
+                    delta = count - before if count > before else count
+                    if delta <= 0:
+                        continue
+                    output.append({'interface': interface['interface'],
+                                   'status': interface['status'],
+                                   'direction': face, 'counter': counter,
+                                   'count': count, 'delta': delta,
+                                   'rate': delta / interval})
+        return output
+
+    def dumps(self):
+        """ Serialize the snapshot to the bytes of a snapshot file. """
+        header = json.dumps({'version': VERSION, 'host': self.host,
+                             'taken': self.taken,
+                             'interfaces': self.interfaces,
+                             'counters': self.counters})
+        return header + '\n' + self.values.tostring()
+
+    @classmethod
+    def loads(cls, data):
+        """ Read a snapshot from the bytes of a snapshot file.
+
+        @param data: The content of the file.
+        @type data: str
+
+        @returns: The snapshot, or None if it's from another version or
+                | damaged.
+        @rtype: CounterSnapshot
+        """
+        header, _, body = data.partition('\n')
+        try:
+            header = json.loads(header)
+        except ValueError:
+            return None
+        if header.get('version') != VERSION:
+            return None
+        values = array('d')
+        try:
+            values.fromstring(body)
+        except ValueError:  # not a whole number of values
+            return None
+        if len(values) != len(header['interfaces']) * len(header['counters']):
+            return None
+        return cls(header['host'], header['taken'], header['interfaces'],
+                   header['counters'], values)
+
+
+class BaselineStore(object):
+
+    """ A directory of counter snapshots, one file per device. """
+
+    def __init__(self, directory):
+        """ Initialize the store, creating the directory if needed.
+
+        @param directory: Where the snapshots are kept.
+        @type directory: str
+        """
+        self.directory = directory
+        try:
+            os.makedirs(directory)
+        except OSError:  # already exists
+            pass
+
+    def path(self, host):
+        """ The snapshot file of a device. """
+        return path.join(self.directory,
+                         re.sub(r'[^\w.-]', '_', host) + '.counters')
+
+    def load(self, host):
+        """ Return the snapshot of a device, or None if there isn't one.
+
+        @param host: The device.
+        @type host: str
+
+        @returns: The last saved snapshot.
+        @rtype: CounterSnapshot
+        """
+        try:
+            with open(self.path(host), 'rb') as snapshot:
+                return CounterSnapshot.loads(snapshot.read())
+        except IOError:
+            return None
+
+    def save(self, snapshot):
+        """ Save the snapshot of a device, replacing the previous one.
+
+        @param snapshot: The snapshot.
+        @type snapshot: CounterSnapshot
+
+        @returns: None
+        """
+        filename = self.path(snapshot.host)
+        # write a new file and move it in place, so that an interrupted
+        # run never leaves a truncated baseline behind.
+        handle, temporary = tempfile.mkstemp(dir=self.directory,
+                                             suffix='.tmp')
+        with os.fdopen(handle, 'wb') as out:
+            out.write(snapshot.dumps())
+        try:
+            os.rename(temporary, filename)
+        except OSError:  # Windows doesn't replace existing files
+            os.remove(filename)
+            os.rename(temporary, filename)
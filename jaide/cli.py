@@ -14,13 +14,24 @@ https://github.com/NetworkAutomation/jaide
 """
 from __future__ import print_function
 # standard modules
-import os
-from os import path, popen
-import multiprocessing
+import copy
 import re
 import sys
+import time
 # intra-Jaide imports
 import wrap
+from analytics import METRICS, FleetAggregator
+import daemon as broker
+from repl import FleetShell
+from playbook import Playbook, PlaybookError
+from executor import BACKENDS, Executor
+import pipeline
+from progress import ProgressMonitor
+from result import DeviceResult
+from writer import MODES, OutputWriter
+from formats import FORMATS, Formatter
+from profiling import Profile, run_profiled
+from timing import FleetTimings
 from utils import clean_lines
 from color_utils import color
 # non-standard modules:
@@ -30,6 +41,14 @@ import click
 
 # needed for '-h' to be a help option
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+# the commands that don't work on devices, which aren't prompted for.
+DEVICELESS = ['daemon']
+# the wrap functions with a structured variant, for the jsonl/csv formats.
+STRUCTURED = {
+    wrap.device_info: wrap.device_info_data,
+    wrap.health_check: wrap.health_check_data,
+    wrap.interface_errors: wrap.interface_errors_data
+}
 
 
 class AliasedGroup(click.Group):
@@ -50,6 +69,34 @@ class AliasedGroup(click.Group):
         ctx.fail('Command ambiguous, could be: %s' %
                  ', '.join(sorted(matches)))
 
+    def parse_args(self, ctx, args):
+        """ Don't prompt for devices for commands that don't use them. """
+        command = None
+        try:
+            # the options of the group end where the command starts.
+            _, rest, _ = self.make_parser(ctx).parse_args(args=list(args))
+        except click.UsageError:
+            rest = []
+        if rest:
+            command = click.Group.get_command(self, ctx, rest[0])
+            if command is None:
+                matches = [name for name in self.list_commands(ctx)
+                           if name.startswith(rest[0])]
+                if len(matches) == 1:
+                    command = click.Group.get_command(self, ctx, matches[0])
+        if command is None or command.name not in DEVICELESS:
+            return click.Group.parse_args(self, ctx, args)
+        params = self.params
+        self.params = []
+        for param in params:
+            param = copy.copy(param)
+            param.prompt = None
+            self.params.append(param)
+        try:
+            return click.Group.parse_args(self, ctx, args)
+        finally:
+            self.params = params
+
 
 def at_time_validate(ctx, param, value):
     """ Callback validating the at_time commit option.
@@ -87,14 +134,79 @@ def at_time_validate(ctx, param, value):
 
 
 @click.pass_context
+def fpcs_validate(ctx, param, value):
+    """ Validate the --fpcs option of the errors command.
+
+    @param ctx: The click context paramter. Callback functions such as this
+              | one receive it automatically.
+    @type ctx: click.Context
+    @param param: param is passed into a validation callback function by click.
+                | We do not use it.
+    @type param: None
+    @param value: The value that the user supplied, such as '0-3,5'.
+    @type value: str
+
+    @returns: The FPC slot numbers, in order and without duplicates, or None
+            | if the option wasn't used. Otherwise, raises
+            | click.BadParameter
+    @rtype: list
+    """
+    if not value:
+        return None
+    slots = set()
+    try:
+        for part in value.split(','):
+            first, _, last = part.strip().partition('-')
+            slots.update(range(int(first), int(last or first) + 1))
+    except ValueError:
+        raise click.BadParameter('Expecting FPC slot numbers or ranges '
+                                 'separated by commas, such as 0-3,5.')
+    if not slots:
+        raise click.BadParameter('The FPC ranges must not be empty.')
+    return sorted(slots)
+
+
+def threshold_validate(ctx, param, value):
+    """ Validate the --threshold option of the health and errors commands.
+
+    @param ctx: The click context paramter. Callback functions such as this
+              | one receive it automatically.
+    @type ctx: click.Context
+    @param param: param is passed into a validation callback function by click.
+                | We do not use it.
+    @type param: None
+    @param value: The values that the user supplied, such as
+                | ('cpu_utilization=80',).
+    @type value: tuple
+
+    @returns: The threshold of each metric. Otherwise, raises
+            | click.BadParameter
+    @rtype: dict
+    """
+    metrics = METRICS[ctx.command.name]
+    thresholds = {}
+    for threshold in value:
+        name, _, limit = threshold.partition('=')
+        if name.strip() not in metrics:
+            raise click.BadParameter('Unknown metric %r, expecting one of: %s'
+                                     % (name.strip(), ', '.join(metrics)))
+        try:
+            thresholds[name.strip()] = float(limit)
+        except ValueError:
+            raise click.BadParameter('Expecting METRIC=NUMBER, such as '
+                                     '%s=80.' % list(metrics)[0])
+    return thresholds
+
+
 def write_validate(ctx, param, value):
     """ Validate the -w option.
 
     Purpose: Validates the `-w`|`--write` option. Two arguments are expected.
            | The first is the mode, which must be in ['s', 'single', 'm',
-           |  'multiple']. The mode determins if we're writing to one file for
-           | all device output, or to a separate file for each device being
-           | handled.
+           |  'multiple', 't', 'tar', 'z', 'zip']. The mode determins if
+           | we're writing to one file for all device output, to a separate
+           | file for each device being handled, or to a separate member of
+           | one tar or zip archive for each device.
            |
            | The second expected argument is the filepath of the desired
            | output file. This will automatically be prepended with the IP or
@@ -120,15 +232,17 @@ def write_validate(ctx, param, value):
             mode, dest_file = (value[0], value[1])
         except IndexError:
             raise click.BadParameter('Expecting two arguments, one for how to '
-                                     'output (s, single, m, multiple), and '
-                                     'the second is a filepath where to put'
-                                     ' the output.')
-        if mode.lower() not in ['s', 'single', 'm', 'multiple']:
+                                     'output (s, single, m, multiple, tar, '
+                                     'zip), and the second is a filepath '
+                                     'where to put the output.')
+        if mode.lower() not in MODES:
             raise click.BadParameter('The first argument of the -w/--write '
                                      'option must specifies whether to write'
                                      ' to one file per device, or all device'
-                                     ' output to a single file. Valid options'
-                                     ' are "s", "single", "m", and "multiple"')
+                                     ' output to a single file, or to an '
+                                     'archive. Valid options are "s", '
+                                     '"single", "m", "multiple", "tar", and '
+                                     '"zip"')
         # we've passed the checks, so set the 'out' context variable to our
         # tuple of the mode, and the destination file.
         ctx.obj['out'] = (mode.lower(), dest_file)
@@ -136,53 +250,176 @@ def write_validate(ctx, param, value):
         ctx.obj['out'] = None
 
 
-def write_out(input):
+def write_out(input, writer=None, formatter=None):
     """ Callback function to write the output from the script.
 
     @param input: A tuple containing two things:
-                | 1. None or Tuple of file mode and destination filepath
-                | 2. The output of the jaide command that will be either
-                |    written to sys.stdout or to a file, depending on the
-                |    first index in the tuple.
+                | 1. None, "quiet", or Tuple of file mode and destination
+                |    filepath
+                | 2. The jaide.result.DeviceResult of the jaide command,
+                |    that will be rendered and either written to
+                |    sys.stdout or to a file, depending on the first index
+                |    in the tuple.
                 |
                 | If the first index of the tuple *is not* another tuple,
                 | the output will be written to sys.stdout. If the first
-                | index *is* a tuple, that tuple is further broken down
-                | into the mode ('single' for single file or 'multiple'
-                | for one file for each IP), and the destination filepath.
+                | index *is* a tuple, the result is handed to the writer.
     @type input: tuple
+    @param writer: The OutputWriter for the file mode and destination
+                 | filepath of the -w option. If it isn't given, one is
+                 | created and closed for this result alone.
+    @type writer: jaide.writer.OutputWriter
+    @param formatter: Renders the result for the --format option. The
+                    | result is rendered as text if it isn't given.
+    @type formatter: jaide.formats.Formatter
 
     @returns: None
     """
-    # peel off the to_file metadata from the output.
-    to_file, output = input
-    if to_file != "quiet":
-        try:
-            # split the to_file metadata into it's separate parts.
-            mode, dest_file = to_file
-        except TypeError:
-            # just dump the output if we had an internal problem with getting
-            # the metadata.
-            click.echo(output)
+    # peel off the to_file metadata from the result.
+    to_file, result = input
+    if to_file == "quiet":
+        return
+    try:
+        # split the to_file metadata into it's separate parts.
+        mode, dest_file = to_file
+    except TypeError:
+        # just dump the output if we had an internal problem with getting
+        # the metadata.
+        if formatter is None or formatter.format == 'text':
+            for chunk in result.chunks():
+                click.echo(chunk, nl=False)
+            click.echo()
         else:
-            ip = output.split('device: ')[1].split('\n')[0].strip()
-            if mode in ['m', 'multiple']:
-                # put the IP in front of the filename if we're writing each
-                # device to its own file.
-                dest_file = path.join(path.split(dest_file)[0], ip + "_" +
-                                      path.split(dest_file)[1])
-            try:
-                out_file = open(dest_file, 'a+b')
-            except IOError as e:
-                print(color("Could not open output file '%s' for writing. "
-                            "Output would have been:\n%s" %
-                            (dest_file, output), 'red'))
-                print(color('Here is the error for opening the output file:' +
-                            str(e), 'red'))
-            else:
-                click.echo(output, nl=False, file=out_file)
-                print(color('%s output appended to: %s' % (ip, dest_file)))
-                out_file.close()
+            click.echo(formatter.format_result(result), nl=False)
+    else:
+        if writer is not None:
+            writer.write(result)
+        else:
+            writer = OutputWriter(mode, dest_file, formatter=formatter)
+            writer.write(result)
+            writer.close()
+
+
+def run_jobs(ctx, function, args, progress=False, aggregator=None):
+    """ Run a jaide.wrap function against every device.
+
+    Purpose: Opens a connection to each host in the context on the
+           | executor chosen with the --backend and --workers options, and
+           | runs the wrap function on it. For the jsonl and csv --format
+           | options, the structured variant of the wrap function is used
+           | where there is one. Each result is handed to
+           | write_out() as soon as that device completes, so fast devices
+           | aren't held back by slow ones. Devices that overrun the
+           | --device-timeout or --job-timeout deadlines are reported as
+           | they are given up on, and listed once more at the end.
+           | With an aggregator, the structured data of every device is
+           | added to it, and its summary is shown at the end. With the
+           | --broker option, each device job is run by the jaide daemon
+           | on its pooled sessions, except SCP transfers showing their
+           | progress, which can't be reported back from the daemon.
+
+    @param ctx: The click context paramter, for receiving the object dictionary
+              | being manipulated by other previous functions.
+    @type ctx: click.Context
+    @param function: The downstream jaide.wrap function to run on each
+                   | device.
+    @type function: function
+    @param args: The arguments for the wrap function, after the Jaide object.
+    @type args: list
+    @param progress: Set to True for SCP commands that should show the
+                   | aggregated transfer progress. The progress queue is
+                   | appended to args for the wrap function.
+    @type progress: bool
+    @param aggregator: A fleet aggregator to add the structured data of
+                     | each device to. In the text format, the wrap
+                     | function is asked for its data with its with_data
+                     | argument, which is appended to args.
+    @type aggregator: jaide.analytics.FleetAggregator
+
+    @returns: None
+    """
+    use_broker = ctx.obj['broker'] is not None and not progress
+    if use_broker:
+        try:
+            broker.status(ctx.obj['broker'])
+        except broker.UnsafeSocketError as e:
+            raise click.ClickException(str(e))
+        except broker.BrokerError:
+            raise click.ClickException("No jaide daemon is listening on %s. "
+                                       "Start one with 'jaide daemon'." %
+                                       ctx.obj['broker'])
+    if ctx.obj['format'] != 'text':
+        function = STRUCTURED.get(function, function)
+    elif aggregator is not None:
+        args = list(args) + [True]
+    formatter = Formatter(ctx.obj['format'], ctx.info_name, ctx.params)
+    hosts = [ip.strip() for ip in ctx.obj['hosts']]
+    executor = Executor(ctx.obj['backend'], ctx.obj['workers'],
+                        jobs=len(hosts))
+    monitor = None
+    if progress:
+        callback = (lambda summary: None) if ctx.obj['out'] == "quiet" else None
+        monitor = ProgressMonitor(hosts, queue=executor.queue(),
+                                  callback=callback).start()
+        args = list(args) + [monitor.queue]
+    writer = None
+    if isinstance(ctx.obj['out'], tuple):
+        writer = OutputWriter(*ctx.obj['out'], formatter=formatter).start()
+    elif ctx.obj['out'] != "quiet" and formatter.header():
+        click.echo(formatter.header(), nl=False)
+
+    fleet = FleetTimings() if ctx.obj['timings'] else None
+
+    def finished(result):
+        """ Write out a device that completed. """
+        if fleet is not None:
+            fleet.add(result[1])
+        if aggregator is not None:
+            aggregator.add_result(result[1])
+        write_out(result, writer, formatter)
+
+    def failed(ip, reason, message, error_class):
+        """ Write out a device that errored, timed out or was cancelled. """
+        finished((ctx.obj['out'], DeviceResult(ip).fail(
+            'Device %s %s' % (ip, message), error_class, status=reason)))
+
+    jobs = [(ip, (ip, ctx.obj['conn']['username'], ctx.obj['conn']['password'],
+                  function, args, ctx.obj['out'],
+                  ctx.obj['conn']['connect_timeout'],
+                  ctx.obj['conn']['session_timeout'], ctx.obj['conn']['port']))
+            for ip in hosts]
+    if ctx.obj.get('pool') is not None:
+        # the open sessions of 'jaide repl'.
+        jobs = [(ip, job + (ctx.obj['pool'],)) for ip, job in jobs]
+    job_function = wrap.open_connection
+    if use_broker:
+        job_function = broker.broker_connection
+        jobs = [(ip, (ctx.obj['broker'],) + job) for ip, job in jobs]
+    profile = None
+    if ctx.obj['profile']:
+        profile = Profile(ctx.obj['profile'], ctx.info_name).start()
+        jobs = [(ip, (ctx.obj['profile'], ip, job_function) + job)
+                for ip, job in jobs]
+        job_function = run_profiled
+    stragglers = executor.run(job_function, jobs, finished, on_failure=failed,
+                              device_timeout=ctx.obj['device_timeout'],
+                              job_timeout=ctx.obj['job_timeout'])
+    if monitor:
+        monitor.stop()
+    if writer:
+        writer.close()
+    if fleet is not None:
+        click.echo(fleet.render(), nl=False, err=True)
+    if aggregator is not None:
+        click.echo(aggregator.render(), nl=False, err=True)
+    if profile is not None:
+        click.echo('Profile written to: %s' % ', '.join(profile.stop()),
+                   err=True)
+    if stragglers and ctx.obj['out'] != "quiet":
+        click.echo(color('%d of %d devices did not complete: %s' %
+                         (len(stragglers), len(hosts),
+                          ', '.join(ip for ip, _ in stragglers)), 'red'),
+                   err=True)
 
 
 @click.group(cls=AliasedGroup, context_settings=CONTEXT_SETTINGS,
@@ -190,7 +427,9 @@ def write_out(input):
              "one or more Junos devices, and manipulate them based on the "
              "command you have chosen. If a comma separated list or a file "
              "containing IP/hostnames on each line is given for the IP option,"
-             " the commands will be sent simultaneously to each device.")
+             " the commands will be sent simultaneously to each device.\n\n"
+             "'jaide daemon' keeps sessions open for runs with --broker, see "
+             "'jaide daemon --help'.")
 @click.option('-i', '--ip', 'host', prompt="IP or hostname of Junos device",
               help="The target hostname(s) or IP(s). Can be a comma separated"
               " list, or path to a file listing devices on individual lines.")
@@ -210,17 +449,69 @@ def write_out(input):
               help="The timeout, in seconds, for declaring a device "
               "unreachable during connection establishment. Default is 5"
               " seconds.")
+@click.option('-W', '--workers', type=click.IntRange(1, 10000), help="The "
+              "number of devices to work on concurrently. Defaults to 64 for"
+              " the thread backend, and twice the number of CPUs for the "
+              "process backend.")
+@click.option('--backend', type=click.Choice(BACKENDS), default='thread',
+              help="Run the device sessions in a pool of threads (cheap, "
+              "suits network bound work on many devices) or a pool of "
+              "processes (for CPU heavy work such as large xpath filtering)."
+              " Defaults to thread.")
+@click.option('--parse-workers', type=click.IntRange(0, 256), default=0,
+              metavar='N', help="Parse and filter the replies in N worker "
+              "processes, so that xpath filtering and configuration diffs "
+              "use more than one CPU while the thread backend waits on the "
+              "devices. Defaults to 0, parsing in the device threads.")
+@click.option('--device-timeout', type=click.IntRange(1, 86400), help="The"
+              " wall-clock deadline, in seconds, for all of the work on a "
+              "single device. Devices exceeding it are reported and no "
+              "longer waited for. No deadline by default.")
+@click.option('--job-timeout', type=click.IntRange(1, 86400), help="The "
+              "wall-clock deadline, in seconds, for the whole run. Devices "
+              "still running or waiting when it passes are reported as "
+              "cancelled. No deadline by default.")
+@click.option('--format', 'output_format', type=click.Choice(FORMATS),
+              default='text', help="The output format. 'jsonl' prints one "
+              "JSON object per device and 'csv' one row per device, as each "
+              "device completes, with the host, command, status, timings and"
+              " output. The info, health and errors commands provide "
+              "structured data instead of output. Defaults to text.")
+@click.option('--timings/--no-timings', default=False, help="Print a "
+              "summary of where the time went at the end of the run: the "
+              "50th, 90th and 99th percentile and maximum seconds across the"
+              " devices for each phase (dns, tcp, ssh_auth, netconf_session,"
+              " cli_session, rpc, parse, transfer), with the bytes moved.")
+@click.option('--profile', type=click.Path(file_okay=False, writable=True,
+              resolve_path=True), help="Profile the run, writing the merged"
+              " cProfile statistics of the parent and every device job to "
+              "DIR/COMMAND.pstats, the top functions to "
+              "DIR/COMMAND-profile.txt, and a memory report to "
+              "DIR/COMMAND-memory.txt.", metavar="DIR")
+@click.option('--broker/--no-broker', default=False, envvar='JAIDE_BROKER',
+              help="Run the device jobs in the jaide daemon, reusing the "
+              "sessions it keeps open from earlier runs instead of "
+              "connecting again. Start it with 'jaide daemon'. Can be set "
+              "with the JAIDE_BROKER environment variable. Defaults to "
+              "--no-broker.")
+@click.option('--broker-socket', default=broker.DEFAULT_SOCKET,
+              envvar='JAIDE_BROKER_SOCKET', type=click.Path(dir_okay=False),
+              help="The socket of the jaide daemon for --broker. Defaults to"
+              " %s." % broker.DEFAULT_SOCKET)
 @click.version_option(version='2.0.0', prog_name='jaide')
 @click.option('-w', '--write', nargs=2, type=click.STRING, expose_value=False,
               callback=write_validate, help="Write the output to a file "
               "instead of echoing it to the terminal. This can be useful "
               "when touching more than one device, because the output can be "
               "split into a file per device. In this case, output filename "
-              "format is IP_FILENAME.", metavar="[s | single | m | multiple]"
+              "format is IP_FILENAME. The tar and zip modes write the output "
+              "of each device as IP_FILENAME.txt inside a single archive at "
+              "FILEPATH.", metavar="[s | single | m | multiple | tar | zip]"
               " FILEPATH", default=("default", "default"))
 @click.pass_context
 def main(ctx, host, password, port, quiet, session_timeout, connect_timeout,
-         username):
+         username, workers, backend, parse_workers, device_timeout,
+         job_timeout, output_format, timings, profile, broker, broker_socket):
     """ Manipulate one or more Junos devices.
 
     Purpose: The main function is the entry point for the jaide tool. Click
@@ -252,11 +543,39 @@ def main(ctx, host, password, port, quiet, session_timeout, connect_timeout,
     @type connect_timeout: int
     @param username: The string username used to connect to the device.
     @type useranme: str
+    @param workers: The number of devices to work on concurrently. None for
+                  | the backend default.
+    @type workers: int
+    @param backend: The executor backend, 'thread' or 'process'.
+    @type backend: str
+    @param parse_workers: The number of processes to parse replies in, or
+                        | 0 to parse them in the device threads.
+    @type parse_workers: int
+    @param device_timeout: The wall-clock deadline in seconds for each
+                         | device, or None.
+    @type device_timeout: int
+    @param job_timeout: The wall-clock deadline in seconds for the whole
+                      | run, or None.
+    @type job_timeout: int
+    @param output_format: The output format, one of jaide.formats.FORMATS.
+    @type output_format: str
+    @param timings: Set to True to print the per-phase timing summary at
+                  | the end of the run.
+    @type timings: bool
+    @param profile: The directory to write the profiling reports to, or
+                  | None to not profile.
+    @type profile: str
+    @param broker: Set to True to run the device jobs in the jaide daemon.
+    @type broker: bool
+    @param broker_socket: The socket of the jaide daemon.
+    @type broker_socket: str
 
     @returns: None. Functions part of click relating to the command group
             | 'main' do not return anything. Click handles passing context
             | between the functions and maintaing command order and chaining.
     """
+    if host is None:  # a command in DEVICELESS
+        return
     # build the list of hosts
     ctx.obj['hosts'] = [ip for ip in clean_lines(host)]
     # set the connection parameters
@@ -267,8 +586,22 @@ def main(ctx, host, password, port, quiet, session_timeout, connect_timeout,
         "session_timeout": session_timeout,
         "connect_timeout": connect_timeout
     }
+    ctx.obj['workers'] = workers
+    ctx.obj['backend'] = backend
+    ctx.obj['device_timeout'] = device_timeout
+    ctx.obj['job_timeout'] = job_timeout
+    ctx.obj['format'] = output_format
+    ctx.obj['timings'] = timings
+    ctx.obj['profile'] = profile
+    ctx.obj['broker'] = broker_socket if broker else None
     if quiet:
         ctx.obj['out'] = "quiet"
+    # the process backend parses in its own workers, and the daemon parses
+    # the jobs it is given.
+    if parse_workers and backend == 'thread' and not broker:
+        # forked here, before any thread is started.
+        pipeline.start(parse_workers)
+        ctx.call_on_close(pipeline.stop)
 
 
 @main.command(context_settings=CONTEXT_SETTINGS, help="Execute a commit "
@@ -350,20 +683,8 @@ def commit(ctx, commands, blank, check, sync, comment, confirm, at_time):
     if not blank and commands == 'annotate system ""':
         raise click.BadParameter("--blank and the commands argument cannot"
                                  " both be omitted.")
-    mp_pool = multiprocessing.Pool(multiprocessing.cpu_count() * 2)
-    for ip in ctx.obj['hosts']:
-        mp_pool.apply_async(wrap.open_connection, args=(ip,
-                            ctx.obj['conn']['username'],
-                            ctx.obj['conn']['password'],
-                            wrap.commit,
-                            [commands, check, sync, comment, confirm,
-                             ctx.obj['at_time'], blank],
-                            ctx.obj['out'],
-                            ctx.obj['conn']['connect_timeout'],
-                            ctx.obj['conn']['session_timeout'],
-                            ctx.obj['conn']['port']), callback=write_out)
-    mp_pool.close()
-    mp_pool.join()
+    run_jobs(ctx, wrap.commit, [commands, check, sync, comment, confirm,
+                                ctx.obj['at_time'], blank])
 
 
 @main.command(context_settings=CONTEXT_SETTINGS, help="Compare commands"
@@ -394,18 +715,7 @@ def compare(ctx, commands):
             | 'main' do not return anything. Click handles passing context
             | between the functions and maintaing command order and chaining.
     """
-    mp_pool = multiprocessing.Pool(multiprocessing.cpu_count() * 2)
-    for ip in ctx.obj['hosts']:
-        mp_pool.apply_async(wrap.open_connection, args=(ip,
-                            ctx.obj['conn']['username'],
-                            ctx.obj['conn']['password'],
-                            wrap.compare, [commands],
-                            ctx.obj['out'],
-                            ctx.obj['conn']['connect_timeout'],
-                            ctx.obj['conn']['session_timeout'],
-                            ctx.obj['conn']['port']), callback=write_out)
-    mp_pool.close()
-    mp_pool.join()
+    run_jobs(ctx, wrap.compare, [commands])
 
 
 @main.command(context_settings=CONTEXT_SETTINGS, help="Copy file(s) from "
@@ -415,8 +725,8 @@ def compare(ctx, commands):
 @click.argument('source', type=click.Path())
 @click.argument('destination', type=click.Path(resolve_path=True))
 @click.option('--progress/--no-progress', default=False, help="Flag to show "
-              "progress as the transfer happens. Defaults to False for "
-              "multiple devices, as output will be jumbled.")
+              "progress as the transfer happens. Progress from all devices "
+              "is combined into a single status line. Defaults to False.")
 @click.pass_context
 def pull(ctx, source, destination, progress):
     """ Copy file(s) from device(s) -> local machine.
@@ -429,28 +739,17 @@ def pull(ctx, source, destination, progress):
     @type source: str
     @param destination: the destination filepath or dirpath
     @type destination: str
-    @param progress: bool set to True if we should request a progress callback
-                   | from the Jaide object. Always set to False when
-                   | we're copying to/from multiple devices.
+    @param progress: bool set to True if we should show the aggregated
+                   | progress of the transfers from all devices.
     @type progress: bool
 
     @returns: None. Functions part of click relating to the command group
             | 'main' do not return anything. Click handles passing context
             | between the functions and maintaing command order and chaining.
     """
-    mp_pool = multiprocessing.Pool(multiprocessing.cpu_count() * 2)
     multi = True if len(ctx.obj['hosts']) > 1 else False
-    for ip in ctx.obj['hosts']:
-        mp_pool.apply_async(wrap.open_connection, args=(ip,
-                            ctx.obj['conn']['username'],
-                            ctx.obj['conn']['password'],
-                            wrap.pull, [source, destination, progress, multi],
-                            ctx.obj['out'],
-                            ctx.obj['conn']['connect_timeout'],
-                            ctx.obj['conn']['session_timeout'],
-                            ctx.obj['conn']['port']), callback=write_out)
-    mp_pool.close()
-    mp_pool.join()
+    run_jobs(ctx, wrap.pull, [source, destination, progress, multi],
+             progress=progress)
 
 
 @main.command(context_settings=CONTEXT_SETTINGS, help="Copy file(s) from "
@@ -460,8 +759,8 @@ def pull(ctx, source, destination, progress):
 @click.argument('source', type=click.Path(exists=True, resolve_path=True))
 @click.argument('destination', type=click.Path())
 @click.option('--progress/--no-progress', default=False, help="Flag to show "
-              "progress as the transfer happens. Defaults to False for "
-              "multiple devices, as output would be jumbled.")
+              "progress as the transfer happens. Progress from all devices "
+              "is combined into a single status line. Defaults to False.")
 @click.pass_context
 def push(ctx, source, destination, progress):
     """ Copy file(s) from local machine -> device(s).
@@ -474,27 +773,16 @@ def push(ctx, source, destination, progress):
     @type source: str
     @param destination: the destination filepath or dirpath
     @type destination: str
-    @param progress: bool set to True if we should request a progress callback
-                   | from the Jaide object. Always set to False when
-                   | we're copying to/from multiple devices.
+    @param progress: bool set to True if we should show the aggregated
+                   | progress of the transfers from all devices.
     @type progress: bool
 
     @returns: None. Functions part of click relating to the command group
             | 'main' do not return anything. Click handles passing context
             | between the functions and maintaing command order and chaining.
     """
-    mp_pool = multiprocessing.Pool(multiprocessing.cpu_count() * 2)
-    for ip in ctx.obj['hosts']:
-        mp_pool.apply_async(wrap.open_connection, args=(ip,
-                            ctx.obj['conn']['username'],
-                            ctx.obj['conn']['password'],
-                            wrap.push, [source, destination, progress],
-                            ctx.obj['out'],
-                            ctx.obj['conn']['connect_timeout'],
-                            ctx.obj['conn']['session_timeout'],
-                            ctx.obj['conn']['port']), callback=write_out)
-    mp_pool.close()
-    mp_pool.join()
+    run_jobs(ctx, wrap.push, [source, destination, progress, False],
+             progress=progress)
 
 
 @main.command(context_settings=CONTEXT_SETTINGS, help="Execute operational "
@@ -507,8 +795,23 @@ def push(ctx, source, destination, progress):
 @click.option('-x', '--xpath', required=False, help="An xpath expression"
               " that will filter the results. Forces response format xml."
               " Example: '//rt-entry'")
+@click.option('--batch/--no-batch', default=False, help="Send all of the "
+              "commands over one CLI session per device, instead of a new "
+              "SSH channel and CLI process per command. Faster for many "
+              "commands. Defaults to --no-batch.")
+@click.option('--parallel', type=click.IntRange(1, 64), default=1,
+              metavar='N', help="Run up to N of the commands at the same time"
+              " on each device, over separate channels of its SSH "
+              "connection. The output stays in the order of the commands. "
+              "Junos allows 10 channels per connection unless 'system "
+              "services ssh max-sessions-per-connection' is raised. Defaults"
+              " to 1.")
+@click.option('--spool-size', type=click.IntRange(1, 65536), default=16,
+              metavar='MB', help="Keep replies in memory up to this many "
+              "megabytes, and read larger ones into temporary files. "
+              "Defaults to 16.")
 @click.pass_context
-def operational(ctx, commands, format, xpath):
+def operational(ctx, commands, format, xpath, batch, parallel, spool_size):
     """ Execute operational mode command(s).
 
     This function will send operational mode commands to a Junos
@@ -535,23 +838,24 @@ def operational(ctx, commands, format, xpath):
     @param xpath: An xpath expression on which we should filter the results.
                 | This enforces 'xml' for the format of the response.
     @type xpath: str
+    @param batch: Set to True to send the commands over one CLI session.
+    @type batch: bool
+    @param parallel: The most commands to run at the same time per device.
+    @type parallel: int
+    @param spool_size: The size in megabytes past which a reply is read
+                     | into a temporary file.
+    @type spool_size: int
 
     @returns: None. Functions part of click relating to the command group
             | 'main' do not return anything. Click handles passing context
             | between the functions and maintaing command order and chaining.
     """
-    mp_pool = multiprocessing.Pool(multiprocessing.cpu_count() * 2)
-    for ip in ctx.obj['hosts']:
-        mp_pool.apply_async(wrap.open_connection, args=(ip,
-                            ctx.obj['conn']['username'],
-                            ctx.obj['conn']['password'],
-                            wrap.command, [commands, format, xpath],
-                            ctx.obj['out'],
-                            ctx.obj['conn']['connect_timeout'],
-                            ctx.obj['conn']['session_timeout'],
-                            ctx.obj['conn']['port']), callback=write_out)
-    mp_pool.close()
-    mp_pool.join()
+    if batch and parallel > 1:
+        raise click.BadParameter("--batch sends the commands one after the "
+                                 "other, it can't be used with --parallel.",
+                                 param_hint="'--parallel'")
+    run_jobs(ctx, wrap.command, [commands, format, xpath, batch, parallel,
+                                 spool_size << 20])
 
 
 @main.command(name='info', context_settings=CONTEXT_SETTINGS, help="Get basic"
@@ -565,18 +869,7 @@ def device_info(ctx):
               | function with the @click.pass_context decorator.
     @type ctx: click.Context
     """
-    mp_pool = multiprocessing.Pool(multiprocessing.cpu_count() * 2)
-    for ip in ctx.obj['hosts']:
-        mp_pool.apply_async(wrap.open_connection, args=(ip,
-                            ctx.obj['conn']['username'],
-                            ctx.obj['conn']['password'],
-                            wrap.device_info, [],
-                            ctx.obj['out'],
-                            ctx.obj['conn']['connect_timeout'],
-                            ctx.obj['conn']['session_timeout'],
-                            ctx.obj['conn']['port']), callback=write_out)
-    mp_pool.close()
-    mp_pool.join()
+    run_jobs(ctx, wrap.device_info, [])
 
 
 @main.command(context_settings=CONTEXT_SETTINGS, help="Compare the "
@@ -607,76 +900,101 @@ def diff_config(ctx, second_host, mode):
             | 'main' do not return anything. Click handles passing context
             | between the functions and maintaing command order and chaining.
     """
-    mp_pool = multiprocessing.Pool(multiprocessing.cpu_count() * 2)
-    for ip in ctx.obj['hosts']:
-        mp_pool.apply_async(wrap.open_connection, args=(ip,
-                            ctx.obj['conn']['username'],
-                            ctx.obj['conn']['password'],
-                            wrap.diff_config, [second_host, mode],
-                            ctx.obj['out'],
-                            ctx.obj['conn']['connect_timeout'],
-                            ctx.obj['conn']['session_timeout'],
-                            ctx.obj['conn']['port']), callback=write_out)
-    mp_pool.close()
-    mp_pool.join()
+    run_jobs(ctx, wrap.diff_config, [second_host, mode])
 
 
 @main.command(name="health", context_settings=CONTEXT_SETTINGS, help="Get "
               "alarm and device health information.")
+@click.option('--summary/--no-summary', default=False, help="Print a fleet "
+              "summary at the end of the run: the 50th, 90th and 99th "
+              "percentile and maximum of the CPU, memory, temperature, load "
+              "average, busiest process and alarms across the devices, and "
+              "the devices with the highest values.")
+@click.option('--top', type=click.IntRange(1, 1000), default=5, help="The "
+              "number of devices listed per metric in the summary. Defaults "
+              "to 5.")
+@click.option('--threshold', 'thresholds', multiple=True,
+              callback=threshold_validate, metavar='METRIC=VALUE', help="List"
+              " the devices over VALUE for METRIC in the summary, such as "
+              "cpu_utilization=80. Implies --summary. Can be given more than"
+              " once.")
 @click.pass_context
-def health_check(ctx):
+def health_check(ctx, summary, top, thresholds):
     """ Get alarm and device health information.
 
     @param ctx: The click context paramter, for receiving the object dictionary
               | being manipulated by other previous functions. Needed by any
               | function with the @click.pass_context decorator.
     @type ctx: click.Context
+    @param summary: Set to True to print the fleet summary.
+    @type summary: bool
+    @param top: The number of devices listed per metric in the summary.
+    @type top: int
+    @param thresholds: The threshold of each metric, for the summary.
+    @type thresholds: dict
 
     @returns: None. Functions part of click relating to the command group
             | 'main' do not return anything. Click handles passing context
             | between the functions and maintaing command order and chaining.
     """
-    mp_pool = multiprocessing.Pool(multiprocessing.cpu_count() * 2)
-    for ip in ctx.obj['hosts']:
-        mp_pool.apply_async(wrap.open_connection, args=(ip,
-                            ctx.obj['conn']['username'],
-                            ctx.obj['conn']['password'],
-                            wrap.health_check, [],
-                            ctx.obj['out'],
-                            ctx.obj['conn']['connect_timeout'],
-                            ctx.obj['conn']['session_timeout'],
-                            ctx.obj['conn']['port']), callback=write_out)
-    mp_pool.close()
-    mp_pool.join()
+    aggregator = None
+    if summary or thresholds:
+        aggregator = FleetAggregator(METRICS['health'], thresholds, top)
+    run_jobs(ctx, wrap.health_check, [], aggregator=aggregator)
 
 
 @main.command(name="errors", context_settings=CONTEXT_SETTINGS, help="Get any"
               " interface errors from the device.")
+@click.option('-b', '--baseline', type=click.Path(file_okay=False),
+              help="A directory to keep the error counters of each device "
+              "in. Each run then only shows the errors that are new since the"
+              " previous run with the same directory, with their rate per "
+              "second. The first run shows all errors.")
+@click.option('--fpcs', callback=fpcs_validate, help="Comma separated FPC "
+              "slot numbers or ranges, such as 0-3,5. The ge, fe, xe, so and "
+              "et interfaces are then requested one FPC at a time, keeping "
+              "each reply small.")
+@click.option('--summary/--no-summary', default=False, help="Print a fleet "
+              "summary at the end of the run: the 50th, 90th and 99th "
+              "percentile and maximum across the devices of the interfaces "
+              "and counters with errors and of the errors (with --baseline, "
+              "the new errors and their rate per second), and the devices "
+              "with the highest values.")
+@click.option('--top', type=click.IntRange(1, 1000), default=5, help="The "
+              "number of devices listed per metric in the summary. Defaults "
+              "to 5.")
+@click.option('--threshold', 'thresholds', multiple=True,
+              callback=threshold_validate, metavar='METRIC=VALUE', help="List"
+              " the devices over VALUE for METRIC in the summary, such as "
+              "errors=100. Implies --summary. Can be given more than once.")
 @click.pass_context
-def interface_errors(ctx):
+def interface_errors(ctx, baseline, fpcs, summary, top, thresholds):
     """ Get any interface errors from the device.
 
     @param ctx: The click context paramter, for receiving the object dictionary
               | being manipulated by other previous functions. Needed by any
               | function with the @click.pass_context decorator.
     @type ctx: click.Context
+    @param baseline: The directory of counter baselines, if any.
+    @type baseline: str
+    @param fpcs: The FPC slot numbers, if any.
+    @type fpcs: list
+    @param summary: Set to True to print the fleet summary.
+    @type summary: bool
+    @param top: The number of devices listed per metric in the summary.
+    @type top: int
+    @param thresholds: The threshold of each metric, for the summary.
+    @type thresholds: dict
 
     @returns: None. Functions part of click relating to the command group
             | 'main' do not return anything. Click handles passing context
             | between the functions and maintaing command order and chaining.
     """
-    mp_pool = multiprocessing.Pool(multiprocessing.cpu_count() * 2)
-    for ip in ctx.obj['hosts']:
-        mp_pool.apply_async(wrap.open_connection, args=(ip,
-                            ctx.obj['conn']['username'],
-                            ctx.obj['conn']['password'],
-                            wrap.interface_errors, [],
-                            ctx.obj['out'],
-                            ctx.obj['conn']['connect_timeout'],
-                            ctx.obj['conn']['session_timeout'],
-                            ctx.obj['conn']['port']), callback=write_out)
-    mp_pool.close()
-    mp_pool.join()
+    aggregator = None
+    if summary or thresholds:
+        aggregator = FleetAggregator(METRICS['errors'], thresholds, top)
+    run_jobs(ctx, wrap.interface_errors, [baseline, fpcs],
+             aggregator=aggregator)
 
 
 @main.command(context_settings=CONTEXT_SETTINGS, help="Send shell commands to "
@@ -684,8 +1002,13 @@ def interface_errors(ctx):
               "comma separate list, or a filepath to a file containing shell "
               "commands on each line.")
 @click.argument('commands', required=True)
+@click.option('--batch/--no-batch', default=True, help="Send all of the "
+              "commands to the shell at once, and split their output apart "
+              "at markers echoed after each of them. --no-batch sends them "
+              "one at a time, waiting a fixed time for each. Defaults to "
+              "--batch.")
 @click.pass_context
-def shell(ctx, commands):
+def shell(ctx, commands, batch):
     """ Send bash command(s) to the device(s).
 
     @param ctx: The click context paramter, for receiving the object dictionary
@@ -700,35 +1023,167 @@ def shell(ctx, commands):
                    |    4. A filepath of a file with shell commands on each
                    |         line.
     @type commands: str or list
+    @param batch: Set to False to send the commands one at a time.
+    @type batch: bool
+
+    @returns: None. Functions part of click relating to the command group
+            | 'main' do not return anything. Click handles passing context
+            | between the functions and maintaing command order and chaining.
+    """
+    run_jobs(ctx, wrap.shell, [commands, batch])
+
+
+@main.command(context_settings=CONTEXT_SETTINGS, help="Run the steps of a "
+              "playbook on each device.\n\nPLAYBOOK is a JSON file listing "
+              "steps such as compare, commit, operational, shell, health and "
+              "wait, each with the parameters of its command and an optional "
+              "condition. The steps are run in order on each device, over one"
+              " SSH and one NETCONF session per device, and a step that fails"
+              " skips the steps depending on it. See the playbook examples in"
+              " the documentation for the format.")
+@click.argument('book', metavar='PLAYBOOK', type=click.Path(exists=True,
+                dir_okay=False))
+@click.option('--check', is_flag=True, help="Run the commit steps as commit "
+              "checks, for a dry run that changes nothing.")
+@click.pass_context
+def playbook(ctx, book, check):
+    """ Run the steps of a playbook on each device.
+
+    @param ctx: The click context paramter, for receiving the object dictionary
+              | being manipulated by other previous functions. Needed by any
+              | function with the @click.pass_context decorator.
+    @type ctx: click.Context
+    @param book: The path of the JSON playbook file.
+    @type book: str
+    @param check: Set to True to run the commit steps as commit checks.
+    @type check: bool
+
+    @returns: None. Functions part of click relating to the command group
+            | 'main' do not return anything. Click handles passing context
+            | between the functions and maintaing command order and chaining.
+    """
+    try:
+        book = Playbook.load(book)
+    except PlaybookError as e:
+        raise click.BadParameter(str(e), param_hint='PLAYBOOK')
+    run_jobs(ctx, wrap.playbook, [book, check])
+
+
+@main.command(context_settings=CONTEXT_SETTINGS, help="Run jaide commands "
+              "interactively, over sessions kept open.\n\nConnects to the "
+              "devices once, then reads jaide commands at a prompt and runs "
+              "them on the selected devices, such as 'operational \"show "
+              "version\"' or just 'show version'. 'select' and 'exclude' "
+              "narrow the devices by name or glob pattern, and a line "
+              "starting with @PATTERN runs on the matching devices only. "
+              "'help' lists the commands.")
+@click.option('--connect/--no-connect', default=True, help="Connect to "
+              "every device when starting, rather than on their first "
+              "command. Defaults to --connect.")
+@click.pass_context
+def repl(ctx, connect):
+    """ Run jaide commands interactively, over sessions kept open.
+
+    @param ctx: The click context paramter, for receiving the object dictionary
+              | being manipulated by other previous functions. Needed by any
+              | function with the @click.pass_context decorator.
+    @type ctx: click.Context
+    @param connect: Set to True to connect to every device first.
+    @type connect: bool
 
     @returns: None. Functions part of click relating to the command group
             | 'main' do not return anything. Click handles passing context
             | between the functions and maintaing command order and chaining.
     """
-    mp_pool = multiprocessing.Pool(multiprocessing.cpu_count() * 2)
-    for ip in ctx.obj['hosts']:
-        mp_pool.apply_async(wrap.open_connection, args=(ip,
-                            ctx.obj['conn']['username'],
-                            ctx.obj['conn']['password'],
-                            wrap.shell, [commands],
-                            ctx.obj['out'],
-                            ctx.obj['conn']['connect_timeout'],
-                            ctx.obj['conn']['session_timeout'],
-                            ctx.obj['conn']['port']), callback=write_out)
-    mp_pool.close()
-    mp_pool.join()
+    if ctx.obj['backend'] == 'process':
+        click.echo('The repl shares its sessions between threads, ignoring '
+                   '--backend process.', err=True)
+    shell = FleetShell(ctx.parent.command, ctx.obj)
+    if connect:
+        shell.connect()
+    shell.cmdloop()
+
+
+@main.command(context_settings=CONTEXT_SETTINGS, help="Keep device "
+               "sessions open for other jaide runs.\n\nListens on a Unix "
+               "domain socket, and runs the device jobs of jaide runs given "
+               "the --broker option, keeping the sessions it opens for the "
+               "next runs against the same devices with the same "
+               "credentials. Runs until stopped with Ctrl-C or --stop.")
+@click.option('--socket', 'socket_path', default=broker.DEFAULT_SOCKET,
+              envvar='JAIDE_BROKER_SOCKET', type=click.Path(dir_okay=False),
+              help="The socket to listen on. Defaults to %s." %
+              broker.DEFAULT_SOCKET)
+@click.option('--idle-timeout', type=click.IntRange(1, 86400), default=300,
+              help="Close sessions that haven't been used for this many "
+              "seconds. Defaults to 300.")
+@click.option('--max-sessions', type=click.IntRange(1, 100000), default=1000,
+              help="The most idle sessions to keep open. Defaults to 1000.")
+@click.option('--status', 'show_status', is_flag=True, help="Show the "
+              "sessions of the running daemon, and exit.")
+@click.option('--stop', is_flag=True, help="Stop the running daemon, "
+              "closing its sessions.")
+@click.option('--parse-workers', type=click.IntRange(0, 256), default=0,
+              metavar='N', help="Parse and filter the replies of the jobs "
+              "in N worker processes. Defaults to 0, parsing in the job "
+              "threads.")
+def daemon(socket_path, idle_timeout, max_sessions, show_status, stop,
+           parse_workers):
+    """ Run the jaide session broker, or query or stop the running one.
+
+    @param socket_path: The path of the Unix domain socket.
+    @type socket_path: str
+    @param idle_timeout: The seconds an unused session is kept open.
+    @type idle_timeout: int
+    @param max_sessions: The most idle sessions kept open.
+    @type max_sessions: int
+    @param show_status: Set to True to show the status of the running
+                      | daemon instead.
+    @type show_status: bool
+    @param stop: Set to True to stop the running daemon instead.
+    @type stop: bool
+    @param parse_workers: The number of processes to parse replies in.
+    @type parse_workers: int
+
+    @returns: None
+    """
+    try:
+        if stop:
+            broker.stop(socket_path)
+            click.echo('Stopped the jaide daemon on %s' % socket_path)
+        elif show_status:
+            status = broker.status(socket_path)
+            click.echo('jaide daemon %d on %s, up %ds: %d idle sessions, %d '
+                       'reused, %d new, %d dropped, %d expired' % (
+                           status['pid'], socket_path,
+                           time.time() - status['started'], status['idle'],
+                           status['hits'], status['misses'], status['dead'],
+                           status['evicted']))
+            for session, count in sorted(status['sessions'].items()):
+                click.echo('  %s: %d' % (session, count))
+        else:
+            if parse_workers:
+                pipeline.start(parse_workers)
+            server = broker.BrokerServer(socket_path, idle_timeout,
+                                         max_sessions)
+            click.echo('jaide daemon listening on %s' % socket_path, err=True)
+            try:
+                server.serve()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                pipeline.stop()
+    except broker.BrokerError as e:
+        raise click.ClickException(str(e))
 
 
 def run():
-    if os.name == 'posix' and sys.stdin.isatty():
-        # set max_content_width to the width of the terminal dynamically
-        rows, columns = popen('stty size', 'r').read().split()
-        # obj and max_column_width get passed into click, and don't actually
-        # proceed into the main() command group. Click handles the CLI
-        # user options and passing them into main().
-        main(obj={}, max_content_width=int(columns))
-    else:
-        main(obj={})
+    # set max_content_width to the width of the terminal dynamically. click
+    # asks the terminal directly, rather than starting 'stty size'.
+    # obj and max_column_width get passed into click, and don't actually
+    # proceed into the main() command group. Click handles the CLI
+    # user options and passing them into main().
+    main(obj={}, max_content_width=click.get_terminal_size()[0])
 
 if __name__ == '__main__':
     run()
@@ -12,28 +12,183 @@ https://github.com/NetworkAutomation/jaide
 from __future__ import print_function
 # standard modules.
 from os import path
+import re
+import socket
+import threading
 import time
 import difflib
-# from lxml import etree, objectify
+import inspect
+import pipes
+import uuid
 # needed to parse strings into xml for cases when ncclient doesn't handle
 # it (commit, validate, etc)
 import xml.etree.ElementTree as ET
 import logging  # logging needed for disabling paramiko logging output
 # intra-Jaide imports
-from errors import InvalidCommandError
-from utils import clean_lines, xpath
-# network modules for device connections
-try:
-    from ncclient import manager
-    from scp import SCPClient
-    import paramiko
-except ImportError as e:
+from errors import InvalidCommandError, JaideError
+from pipeline import offload
+from spool import SPOOL_SIZE, SpoolBuffer
+from timing import Timings, reply_size
+from utils import LazyModule, clean_lines, etree, is_instance, xpath
+
+
+def _import_failed(name, error):
     print("FAILED TO IMPORT ONE OR MORE PACKAGES.\n"
           "NCCLIENT\thttps://github.com/leopoul/ncclient/\n"
           "PARAMIKO\thttps://github.com/paramiko/paramiko\n"
           "SCP\t\thttps://pypi.python.org/pypi/scp/0.8.0")
     print('\nImport Error:\n')
-    raise e
+
+
+# network modules for device connections. They are imported when the first
+# connection of their type is made, see jaide.utils.LazyModule.
+manager = LazyModule('ncclient.manager', _import_failed)
+paramiko = LazyModule('paramiko', _import_failed)
+scp = LazyModule('scp', _import_failed)
+
+# the interface types checked by interface_errors(), matched against the
+# start of the interface name.
+ERROR_INTERFACE_PREFIXES = ('ge', 'fe', 'ae', 'xe', 'so', 'et', 'vlan', 'lo0',
+                            'irb')
+# the prefixes above whose interfaces are numbered by FPC slot, and can be
+# fetched one FPC at a time.
+_SLOTTED_PREFIXES = ('ge', 'fe', 'xe', 'so', 'et')
+# the elements of 'show interfaces extensive' that interface_errors() reads.
+_INTERFACE_TAGS = ('physical-interface', 'logical-interface')
+_ERROR_WALK_TAGS = _INTERFACE_TAGS + ('name', 'admin-status', 'oper-status',
+                                      'input-error-list', 'output-error-list')
+# the numbers in the health_check() output, and its load averages.
+_NUMBER = re.compile(r'-?\d+(\.\d+)?')
+_LOAD_AVERAGE = re.compile(r'load averages?:\s*([\d.]+),?\s+([\d.]+),?\s+'
+                           r'([\d.]+)')
+_UNITS = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+# the terminal width asked for by op_batch(), so that the CLI doesn't wrap
+# long command lines or output.
+CLI_WIDTH = 1024
+# the line dual routing engine devices print before the CLI prompt.
+_RE_BANNER = re.compile(r'^\{[\w:-]+\}$')
+# the line endings of a terminal, which end a line with one or more carriage
+# returns and a newline.
+_LINE_END = re.compile(r'\r+\n')
+
+
+def significant_errors(counters):
+    """ Pick the significant error counters out of interface counters.
+
+    Purpose: A counter is significant when it is above zero, or above 50
+           | for carrier-transitions.
+
+    @param counters: The interface counters, as returned by
+                   | Jaide.interface_counters().
+    @type counters: list
+
+    @returns: A dictionary per significant counter, with the keys
+            | 'interface', 'status', 'direction', 'counter' and 'count'.
+    @rtype: list
+    """
+    output = []
+    for interface in counters:
+        for face in ('input', 'output'):
+            for counter, count in interface[face]:
+                if count > (50 if counter == 'carrier-transitions' else 0):
+                    output.append({'interface': interface['interface'],
+                                   'status': interface['status'],
+                                   'direction': face, 'counter': counter,
+                                   'count': count})
+    return output
+
+
+def describe_errors(errors):
+    """ Describe significant error counters, one line per counter.
+
+    @param errors: The errors, as returned by significant_errors().
+    @type errors: list
+
+    @returns: The description, or a line saying there are no errors.
+    @rtype: str
+    """
+    output = []  # used to store the list of interfaces with errors.
+    for error in errors:
+        if error['counter'] == 'carrier-transitions':
+            detail = " has greater than 50 flaps."
+        else:
+            detail = " has %s of %s." % (error['count'], error['counter'])
+        output.append("%s (%s)%s" % (error['interface'], error['status'],
+                                     detail))
+    if output == []:
+        output.append('No interface errors were detected on this device.')
+    return '\n'.join(output) + '\n'
+
+
+def describe_health(health):
+    """ Describe the health information of a device.
+
+    @param health: The health information, as returned by
+                 | Jaide.health_check_data().
+    @type health: dict
+
+    @returns: The alarms, the routing engine status and the top 5 processes.
+    @rtype: str
+    """
+    output = 'Chassis Alarms:\n\t'
+    if health['chassis_alarms'] == []:  # Chassis Alarms
+        output += 'No chassis alarms active.\n'
+    else:
+        for alarm in health['chassis_alarms']:
+            output += (alarm['class'] + ' Alarm \t\t' + alarm['time'] +
+                       '\n\t' + alarm['description'] + '\n')
+    output += '\nSystem Alarms: \n\t'
+    if health['system_alarms'] == []:  # System Alarms
+        output += 'No system alarms active.\n'
+    else:
+        for alarm in health['system_alarms']:
+            output += (alarm['class'] + ' Alarm \t\t' + alarm['time'] +
+                       '\n\t' + alarm['description'] + '\n')
+    # add the output of the show chassis routing-engine to the command.
+    output += '\n' + health['routing_engine']
+    # Grabs the top 5 processes and the header line.
+    output += ('\n\nTop 5 busiest processes (high mgd values likely from '
+               'script execution):\n')
+    for line in health['processes']:
+        output += line + '\n'
+    return output
+
+
+def _number(text):
+    """ Return the first number in a string, such as 16384 of '16384 MB'.
+
+    @returns: The number as an int, or a float if it has a decimal point,
+            | or None if there isn't one.
+    @rtype: int or float
+    """
+    found = _NUMBER.search(text or '')
+    if found is None:
+        return None
+    number = found.group()
+    return float(number) if '.' in number else int(number)
+
+
+def _bytes(text):
+    """ Return a size from the process table, such as '500M', in bytes. """
+    number = _number(text)
+    if number is None:
+        return None
+    return int(number * _UNITS.get(text.strip()[-1:].upper(), 1))
+
+
+def _first(*values):
+    """ Return the first of the values that isn't None. """
+    for value in values:
+        if value is not None:
+            return value
+    return None
+
+
+def _unified_diff(config1, config2, host1, host2):
+    """ Return the unified diff of two configurations, as a list of lines.
+    """
+    return list(difflib.unified_diff(config1.splitlines(),
+                                     config2.splitlines(), host1, host2))
 
 
 class Jaide():
@@ -87,8 +242,8 @@ class Jaide():
                         | connect parameter should be ignored.**
                         |
                         | The connection type that should be made. Several
-                        | options are available: 'ncclient', 'scp', and
-                        | 'paramiko', 'shell' and 'root'.
+                        | options are available: 'ncclient', 'scp',
+                        | 'paramiko' and 'shell'.
                         |
                         | 'paramiko' : is used for operational commands
                         | (couldn't use ncclient because of lack of pipes `|`
@@ -99,11 +254,6 @@ class Jaide():
                         |
                         | 'shell' : is for sending shell commands.
                         |
-                        | 'root' : is when the user is doing operational
-                        | commands, but is logged in as root, (requires
-                        | handling separately, since this puts the session
-                        | into a shell prompt)
-                        |
                         | 'ncclient' : is used for all other commands.
         @type connect: str
         @param port: The destination port on the device to attempt the
@@ -120,15 +270,49 @@ class Jaide():
         self.password = password
         self.session_timeout = session_timeout
         self.connect_timeout = connect_timeout
+        self._session = ""
         self._shell = ""
         self._scp = ""
+        # the interactive CLI channel of op_batch(), and its prompt.
+        self._cli = ""
+        self._cli_prompt = ""
         self.conn_type = connect
         self._in_cli = False
         self._filename = None
+        self._progress_time = 0
+        # per-phase timing spans, see jaide.timing.
+        self.timings = Timings(self.host)
+        # replies past this many bytes are read into a temporary file.
+        self.spool_size = SPOOL_SIZE
         # make the connection to the device
         if connect:
             self.connect()
 
+    def alive(self):
+        """ Check whether the current session to the device is still open.
+
+        Purpose: Used by the jaide daemon before it reuses a session. An
+               | SSH session is sent an SSH_MSG_IGNORE packet, which fails if
+               | the connection was dropped, without waiting for the device.
+               | A NETCONF session is alive as long as ncclient still has its
+               | transport open.
+
+        @returns: True if the session can be used.
+        @rtype: bool
+        """
+        if is_instance(self._session, manager, 'Manager'):
+            return self._session.connected
+        if is_instance(self._session, paramiko, 'SSHClient'):
+            transport = self._session.get_transport()
+            if transport is None or not transport.is_active():
+                return False
+            try:
+                transport.send_ignore()
+            except (EOFError, socket.error, paramiko.SSHException):
+                return False
+            return True
+        return False
+
     def check_instance(function):
         """ Wrapper that tests the type of _session.
 
@@ -150,47 +334,43 @@ class Jaide():
         """
         def wrapper(self, *args, **kwargs):
             func_trans = {
-                "commit": manager.Manager,
-                "compare_config": manager.Manager,
-                "commit_check": manager.Manager,
-                "device_info": manager.Manager,
-                "diff_config": manager.Manager,
-                "health_check": manager.Manager,
-                "interface_errors": manager.Manager,
-                "op_cmd": paramiko.client.SSHClient,
-                "shell_cmd": paramiko.client.SSHClient,
-                "scp_pull": paramiko.client.SSHClient,
-                "scp_push": paramiko.client.SSHClient
+                "commit": (manager, 'Manager'),
+                "compare_config": (manager, 'Manager'),
+                "commit_check": (manager, 'Manager'),
+                "device_info": (manager, 'Manager'),
+                "device_info_data": (manager, 'Manager'),
+                "diff_config": (manager, 'Manager'),
+                "health_check": (manager, 'Manager'),
+                "health_check_data": (manager, 'Manager'),
+                "interface_errors": (manager, 'Manager'),
+                "interface_counters": (manager, 'Manager'),
+                "interface_errors_data": (manager, 'Manager'),
+                "op_cmd": (paramiko, 'SSHClient'),
+                "op_batch": (paramiko, 'SSHClient'),
+                "op_parallel": (paramiko, 'SSHClient'),
+                "shell_cmd": (paramiko, 'SSHClient'),
+                "shell_batch": (paramiko, 'SSHClient'),
+                "scp_pull": (paramiko, 'SSHClient'),
+                "scp_push": (paramiko, 'SSHClient')
             }
-            # when doing an operational command, logging in as root
-            # brings you to shell, so we need to enter the device as a shell
-            # connection, and move to cli to perform the command
-            # this is a one-off because the isinstance() check will be bypassed
-            if self.username == "root" and function.__name__ == "op_cmd":
-                if not self._session:
-                    self.conn_type = "paramiko"
-                    self.connect()
-                if not self._shell:
-                    self.conn_type = "root"
-                    self.connect()
-                self.shell_to_cli()  # check if we're in the cli
             # Have to call shell command separately, since we are using _shell
             # for comparison, not _session.
-            elif function.__name__ == 'shell_cmd':
+            if function.__name__ == 'shell_cmd':
                 if not self._shell:
                     self.conn_type = "shell"
                     self.connect()
                 self.cli_to_shell()  # check if we're in shell.
-            if isinstance(self._session, func_trans[function.__name__]):
+            if is_instance(self._session, *func_trans[function.__name__]):
                 # If they're doing SCP, we have to check for both _session and
                 # _scp
                 if function.__name__ in ['scp_pull', 'scp_push']:
-                    if not isinstance(self._scp, SCPClient):
+                    if not is_instance(self._scp, scp, 'SCPClient'):
                         self.conn_type = "scp"
                         self.connect()
             else:
                 self.disconnect()
-                if function.__name__ == "op_cmd":
+                if function.__name__ in ["op_cmd", "op_batch",
+                                         "op_parallel"]:
                     self.conn_type = "paramiko"
                 elif function.__name__ in ["scp_pull", "scp_push"]:
                     self.conn_type = "scp"
@@ -255,18 +435,17 @@ class Jaide():
             clean_cmds.append(cmd)
         # try to lock the candidate config so we can make changes.
         self.lock()
-        self._session.load_configuration(action='set', config=commands)
+        self._rpc('load_configuration', action='set', config=commands)
         results = ""
         # confirmed and commit at are mutually exclusive. commit confirm
         # takes precedence.
         if confirmed:
-            results = self._session.commit(confirmed=True,
-                                           timeout=str(confirmed),
-                                           comment=comment,
-                                           synchronize=synchronize)
+            results = self._rpc('commit', confirmed=True,
+                                timeout=str(confirmed), comment=comment,
+                                synchronize=synchronize)
         else:
-            results = self._session.commit(comment=comment, at_time=at_time,
-                                           synchronize=synchronize)
+            results = self._rpc('commit', comment=comment, at_time=at_time,
+                                synchronize=synchronize)
         self.unlock()
         if results:
             if req_format == 'xml':
@@ -274,27 +453,8 @@ class Jaide():
             # commit() DOES NOT return a parse-able xml tree, so we
             # convert it to an ElementTree xml tree.
             results = ET.fromstring(results.tostring)
-            out = ''
-            for i in results.iter():
-                # the success message is just a tag, so we need to get it
-                # specifically.
-                if i.tag == 'commit-check-success':
-                    out += 'configuration check succeeds\n'
-                elif i.tag == 'commit-success':
-                    out += 'commit complete\n'
-                elif i.tag == 'ok':
-                    out += 'commit complete\n'
-                # this is for normal output with a tag and inner text, it will
-                # strip the inner text and add it to the output.
-                elif i.text is not None:
-                    if i.text.strip() + '\n' != '\n':
-                        out += i.text.strip() + '\n'
-                # this is for elements that don't have inner text,
-                # it will add the tag to the output.
-                elif i.text is None:
-                    if i.tag + '\n' != '\n':
-                        out += i.tag + '\n'
-            return out
+            with self.timings.span('parse', 'commit'):
+                return self._commit_output(results, commit=True)
         return False
 
     @check_instance
@@ -322,34 +482,50 @@ class Jaide():
         for cmd in clean_lines(commands):
             clean_cmds.append(cmd)
         self.lock()
-        self._session.load_configuration(action='set', config=clean_cmds)
+        self._rpc('load_configuration', action='set', config=clean_cmds)
         # conn.validate() DOES NOT return a parse-able xml tree, so we
         # convert it to an ElementTree xml tree.
-        results = ET.fromstring(self._session.validate(
-            source='candidate').tostring)
+        results = ET.fromstring(self._rpc('validate',
+                                          source='candidate').tostring)
         # release the candidate configuration
         self.unlock()
         if req_format == "xml":
             return ET.tostring(results)
-        out = ""
-        # we have to parse the elementTree object, and get the text
-        # from the xml.
-        for i in results.iter():
-            # the success message is just a tag, so we need to get it
-            # specifically.
-            if i.tag == 'commit-check-success':
-                out += 'configuration check succeeds\n'
-            # this is for normal output with a tag and inner text, it will
-            # strip the inner text and add it to the output.
-            elif i.text is not None:
-                if i.text.strip() + '\n' != '\n':
-                    out += i.text.strip() + '\n'
-            # this is for elements that don't have inner text, it will add the
-            # tag to the output.
-            elif i.text is None:
-                if i.tag + '\n' != '\n':
-                    out += i.tag + '\n'
-        return out
+        with self.timings.span('parse', 'commit_check'):
+            return self._commit_output(results)
+
+    def _commit_output(self, results, commit=False):
+        """ Turn the xml reply of a commit or commit check into text.
+
+        Purpose: Walks every element of the reply. The success messages
+               | are bare tags, so they're translated to the messages the
+               | Junos CLI shows. Other elements give their stripped inner
+               | text, or their tag if they have no text at all.
+
+        @param results: The reply, parsed with ElementTree.
+        @type results: xml.etree.ElementTree.Element
+        @param commit: True for the reply of a commit, where 'commit-success'
+                     | and 'ok' mean the commit completed.
+        @type commit: bool
+
+        @returns: One line of output per element that produced text.
+        @rtype: str
+        """
+        out = []
+        for elem in results.iter():
+            tag = elem.tag
+            if tag == 'commit-check-success':
+                out.append('configuration check succeeds\n')
+            elif commit and (tag == 'commit-success' or tag == 'ok'):
+                out.append('commit complete\n')
+            elif elem.text is None:
+                if tag:
+                    out.append(tag + '\n')
+            else:
+                text = elem.text.strip()
+                if text:
+                    out.append(text + '\n')
+        return ''.join(out)
 
     @check_instance
     def compare_config(self, commands="", req_format="text"):
@@ -374,8 +550,8 @@ class Jaide():
             raise InvalidCommandError('No commands specified')
         clean_cmds = [cmd for cmd in clean_lines(commands)]
         self.lock()
-        self._session.load_configuration(action='set', config=clean_cmds)
-        out = self._session.compare_configuration()
+        self._rpc('load_configuration', action='set', config=clean_cmds)
+        out = self._rpc('compare_configuration')
         self.unlock()
         if req_format.lower() == "xml":
             return out
@@ -392,8 +568,6 @@ class Jaide():
                |            pipes in commands)
                | - 'scp' is used for copying files
                | - 'shell' is used for to send shell commands
-               | - 'root' is used when logging into the device as root, and
-               |            wanting to send operational commands
                | - 'ncclient' is used for the rest (commit, compare_config,
                |            commit_check)
 
@@ -408,33 +582,46 @@ class Jaide():
             logger.setLevel(logging.CRITICAL)
             self._session.set_missing_host_key_policy(
                 paramiko.AutoAddPolicy())
-            self._session.connect(hostname=self.host,
-                                  username=self.username,
-                                  password=self.password,
-                                  port=self.port,
-                                  timeout=self.connect_timeout)
+            sock = self._open_socket()
+            with self.timings.span('ssh_auth', 'paramiko'):
+                self._session.connect(hostname=self.host,
+                                      username=self.username,
+                                      password=self.password,
+                                      port=self.port,
+                                      timeout=self.connect_timeout,
+                                      sock=sock)
         if self.conn_type == 'scp':
             self._scp_session = paramiko.SSHClient()
             logger = logging.Logger.manager.getLogger('paramiko.transport')
             logger.setLevel(logging.CRITICAL)
             self._scp_session.set_missing_host_key_policy(
                 paramiko.AutoAddPolicy())
-            self._scp_session.connect(hostname=self.host,
-                                      username=self.username,
-                                      password=self.password,
-                                      port=self.port,
-                                      timeout=self.connect_timeout)
-            self._scp = SCPClient(self._scp_session.get_transport())
+            sock = self._open_socket()
+            with self.timings.span('ssh_auth', 'scp'):
+                self._scp_session.connect(hostname=self.host,
+                                          username=self.username,
+                                          password=self.password,
+                                          port=self.port,
+                                          timeout=self.connect_timeout,
+                                          sock=sock)
+            self._scp = scp.SCPClient(self._scp_session.get_transport())
         elif self.conn_type == "ncclient":
-            self._session = manager.connect(
-                host=self.host,
-                port=self.port,
-                username=self.username,
-                password=self.password,
-                timeout=self.connect_timeout,
-                device_params={'name': 'junos'},
-                hostkey_verify=False
-            )
+            # ncclient opens its own socket, so the TCP connection, SSH
+            # handshake, authentication and hello exchange are one span.
+            # It is given the host name, not an address, so that it tries
+            # every address of the host; resolving it first only times the
+            # lookup, which ncclient then gets from the resolver's cache.
+            self._resolve()
+            with self.timings.span('netconf_session'):
+                self._session = manager.connect(
+                    host=self.host,
+                    port=self.port,
+                    username=self.username,
+                    password=self.password,
+                    timeout=self.connect_timeout,
+                    device_params={'name': 'junos'},
+                    hostkey_verify=False
+                )
         elif self.conn_type == 'shell':
             if not self._session:
                 self.conn_type = 'paramiko'
@@ -447,15 +634,153 @@ class Jaide():
                     self._in_cli = True
             if not self.cli_to_shell():
                 self._shell.recv(9999)
-        elif self.conn_type == 'root':
-            # open the shell if necessary, and move into CLI
-            if not self._shell:
-                self._shell = self._session.invoke_shell()
-                time.sleep(2)
-            if not self.shell_to_cli():
-                self._shell.recv(9999)
         self._update_timeout(self.session_timeout)
 
+    def _resolve(self):
+        """ Resolve the host, timed as the dns span.
+
+        @returns: The socket.getaddrinfo() results for the host and port.
+        @rtype: list
+        """
+        with self.timings.span('dns', self.host):
+            return socket.getaddrinfo(self.host, self.port, socket.AF_UNSPEC,
+                                      socket.SOCK_STREAM)
+
+    def _open_socket(self):
+        """ Open the TCP connection to the device, timed as the tcp span.
+
+        Purpose: Does what paramiko.SSHClient.connect() would do itself, so
+               | that the DNS lookup and the TCP connection can be timed
+               | apart from the SSH handshake.
+
+        @returns: The connected socket.
+        @rtype: socket.socket
+        """
+        addresses = self._resolve()
+        with self.timings.span('tcp', self.host):
+            for family, socktype, proto, _, address in addresses:
+                sock = socket.socket(family, socktype, proto)
+                sock.settimeout(self.connect_timeout)
+                try:
+                    sock.connect(address)
+                except socket.error:
+                    sock.close()
+                    # only give up when there is no other address to try.
+                    if address == addresses[-1][4]:
+                        raise
+                else:
+                    return sock
+
+    def _rpc(self, method, *args, **kwargs):
+        """ Call an RPC on the ncclient manager, timed as an rpc span.
+
+        @param method: The name of the manager method, such as 'command' or
+                     | 'get_software_information'.
+        @type method: str
+
+        @returns: The reply of the RPC.
+        @rtype: ncclient.xml_.NCElement
+        """
+        detail = method
+        if method == 'command':
+            detail = kwargs.get('command', args[0] if args else '')
+        with self.timings.span('rpc', detail) as span:
+            reply = getattr(self._session, method)(*args, **kwargs)
+            span.bytes = reply_size(reply)
+        return reply
+
+    def _rpc_pipeline(self, requests, skip_not_found=True):
+        """ Send several RPCs back to back, then collect their replies.
+
+        Purpose: Every request is written to the NETCONF session before
+               | waiting for any reply, so that on high latency links they
+               | take about one round trip instead of one each. The whole
+               | exchange is timed as a single rpc span.
+               |
+               | Replies with a 'not found' error, as Junos sends for an
+               | interface name that matches nothing, are skipped unless
+               | skip_not_found is False. Other errors are raised like those
+               | of _rpc().
+               |
+               | Sending without waiting relies on parts of ncclient that
+               | aren't its public API. If the installed ncclient lacks
+               | them, the requests are sent one at a time with _rpc().
+
+        @param requests: The RPCs to send.
+        @type requests: list of lxml.etree._Element
+        @param skip_not_found: Set to False to raise 'not found' errors
+                             | too, for callers that need one reply per
+                             | request.
+        @type skip_not_found: bool
+
+        @returns: The replies that aren't errors, in the order of requests.
+        @rtype: list of ncclient.xml_.NCElement
+        """
+        # loaded along with ncclient.manager, by the NETCONF connection.
+        from ncclient.operations.errors import TimeoutExpiredError
+        from ncclient.operations.rpc import RPCError
+        from ncclient.xml_ import NCElement
+        if not self._can_pipeline():
+            replies = []
+            for request in requests:
+                try:
+                    replies.append(self._rpc('rpc', request))
+                except RPCError as e:
+                    if not (skip_not_found and
+                            'not found' in (e.message or '')):
+                        raise
+            return replies
+        detail = '%s x%d' % (requests[0].tag, len(requests)) if requests \
+            else ''
+        replies = []
+        with self.timings.span('rpc', detail) as span:
+            self._session.async_mode = True
+            try:
+                pending = [self._session.rpc(request) for request in requests]
+            finally:
+                self._session.async_mode = False
+            transform = self._session._device_handler.transform_reply()
+            span.bytes = 0
+            for rpc in pending:
+                rpc.event.wait(self._session.timeout)
+                if not rpc.event.isSet():
+                    raise TimeoutExpiredError('ncclient timed out while '
+                                              'waiting for an rpc reply.')
+                if rpc.error:
+                    raise rpc.error
+                reply = rpc.reply
+                reply.parse()
+                span.bytes += len(reply.xml)
+                if reply.error is not None:
+                    if skip_not_found and 'not found' in (
+                            reply.error.message or ''):
+                        continue
+                    raise reply.error
+                replies.append(NCElement(reply, transform))
+        return replies
+
+    def _can_pipeline(self):
+        """ Whether ncclient can send RPCs without waiting for replies.
+
+        Purpose: These were checked with ncclient 0.5.3, and aren't part of
+               | its public API, so they are looked for instead of trusting
+               | the version number.
+
+        @returns: True if the requests can be pipelined.
+        @rtype: bool
+        """
+        from ncclient.operations.rpc import RPC, RPCReply
+        from ncclient.xml_ import NCElement
+        try:
+            arguments = inspect.getargspec(NCElement.__init__).args
+        except TypeError:
+            return False
+        return (hasattr(self._session, 'async_mode') and
+                hasattr(getattr(self._session, '_device_handler', None),
+                        'transform_reply') and
+                hasattr(RPC, 'event') and hasattr(RPCReply, 'parse') and
+                len(arguments) == 3)
+
     def _copy_status(self, filename, size, sent):
         """ Echo status of an SCP operation.
 
@@ -464,7 +789,11 @@ class Jaide():
                | prints to stdout, one line for each file as it's copied.
                | The parameters received by this function are those received
                | from the scp.put or scp.get function, as explained in the
-               | python scp module docs.
+               | python scp module docs. The line is only rewritten when a
+               | file completes or half a second has passed, rather than on
+               | every chunk. For transfers to many devices at once, use a
+               | jaide.progress.ProgressReporter as the progress callback
+               | instead.
 
         @param filename: The filename of file being copied.
         @type filename: str
@@ -475,6 +804,11 @@ class Jaide():
 
         @returns: None
         """
+        now = time.time()
+        if (filename == self._filename and float(sent) < float(size) and
+                now - self._progress_time < .5):
+            return
+        self._progress_time = now
         output = "Transferred %.0f%% of the file %s" % (
             (float(sent) / float(size) * 100), path.normpath(filename))
         output += (' ' * (120 - len(output)))
@@ -494,8 +828,51 @@ class Jaide():
         @returns: The output that should be shown to the user.
         @rtype: str
         """
+        info = self.device_info_data()
+        if info['routing_engines']:
+            serial_num = ''.join(name + ' Serial #: ' + serial for name, serial
+                                 in info['routing_engines'])
+        else:
+            serial_num = 'Chassis Serial Number: ' + info['serial_number']
+        return ('Hostname: %s\nModel: %s\nJunos Version: %s\n%s\nCurrent Time:'
+                ' %s\nUptime: %s\n' %
+                (info['hostname'], info['model'], info['version'], serial_num,
+                 info['current_time'], info['uptime']))
+
+    @check_instance
+    def device_info_data(self):
+        """ Pull basic device information as a dictionary.
+
+        Purpose: The structured form of device_info(), for callers that want
+               | the values rather than the text.
+
+        @returns: A dictionary with the keys 'hostname', 'model', 'version',
+                | 'serial_number', 'routing_engines', 'current_time' and
+                | 'uptime'. 'routing_engines' is a list of (name, serial)
+                | tuples, filled instead of the chassis serial number on EX
+                | switches, to get all RE serial numbers in a VC.
+        @rtype: dict
+        """
+        resp = self._rpc('get_software_information', format='xml')
+        uptime_resp = self._rpc('get_system_uptime_information', format='xml')
+        show_hardware = self._rpc('get_chassis_inventory', format='xml')
+        with self.timings.span('parse', 'device_info'):
+            return self._parse_device_info(resp, uptime_resp, show_hardware)
+
+    def _parse_device_info(self, resp, uptime_resp, show_hardware):
+        """ Parse the replies of device_info_data() into its dictionary.
+
+        @param resp: The reply of get-software-information.
+        @type resp: ncclient.xml_.NCElement
+        @param uptime_resp: The reply of get-system-uptime-information.
+        @type uptime_resp: ncclient.xml_.NCElement
+        @param show_hardware: The reply of get-chassis-inventory.
+        @type show_hardware: ncclient.xml_.NCElement
+
+        @returns: The device information.
+        @rtype: dict
+        """
         # get hostname, model, and version from 'show version'
-        resp = self._session.get_software_information(format='xml')
 
         hostname = resp.xpath('//software-information/host-name')[0].text
         model = resp.xpath('//software-information/product-model')[0].text
@@ -549,17 +926,16 @@ class Jaide():
 #                version = 'Unknown'
 
         # get uptime from 'show system uptime'
-        resp = self._session.get_system_uptime_information(format='xml')
         try:
-            current_time = resp.xpath('//current-time/date-time')[0].text
+            current_time = uptime_resp.xpath(
+                '//current-time/date-time')[0].text
         except IndexError:
             current_time = 'Unknown'
         try:
-            uptime = resp.xpath('//uptime-information/up-time')[0].text
+            uptime = uptime_resp.xpath('//uptime-information/up-time')[0].text
         except IndexError:
             uptime = 'Unknown'
         # get serial number from 'show chassis hardware'
-        show_hardware = self._session.get_chassis_inventory(format='xml')
         # If we're hitting an EX, grab each Routing Engine Serial number
         # to get all RE SNs in a VC
         try:
@@ -569,23 +945,29 @@ class Jaide():
         except IndexError:
             chassis_module = 'Unknown'
 
+        serial_num = None
+        engines = []
         if ('EX' or 'ex' or 'Ex') in chassis_module:
-            serial_num = ''
             for eng in show_hardware.xpath(
                     '//chassis-inventory/chassis/chassis-module'):
                 if 'Routing Engine' in eng.xpath('name')[0].text:
-                    serial_num += (eng.xpath('name')[0].text + ' Serial #: ' +
-                                   eng.xpath('serial-number')[0].text)
+                    engines.append((eng.xpath('name')[0].text,
+                                    eng.xpath('serial-number')[0].text))
         else:  # Any other device type, just grab chassis SN
             try:
-                serial_num = ('Chassis Serial Number: ' + show_hardware.xpath(
-                    '//chassis-inventory/chassis/serial-number')[0].text)
+                serial_num = show_hardware.xpath(
+                    '//chassis-inventory/chassis/serial-number')[0].text
             except IndexError:
-                serial_num = 'Chassis Serial Number: ' \
-                    + 'Unknown (virtual machine?)'
-        return ('Hostname: %s\nModel: %s\nJunos Version: %s\n%s\nCurrent Time:'
-                ' %s\nUptime: %s\n' %
-                (hostname, model, version, serial_num, current_time, uptime))
+                serial_num = 'Unknown (virtual machine?)'
+        return {
+            'hostname': hostname,
+            'model': model,
+            'version': version,
+            'serial_number': serial_num,
+            'routing_engines': engines,
+            'current_time': current_time,
+            'uptime': uptime
+        }
 
     # TODO: [2.1] @rfe optional different username/password.
     @check_instance
@@ -602,8 +984,8 @@ class Jaide():
         @param mode: string to signify 'set' mode or 'stanza' mode.
         @type mode: str
 
-        @returns: iterable of strings
-        @rtype: str
+        @returns: The lines of the unified diff.
+        @rtype: list
         """
         second_conn = manager.connect(
             host=second_host,
@@ -620,17 +1002,22 @@ class Jaide():
             command += ' | display set'
 
         # get the raw xml config
-        config1 = self._session.command(command, format='text')
+        config1 = self._rpc('command', command, format='text')
         # for each /configuration-output snippet, turn it to text and join them
         config1 = ''.join([snippet.text.lstrip('\n') for snippet in
                           config1.xpath('//configuration-output')])
 
-        config2 = second_conn.command(command, format='text')
+        try:
+            config2 = second_conn.command(command, format='text')
+        finally:
+            second_conn.close_session()
+            second_conn._session.close()
         config2 = ''.join([snippet.text.lstrip('\n') for snippet in
                           config2.xpath('//configuration-output')])
 
-        return difflib.unified_diff(config1.splitlines(), config2.splitlines(),
-                                    self.host, second_host)
+        with self.timings.span('parse', 'diff'):
+            return offload(_unified_diff, config1, config2, self.host,
+                           second_host, timeout=self.session_timeout)
 
     def disconnect(self):
         """ Close the connection(s) to the device.
@@ -644,46 +1031,26 @@ class Jaide():
         if self._shell:
             self._shell.close()
             self._shell = ""
-        if isinstance(self._session, manager.Manager):
-            self._session.close_session()
-        elif isinstance(self._session, paramiko.client.SSHClient):
-            self._session.close()
-            self._session = ""
-        elif isinstance(self._session, SCPClient):
+        if self._cli:
+            self._cli.close()
+            self._cli = ""
+        if is_instance(self._session, manager, 'Manager'):
+            try:
+                if self._session.connected:
+                    self._session.close_session()
+            finally:
+                # close_session() only asks the device to end the session,
+                # the SSH transport and its thread are closed here.
+                self._session._session.close()
+                self._session = ""
+        elif is_instance(self._session, paramiko, 'SSHClient'):
             self._session.close()
             self._session = ""
+        if is_instance(self._scp, scp, 'SCPClient'):
+            self._scp.close()
+            self._scp_session.close()
             self._scp = ""
 
-    def _error_parse(self, interface, face):
-        """ Parse the extensive xml output of an interface and yield errors.
-
-        Purpose: Takes the xml output of 'show interfaces extensive' for a
-               | given interface and yields the error types that have a
-               | significant number of errors.
-
-        @param interface: The xml output of the 'sh int ext' command for
-                        | the desired interface.
-        @type interface: lxml.etree._Element object
-        @param face: The direction of the errors we're wanting. Either 'input'
-                   | or 'output' is accepted.
-        @type face: str
-
-        @returns: Yields each error that has a significant number
-        @rtype: iterable of strings.
-        """
-        try:
-            error_list = interface.xpath(face + '-error-list')[0].getchildren()
-        except IndexError:  # no error list on this interface
-            pass
-        else:
-            for x in range(len(error_list)):
-                if error_list[x].tag == "carrier-transitions":
-                    if int(error_list[x].text.strip()) > 50:
-                        yield " has greater than 50 flaps."
-                elif int(error_list[x].text.strip()) > 0:
-                    yield " has %s of %s." % (error_list[x].text.strip(),
-                                              error_list[x].tag.strip())
-
     @check_instance
     def health_check(self):
         """ Pull health and alarm information from the device.
@@ -695,89 +1062,358 @@ class Jaide():
         @returns: The output that should be shown to the user.
         @rtype: str
         """
-        output = 'Chassis Alarms:\n\t'
-        # Grab chassis alarms, system alarms, show chassis routing-engine,
-        # 'show system processes extensive', and also xpath to the
-        # relevant nodes on each.
-        chassis_alarms = self._session.command("show chassis alarms")
-        chassis_alarms = chassis_alarms.xpath('//alarm-detail')
-        system_alarms = self._session.command("show system alarms")
-        system_alarms = system_alarms.xpath('//alarm-detail')
-        chass = self._session.command(command="show chassis routing-engine",
-                                      format='text').xpath('//output')[0].text
-        proc = self._session.command("show system processes extensive")
-        proc = proc.xpath('output')[0].text.split('\n')
-        if chassis_alarms == []:  # Chassis Alarms
-            output += 'No chassis alarms active.\n'
-        else:
-            for i in chassis_alarms:
-                output += (i.xpath('alarm-class')[0].text.strip() + ' Alarm \t'
-                           '\t' + i.xpath('alarm-time')[0].text.strip() +
-                           '\n\t' +
-                           i.xpath('alarm-description')[0].text.strip() + '\n')
-        output += '\nSystem Alarms: \n\t'
-        if system_alarms == []:  # System Alarms
-            output += 'No system alarms active.\n'
-        else:
-            for i in system_alarms:
-                output += (i.xpath('alarm-class')[0].text.strip() + ' Alarm '
-                           '\t\t' + i.xpath('alarm-time')[0].text.strip() +
-                           '\n\t' +
-                           i.xpath('alarm-description')[0].text.strip() + '\n')
-        # add the output of the show chassis routing-engine to the command.
-        output += '\n' + chass
-        # Grabs the top 5 processes and the header line.
-        output += ('\n\nTop 5 busiest processes (high mgd values likely from '
-                   'script execution):\n')
-        for line_number in range(8, 14):
-            output += proc[line_number] + '\n'
+        return describe_health(self.health_check_data())
+
+    @check_instance
+    def health_check_data(self):
+        """ Pull health and alarm information from the device as a dictionary.
+
+        Purpose: The structured form of health_check(), for callers that
+               | want the values rather than the text. Besides the text
+               | shown by health_check(), it holds the CPU, memory and
+               | temperature of each routing engine and the usage of the
+               | busiest processes as numbers, so that they can be compared
+               | across devices, see jaide.analytics.
+               |
+               | The five requests are pipelined on the NETCONF session,
+               | so they cost about one round trip in all.
+
+        @returns: A dictionary with the keys:
+                | 'chassis_alarms' and 'system_alarms': lists of
+                | dictionaries with the alarm 'class', 'time' and
+                | 'description'.
+                | 'routing_engine': the text of 'show chassis
+                | routing-engine'.
+                | 'routing_engines': a dictionary per routing engine, see
+                | _parse_routing_engines().
+                | 'processes': the header and top 5 lines of the process
+                | table.
+                | 'top_processes': a dictionary for each of those 5
+                | processes, see _parse_processes().
+                | 'load_average': the 1, 5 and 15 minute load averages
+                | from the process table, or None.
+        @rtype: dict
+        """
+        # Grab chassis alarms, system alarms, show chassis routing-engine
+        # as text for showing and as xml for the values, 'show system
+        # processes extensive', and also xpath to the relevant nodes on each.
+        requests = []
+        for command, text in (('show chassis alarms', False),
+                              ('show system alarms', False),
+                              ('show chassis routing-engine', True),
+                              ('show chassis routing-engine', False),
+                              ('show system processes extensive', False)):
+            request = etree.Element('command')
+            if text:
+                request.set('format', 'text')
+            request.text = command
+            requests.append(request)
+        chassis_alarms, system_alarms, chass, engines, proc = \
+            self._rpc_pipeline(requests, skip_not_found=False)
+        with self.timings.span('parse', 'health_check'):
+            chassis_alarms = chassis_alarms.xpath('//alarm-detail')
+            system_alarms = system_alarms.xpath('//alarm-detail')
+            chass = chass.xpath('//output')[0].text
+            engines = engines.xpath('//route-engine')
+            proc = proc.xpath('output')[0].text.split('\n')
+            return self._parse_health(chassis_alarms, system_alarms, chass,
+                                      proc, engines)
+
+    def _parse_health(self, chassis_alarms, system_alarms, chass, proc,
+                      engines=()):
+        """ Build the dictionary of health_check_data().
+
+        @param chassis_alarms: The chassis alarm-detail elements.
+        @type chassis_alarms: list
+        @param system_alarms: The system alarm-detail elements.
+        @type system_alarms: list
+        @param chass: The text of 'show chassis routing-engine'.
+        @type chass: str
+        @param proc: The lines of 'show system processes extensive'.
+        @type proc: list
+        @param engines: The route-engine elements of 'show chassis
+                      | routing-engine'.
+        @type engines: list
+
+        @returns: The health information.
+        @rtype: dict
+        """
+        alarms = {}
+        for kind, details in (('chassis_alarms', chassis_alarms),
+                              ('system_alarms', system_alarms)):
+            alarms[kind] = [{
+                'class': i.xpath('alarm-class')[0].text.strip(),
+                'time': i.xpath('alarm-time')[0].text.strip(),
+                'description': i.xpath('alarm-description')[0].text.strip()
+            } for i in details]
+        lines, processes, load_average = self._parse_processes(proc)
+        return {
+            'chassis_alarms': alarms['chassis_alarms'],
+            'system_alarms': alarms['system_alarms'],
+            'routing_engine': chass,
+            'routing_engines': self._parse_routing_engines(engines),
+            'processes': lines,
+            'top_processes': processes,
+            'load_average': load_average
+        }
+
+    def _parse_routing_engines(self, engines):
+        """ Read the values of each routing engine.
+
+        @param engines: The route-engine elements of 'show chassis
+                      | routing-engine'.
+        @type engines: list
+
+        @returns: A dictionary per routing engine, with the keys 'slot',
+                | 'state' (such as 'master'), 'temperature' and
+                | 'cpu_temperature' (degrees celsius), 'memory' (the DRAM
+                | size in MB), 'memory_utilization', 'cpu_user',
+                | 'cpu_background', 'cpu_kernel', 'cpu_interrupt',
+                | 'cpu_idle' and 'cpu_utilization' (percentages, the last
+                | being everything but idle), 'load_average' (the 1, 5 and
+                | 15 minute load averages) and 'uptime' (seconds). Values
+                | the device doesn't report are None.
+        @rtype: list
+        """
+        output = []
+        for engine in engines:
+            elements = dict((elem.tag, elem) for elem in engine)
+            values = dict((elem.tag, _number(elem.text)) for elem in engine)
+            state = {
+                'slot': values.get('slot'),
+                'state': (elements['mastership-state'].text or '').strip()
+                if 'mastership-state' in elements else None,
+                'memory': values.get('memory-dram-size'),
+                # older and smaller routing engines name it differently.
+                'memory_utilization': _first(
+                    values.get('memory-buffer-utilization'),
+                    values.get('memory-system-total-util')),
+                'cpu_user': values.get('cpu-user'),
+                'cpu_background': values.get('cpu-background'),
+                'cpu_kernel': values.get('cpu-system'),
+                'cpu_interrupt': values.get('cpu-interrupt'),
+                'cpu_idle': values.get('cpu-idle'),
+                'cpu_utilization': None,
+                'load_average': None,
+                'uptime': None
+            }
+            for key, tag in (('temperature', 'temperature'),
+                             ('cpu_temperature', 'cpu-temperature')):
+                # the junos:celsius attribute, or the text such as
+                # '35 degrees C / 95 degrees F'.
+                if tag in elements:
+                    state[key] = _first(
+                        _number(elements[tag].get('celsius')), values[tag])
+                else:
+                    state[key] = None
+            if state['cpu_idle'] is not None:
+                state['cpu_utilization'] = 100 - state['cpu_idle']
+            load = [values.get('load-average-' + minutes)
+                    for minutes in ('one', 'five', 'fifteen')]
+            if None not in load:
+                state['load_average'] = load
+            if 'up-time' in elements:
+                state['uptime'] = _number(elements['up-time'].get('seconds'))
+            output.append(state)
         return output
 
+    def _parse_processes(self, proc, count=5):
+        """ Read the busiest processes from 'show system processes extensive'.
+
+        Purpose: The table is found by its header line, rather than at a
+               | fixed line, and its columns are read by their names in
+               | the header, as both differ between platforms.
+
+        @param proc: The lines of 'show system processes extensive'.
+        @type proc: list
+        @param count: The number of processes to read.
+        @type count: int
+
+        @returns: A tuple of the header and process lines, a dictionary
+                | per process, and the 1, 5 and 15 minute load averages
+                | (or None). Each process has the keys 'pid', 'user',
+                | 'size' and 'resident' (bytes), 'state', 'time', 'cpu'
+                | (percent) and 'command'. Values the table doesn't have
+                | are None.
+        @rtype: tuple
+        """
+        load_average = None
+        for index, line in enumerate(proc):
+            columns = line.split()
+            if columns[:1] == ['PID']:
+                break
+            found = _LOAD_AVERAGE.search(line)
+            if found:
+                load_average = [float(value) for value in found.groups()]
+        else:
+            return [], [], load_average
+        lines = [line for line in proc[index:index + count + 1]
+                 if line.strip()]
+        processes = []
+        for line in lines[1:]:
+            # the command is last, and can contain spaces.
+            fields = dict(zip(columns, line.split(None, len(columns) - 1)))
+            cpu = fields.get('WCPU', fields.get('CPU'))
+            processes.append({
+                'pid': _number(fields.get('PID')),
+                'user': fields.get('USERNAME'),
+                'size': _bytes(fields.get('SIZE')),
+                'resident': _bytes(fields.get('RES')),
+                'state': fields.get('STATE'),
+                'time': fields.get('TIME'),
+                'cpu': _number(cpu),
+                'command': fields.get('COMMAND')
+            })
+        return lines, processes, load_average
+
     @check_instance
-    def interface_errors(self):
+    def interface_errors(self, fpcs=None):
         """ Parse 'show interfaces extensive' and return interfaces with errors.
 
         Purpose: This function is called for the -e flag. It will let the user
                | know if there are any interfaces with errors, and what those
                | interfaces are.
 
+        @param fpcs: FPC slot numbers to fetch one at a time, see
+                   | interface_counters().
+        @type fpcs: list
+
         @returns: The output that should be shown to the user.
         @rtype: str
         """
-        output = []  # used to store the list of interfaces with errors.
-        # get a string of each physical and logical interface element
-        dev_response = self._session.command('sh interfaces extensive')
-        ints = dev_response.xpath('//physical-interface')
-        ints += dev_response.xpath('//logical-interface')
-        for i in ints:
-            # Grab the interface name for user output.
-            int_name = i.xpath('name')[0].text.strip()
-            # Only check certain interface types.
-            if (('ge' or 'fe' or 'ae' or 'xe' or 'so' or 'et' or 'vlan' or
-                 'lo0' or 'irb') in int_name):
-                try:
-                    status = (i.xpath('admin-status')[0].text.strip() +
-                              '/' + i.xpath('oper-status')[0].text.strip())
-                except IndexError:
-                    pass
-                else:
-                    for error in self._error_parse(i, "input"):
-                        output.append("%s (%s)%s" % (int_name, status,
-                                                     error))
-                    for error in self._error_parse(i, "output"):
-                        output.append("%s (%s)%s" % (int_name, status,
-                                                     error))
-        if output == []:
-            output.append('No interface errors were detected on this device.')
-        return '\n'.join(output) + '\n'
+        return describe_errors(self.interface_errors_data(fpcs))
+
+    @check_instance
+    def interface_errors_data(self, fpcs=None):
+        """ Parse 'show interfaces extensive' and return the errors found.
+
+        Purpose: The structured form of interface_errors(), for callers that
+               | want the values rather than the text.
+
+        @param fpcs: FPC slot numbers to fetch one at a time, see
+                   | interface_counters().
+        @type fpcs: list
+
+        @returns: A dictionary for each significant error counter, with the
+                | keys 'interface', 'status' (admin/oper), 'direction'
+                | ('input' or 'output'), 'counter' and 'count'.
+        @rtype: list
+        """
+        return significant_errors(self.interface_counters(fpcs))
+
+    @check_instance
+    def interface_counters(self, fpcs=None):
+        """ Return every error counter of the interfaces that are checked.
+
+        Purpose: The raw values behind interface_errors_data(), including
+               | the counters that are zero, for callers that keep track of
+               | them over time such as jaide.baseline.
+               |
+               | Rather than all of 'show interfaces extensive', the device
+               | is asked for the interfaces of ERROR_INTERFACE_PREFIXES
+               | only, with one filtered get-interface-information request
+               | per prefix. The requests are pipelined on the NETCONF
+               | session, so they cost about one round trip in all.
+
+        @param fpcs: FPC slot numbers. When given, the slot numbered
+                   | interface types (ge, fe, xe, so, et) are requested once
+                   | per FPC, such as 'ge-1/*', so that no single reply
+                   | holds the whole chassis.
+        @type fpcs: list
+
+        @returns: A dictionary per interface, see _parse_interface_counters().
+        @rtype: list
+        """
+        requests = []
+        for prefix in ERROR_INTERFACE_PREFIXES:
+            if fpcs and prefix in _SLOTTED_PREFIXES:
+                patterns = ['%s-%s/*' % (prefix, fpc) for fpc in fpcs]
+            else:
+                patterns = [prefix + '*']
+            for pattern in patterns:
+                request = etree.Element('get-interface-information')
+                etree.SubElement(request, 'extensive')
+                etree.SubElement(request, 'interface-name').text = pattern
+                requests.append(request)
+        replies = self._rpc_pipeline(requests)
+        output = []
+        with self.timings.span('parse', 'interface_errors'):
+            for reply in replies:
+                output.extend(self._parse_interface_counters(reply))
+        return output
+
+    def _parse_interface_counters(self, dev_response):
+        """ Read the error counters from 'show interfaces extensive'.
+
+        Purpose: Makes a single pass over the reply, picking up the name,
+               | status and error lists of each physical and logical
+               | interface as it goes, instead of searching the document
+               | again for every interface. Only interfaces whose name
+               | starts with one of ERROR_INTERFACE_PREFIXES, and that have
+               | an admin and oper status, are returned.
+
+        @param dev_response: The reply of 'show interfaces extensive'.
+        @type dev_response: ncclient.xml_.NCElement or lxml.etree._Element
+
+        @returns: A dictionary per interface, physical interfaces first,
+                | with the keys 'interface', 'status' (admin/oper), and
+                | 'input' and 'output' holding (counter, count) tuples in
+                | the order of the reply.
+        @rtype: list
+        """
+        interfaces = {'physical-interface': [], 'logical-interface': []}
+        # interface element: the values picked up for it so far.
+        seen = {}
+        root = dev_response.xpath('/*')[0]
+        # iter() with tags walks the tree once, in document order, so each
+        # interface comes before the elements inside it.
+        for elem in root.iter(*_ERROR_WALK_TAGS):
+            tag = elem.tag
+            if tag in _INTERFACE_TAGS:
+                seen[elem] = {'input': [], 'output': []}
+                interfaces[tag].append(seen[elem])
+                continue
+            # only direct children of an interface count; 'name' is also
+            # used deeper in the tree.
+            interface = seen.get(elem.getparent())
+            if interface is None:
+                continue
+            if tag.endswith('-error-list'):
+                # the name comes first, so the counters of interfaces that
+                # won't be reported aren't read at all.
+                if not interface.get('name', '').startswith(
+                        ERROR_INTERFACE_PREFIXES):
+                    continue
+                counters = interface[tag[:-len('-error-list')]]
+                for counter in elem:
+                    try:
+                        counters.append((counter.tag, int(counter.text)))
+                    except (TypeError, ValueError):
+                        continue
+            elif elem.text is not None:
+                interface[tag] = elem.text.strip()
+        output = []
+        for interface in (interfaces['physical-interface'] +
+                          interfaces['logical-interface']):
+            name = interface.get('name')
+            if (not name or not name.startswith(ERROR_INTERFACE_PREFIXES) or
+                    'admin-status' not in interface or
+                    'oper-status' not in interface):
+                continue
+            output.append({'interface': name,
+                           'status': (interface['admin-status'] + '/' +
+                                      interface['oper-status']),
+                           'input': interface['input'],
+                           'output': interface['output']})
+        return output
 
     def lock(self):
         """ Lock the candidate config. Requires ncclient.manager.Manager. """
-        if isinstance(self._session, manager.Manager):
+        if is_instance(self._session, manager, 'Manager'):
             self._session.lock()
 
     @check_instance
-    def op_cmd(self, command, req_format='text', xpath_expr=""):
+    def op_cmd(self, command, req_format='text', xpath_expr="", spool=False):
         """ Execute an operational mode command.
 
         Purpose: Used to send an operational mode command to the connected
@@ -788,7 +1424,8 @@ class Jaide():
                | We indiscriminately attach ' | no-more' on the end of
                | every command so the device doesn't hold output. The
                | req_format parameter can be set to 'xml' to force raw
-               | xml output in the reply.
+               | xml output in the reply. When logged in as root, the
+               | command runs through 'cli -c' from the shell.
 
         @param command: The single command that to retrieve output from the
                       | device. Any pipes will be taken into account.
@@ -797,39 +1434,266 @@ class Jaide():
                          | 'text', but also accepts 'xml'. **NOTE**: 'xml'
                          | will still return a string, not a libxml ElementTree
         @type req_format: str
+        @param xpath_expr: An xpath expression to filter the reply with,
+                         | which requests it in xml.
+        @type xpath_expr: str
+        @param spool: Set to True to get the reply as the SpoolBuffer it
+                    | was read into, which has moved to a temporary file if
+                    | it is larger than self.spool_size, instead of a
+                    | string. Filtered replies are always strings.
+        @type spool: bool
 
         @returns: The reply from the device.
-        @rtype: str
+        @rtype: str or jaide.spool.SpoolBuffer
         """
         if not command:
             raise InvalidCommandError("Parameter 'command' cannot be empty")
+        out = self._exec_command(self._op_request(command, req_format,
+                                                  xpath_expr))
+        if not xpath_expr:
+            return out if spool else out.getvalue()
+        with self.timings.span('parse', xpath_expr):
+            return offload(xpath, out, xpath_expr,
+                           timeout=self.session_timeout)
+
+    def _op_request(self, command, req_format, xpath_expr):
+        """ Build the exec request for an operational mode command.
+
+        Purpose: Attaches ' | display xml' when xml is wanted and
+               | ' | no-more' always. Root logs into the shell instead of the
+               | CLI, so for root the command is handed to 'cli -c', which
+               | runs it and exits. The end of the reply is then the end of
+               | the channel, the same as for any other user.
+
+        @param command: The operational mode command, with its pipes.
+        @type command: str
+        @param req_format: 'text' or 'xml'.
+        @type req_format: str
+        @param xpath_expr: An xpath expression the reply will be filtered
+                         | with, which needs the reply in xml.
+        @type xpath_expr: str
+
+        @returns: The command to run on an exec channel.
+        @rtype: str
+        """
         if req_format.lower() == 'xml' or xpath_expr:
             command = command.strip() + ' | display xml'
-        command = command.strip() + ' | no-more\n'
-        out = ''
-        # when logging in as root, we use _shell to get the response.
+        command = command.strip() + ' | no-more'
         if self.username == 'root':
-            self._shell.send(command)
-            time.sleep(3)
-            while self._shell.recv_ready():
-                out += self._shell.recv(999999)
-                time.sleep(.75)
-            # take off the command being sent and the prompt at the end.
-            out = '\n'.join(out.split('\n')[1:-2])
-        # not logging in as root, and can grab the output as normal.
-        else:
-            stdin, stdout, stderr = self._session.exec_command(command=command,
-                                           timeout=float(self.session_timeout))
+            command = 'cli -c ' + pipes.quote(command)
+        return command + '\n'
+
+    def _exec_command(self, command):
+        """ Run a command on a new exec channel, and read its reply.
+
+        Purpose: Only opens a channel on the existing SSH transport, so
+               | that op_parallel() can call it from several threads at once.
+
+        @param command: The command, with its pipes.
+        @type command: str
+
+        @returns: The reply from the device.
+        @rtype: jaide.spool.SpoolBuffer
+        """
+        with self.timings.span('rpc', command.strip()) as span:
+            stdin, stdout, stderr = self._session.exec_command(
+                command=command, timeout=float(self.session_timeout))
             stdin.close()
-            # read normal output
-            while not stdout.channel.exit_status_ready():
-                out += stdout.read()
-            stdout.close()
-            # read errors
-            while not stderr.channel.exit_status_ready():
-                out += stderr.read()
-            stderr.close()
-        return out if not xpath_expr else xpath(out, xpath_expr)
+            out = SpoolBuffer(self.spool_size)
+            # read normal output, then errors, each up to the end of the
+            # channel. Waiting for exit_status_ready() instead could skip
+            # the read altogether when the exit status came in first.
+            for stream in (stdout, stderr):
+                data = stream.read(65536)
+                while data:
+                    out.write(data)
+                    data = stream.read(65536)
+                stream.close()
+            span.bytes = len(out)
+        return out
+
+    @check_instance
+    def op_parallel(self, commands, req_format='text', xpath_exprs=None,
+                    channels=4, spool=False):
+        """ Execute several operational mode commands at the same time.
+
+        Purpose: Runs up to 'channels' of the commands at once, each on its
+               | own exec channel of the one SSH connection, so that a set of
+               | slow commands takes about as long as the slowest of them
+               | instead of their sum. The replies are returned in the order
+               | of the commands. The device limits the channels of a
+               | connection, to 10 by default on Junos (see 'system services
+               | ssh max-sessions-per-connection').
+
+        @param commands: The commands to retrieve output for.
+        @type commands: list
+        @param req_format: The desired format of the responses, defaults to
+                         | 'text', but also accepts 'xml'.
+        @type req_format: str
+        @param xpath_exprs: An xpath expression per command to filter its
+                          | reply with, or '' for none. Commands with an
+                          | expression are requested in xml.
+        @type xpath_exprs: list
+        @param channels: The most commands to run at the same time.
+        @type channels: int
+        @param spool: Set to True to get the replies that aren't filtered as
+                    | SpoolBuffers, as with op_cmd().
+        @type spool: bool
+
+        @returns: The replies from the device, in the order of commands. The
+                | reply of a command whose xpath expression matched nothing
+                | is None.
+        @rtype: list
+
+        @raises: The error of the first command that failed, once the
+               | commands already running have completed.
+        """
+        xpath_exprs = xpath_exprs or [''] * len(commands)
+        if not all(command.strip() for command in commands):
+            raise InvalidCommandError("Parameter 'commands' cannot contain "
+                                      "empty commands")
+        requests = [self._op_request(command, req_format, xpath_expr)
+                    for command, xpath_expr in zip(commands, xpath_exprs)]
+        replies = [None] * len(requests)
+        failures = []
+        pending = iter(range(len(requests)))
+        lock = threading.Lock()
+
+        def work():
+            while not failures:
+                with lock:
+                    index = next(pending, None)
+                if index is None:
+                    return
+                try:
+                    replies[index] = self._exec_command(requests[index])
+                except Exception as e:
+                    failures.append((index, e))
+
+        workers = [threading.Thread(target=work) for _ in
+                   range(max(1, min(channels, len(requests))))]
+        for worker in workers:
+            worker.daemon = True
+            worker.start()
+        for worker in workers:
+            worker.join()
+        if failures:
+            raise min(failures)[1]
+        return [self._filter_reply(out, xpath_expr) if xpath_expr
+                else out if spool else out.getvalue()
+                for out, xpath_expr in zip(replies, xpath_exprs)]
+
+    @check_instance
+    def op_batch(self, commands, req_format='text', xpath_exprs=None):
+        """ Execute several operational mode commands over one CLI channel.
+
+        Purpose: op_cmd() opens a new exec channel for every command, and
+               | the device starts a new CLI process for each of them. This
+               | sends the commands one after the other to a single
+               | interactive CLI channel instead, which is kept open for
+               | later batches, and splits the replies apart at the CLI
+               | prompt that follows each of them.
+               |
+               | As with op_cmd(), ' | no-more' is attached to every command
+               | and pipes can be used. Root logs into the shell rather than
+               | the CLI, so for root the commands are sent with op_cmd()
+               | one at a time.
+
+        @param commands: The commands to retrieve output for.
+        @type commands: list
+        @param req_format: The desired format of the responses, defaults to
+                         | 'text', but also accepts 'xml'.
+        @type req_format: str
+        @param xpath_exprs: An xpath expression per command to filter its
+                          | reply with, or '' for none. Commands with an
+                          | expression are requested in xml.
+        @type xpath_exprs: list
+
+        @returns: The replies from the device, in the order of commands. The
+                | reply of a command whose xpath expression matched nothing
+                | is None.
+        @rtype: list
+        """
+        xpath_exprs = xpath_exprs or [''] * len(commands)
+        if not all(command.strip() for command in commands):
+            raise InvalidCommandError("Parameter 'commands' cannot contain "
+                                      "empty commands")
+        replies = []
+        for command, xpath_expr in zip(commands, xpath_exprs):
+            if self.username == 'root':
+                out = self.op_cmd(command, req_format='xml' if xpath_expr
+                                  else req_format)
+            else:
+                out = self._cli_command(command, req_format, xpath_expr)
+            replies.append(self._filter_reply(out, xpath_expr))
+        return replies
+
+    def _filter_reply(self, out, xpath_expr):
+        """ Filter a reply with an xpath expression, None if nothing matched.
+        """
+        if not xpath_expr:
+            return out
+        with self.timings.span('parse', xpath_expr):
+            try:
+                return offload(xpath, out, xpath_expr,
+                               timeout=self.session_timeout)
+            except etree.XMLSyntaxError:
+                return None
+
+    def _cli_command(self, command, req_format, xpath_expr):
+        """ Send one command to the CLI channel, and read its reply. """
+        if req_format.lower() == 'xml' or xpath_expr:
+            command = command.strip() + ' | display xml'
+        command = command.strip() + ' | no-more'
+        if self._cli and (self._cli.closed or self._cli.exit_status_ready()):
+            # closed by the device since the last batch, such as after an
+            # idle timeout.
+            self._cli = ""
+        if not self._cli:
+            with self.timings.span('cli_session'):
+                self._cli = self._session.invoke_shell(width=CLI_WIDTH)
+                self._cli.settimeout(float(self.session_timeout))
+                # the prompt is the last line of the login banner.
+                self._cli_prompt = self._read_cli().rsplit('\n', 1)[-1]
+        with self.timings.span('rpc', command) as span:
+            self._cli.send(command + '\n')
+            lines = self._read_cli(self._cli_prompt).split('\n')
+            span.bytes = sum(len(line) + 1 for line in lines)
+        # take off the echoed command and the prompt.
+        lines = lines[1:-1]
+        if lines and _RE_BANNER.match(lines[-1]):
+            lines.pop()
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def _read_cli(self, prompt=None):
+        """ Read from the CLI channel up to the prompt.
+
+        @param prompt: The prompt to read up to, or None for any operational
+                     | mode prompt, when it isn't known yet.
+        @type prompt: str
+
+        @returns: What was read, with the line endings of the terminal
+                | turned into newlines. A carriage return that doesn't end
+                | a line, as in the progress of a long command, is kept.
+        @rtype: str
+        """
+        end = '> ' if prompt is None else '\n' + prompt
+        chunks = []
+        text = ''
+        while True:
+            data = self._cli.recv(65536)
+            if not data:
+                self._cli.close()
+                self._cli = ""
+                raise paramiko.SSHException('The device closed the CLI '
+                                            'session.')
+            chunks.append(data)
+            # only the end of what was read can hold the prompt, so the
+            # rest isn't joined and searched again for every chunk.
+            text = text[-len(end) - 2:] + data
+            if text.replace('\r\n', '\n').replace('\r', '').endswith(end):
+                return ''.join(chunks).replace('\r\n', '\n').replace(
+                    '\r', '')
 
     @check_instance
     def scp_pull(self, src, dest, progress=False, preserve_times=True):
@@ -845,7 +1709,7 @@ class Jaide():
         @param progress: set to `True` to have the progress callback be
                        | printed as the operation is copying. Can also pass
                        | a function pointer to handoff the progress callback
-                       | elsewhere.
+                       | elsewhere, such as a jaide.progress.ProgressReporter.
         @type progress: bool or function pointer
         @param preserve_times: Set to false to have the times of the copied
                              | files set at the time of copy.
@@ -854,16 +1718,11 @@ class Jaide():
         @returns: `True` if the copy succeeds.
         @rtype: bool
         """
-        # set up the progress callback if they want to see the process
-        if progress is True:
-            self._scp._progress = self._copy_status
-        # redirect to another function
-        elif hasattr(progress, '__call__'):
-            self._scp._progress = progress
-        else:  # no progress callback
-            self._scp._progress = None
-        # retrieve the file(s)
-        self._scp.get(src, dest, recursive=True, preserve_times=preserve_times)
+        with self.timings.span('transfer', src) as span:
+            self._set_progress(progress, span)
+            # retrieve the file(s)
+            self._scp.get(src, dest, recursive=True,
+                          preserve_times=preserve_times)
         self._filename = None
         return False
 
@@ -878,7 +1737,7 @@ class Jaide():
         @param progress: set to `True` to have the progress callback be
                        | printed as the operation is copying. Can also pass
                        | a function pointer to handoff the progress callback
-                       | elsewhere.
+                       | elsewhere, such as a jaide.progress.ProgressReporter.
         @type progress: bool or function pointer
         @param preserve_times: Set to false to have the times of the copied
                              | files set at the time of copy.
@@ -887,18 +1746,40 @@ class Jaide():
         @returns: `True` if the copy succeeds.
         @rtype: bool
         """
+        with self.timings.span('transfer', src) as span:
+            self._set_progress(progress, span)
+            # push the file(s)
+            self._scp.put(src, dest, recursive=True,
+                          preserve_times=preserve_times)
+        self._filename = None
+        return False
+
+    def _set_progress(self, progress, span):
+        """ Set the SCP progress callback, counting the bytes for a span.
+
+        @param progress: The progress parameter of scp_pull() or scp_push().
+        @type progress: bool or function pointer
+        @param span: The transfer span to count the copied bytes on.
+        @type span: jaide.timing.Span
+
+        @returns: None
+        """
         # set up the progress callback if they want to see the process
         if progress is True:
-            self._scp._progress = self._copy_status
+            callback = self._copy_status
         # redirect to another function
         elif hasattr(progress, '__call__'):
-            self._scp._progress = progress
+            callback = progress
         else:  # no progress callback
-            self._scp._progress = None
-        # push the file(s)
-        self._scp.put(src, dest, recursive=True, preserve_times=preserve_times)
-        self._filename = None
-        return False
+            callback = None
+        span.bytes = 0
+
+        def counting(filename, size, sent, *args):
+            if sent >= size:
+                span.bytes += size
+            if callback is not None:
+                callback(filename, size, sent, *args)
+        self._scp._progress = counting
 
     @check_instance
     def shell_cmd(self, command=""):
@@ -922,12 +1803,144 @@ class Jaide():
         command = command.strip() + '\n'
         self._shell.send(command)
         time.sleep(2)
-        out = ''
+        chunks = []
         while self._shell.recv_ready():
-            out += self._shell.recv(999999)
+            # take all that has arrived, then wait a little for more.
+            while self._shell.recv_ready():
+                chunks.append(self._shell.recv(65536))
             time.sleep(.75)
         # take off the command being sent and the prompt at the end.
-        return '\n'.join(out.split('\n')[1:-1])
+        return '\n'.join(''.join(chunks).split('\n')[1:-1])
+
+    @check_instance
+    def shell_batch(self, commands):
+        """ Execute several shell commands, reading each reply exactly.
+
+        Purpose: shell_cmd() waits a fixed time for every command, and
+               | guesses where its output starts and ends. This waits for
+               | the shell to echo a first marker, then sends all of the
+               | commands at once, each followed by an echo of a unique
+               | marker, reads up to the marker of the last command, and
+               | splits the output at the markers. The echo of
+               | the typed lines and the shell prompts are taken out of each
+               | reply. Nothing is waited for but the device.
+               |
+               | Commands that read from their standard input would read the
+               | commands after them, so those must not be sent.
+
+        @param commands: The shell commands to run, in order.
+        @type commands: list
+
+        @returns: The output of each command, without its trailing newline.
+        @rtype: list
+
+        @raises: JaideError if the output doesn't hold every marker in
+               | order, as it can't be split into replies then.
+        """
+        if not all(command.strip() for command in commands):
+            raise InvalidCommandError("Parameter 'commands' cannot contain "
+                                      "empty commands")
+        token = '__jaide_%s__' % uuid.uuid4().hex[:12]
+        # the quotes keep the echo of the typed line from matching the
+        # marker, and the leading echo puts the marker on a line of its own.
+        typed = lambda mark: "echo; echo %s'':%s" % (token, mark)
+        if not self._shell:
+            with self.timings.span('cli_session', 'shell'):
+                self._shell = self._session.invoke_shell(width=CLI_WIDTH)
+                self._shell.settimeout(float(self.session_timeout))
+            self._in_cli = self.username != 'root'
+        # two markers first, to learn the prompt in between them.
+        marks = ['start', 'prompt'] + range(len(commands))
+        script = typed('prompt') + '\n' + ''.join(
+            '%s\n%s\n' % (command.strip(), typed(number))
+            for number, command in enumerate(commands))
+        with self.timings.span('rpc', 'shell x%d' % len(commands)) as span:
+            if self._in_cli:
+                self._shell.send('start shell\n')
+                self._in_cli = False
+            # the commands are only sent once the shell has echoed the
+            # first marker, so that none of them reach the CLI instead.
+            self._shell.send(typed('start') + '\n')
+            text = self._read_shell('%s:start\n' % token)
+            self._shell.send(script)
+            text += self._read_shell('%s:%s\n' % (token, marks[-1]))
+            span.bytes = len(text)
+        lines = text.split('\n')
+        # the line index of each marker, in order.
+        found = []
+        for index, line in enumerate(lines):
+            if (len(found) < len(marks) and
+                    line.endswith('%s:%s' % (token, marks[len(found)]))):
+                found.append(index)
+        if len(found) != len(marks):
+            raise JaideError("Marker '%s:%s' is missing from the shell "
+                             "output." % (token, marks[len(found)]))
+        prompt = ''
+        for line in lines[found[0] + 1:found[1]]:
+            if line.endswith(typed('prompt')):
+                prompt = line[:-len(typed('prompt'))]
+                break
+            elif line:
+                prompt = line
+                break
+        if not prompt.strip():
+            prompt = ''
+        replies = []
+        for number, command in enumerate(commands):
+            chunk = lines[found[number + 1] + 1:found[number + 2]]
+            echoes = (command.strip(), typed(number))
+            out = []
+            for line in chunk:
+                for echo in echoes:
+                    # a typed line, after the prompt and any output that
+                    # didn't end with a newline.
+                    if line == echo or (prompt and
+                                        line.endswith(prompt + echo)):
+                        line = line[:-len(echo)]
+                        if prompt and line.endswith(prompt):
+                            line = line[:-len(prompt)]
+                        break
+                else:
+                    echo = None
+                while prompt and line.startswith(prompt):
+                    line = line[len(prompt):]
+                if echo is None or line:
+                    out.append(line)
+            # the prompt printed before the marker, when nothing is echoed.
+            if out and prompt and out[-1].endswith(prompt):
+                out[-1] = out[-1][:-len(prompt)]
+            # the empty line of the leading echo of the marker.
+            if out and not out[-1]:
+                out.pop()
+            replies.append('\n'.join(out))
+        return replies
+
+    def _read_shell(self, end):
+        """ Read from the shell channel up to some text.
+
+        @param end: The text that ends the reply.
+        @type end: str
+
+        @returns: What was read, with the line endings of the terminal
+                | turned into newlines. A carriage return that doesn't end
+                | a line, as in the progress of a long command, is kept.
+        @rtype: str
+        """
+        chunks = []
+        text = ''
+        while True:
+            data = self._shell.recv(65536)
+            if not data:
+                self._shell.close()
+                self._shell = ""
+                raise paramiko.SSHException('The device closed the shell '
+                                            'session.')
+            chunks.append(data)
+            # only the end can hold the marker that wasn't there before.
+            tail = text[-len(end) - 2:] + data
+            if end in _LINE_END.sub('\n', tail):
+                return _LINE_END.sub('\n', ''.join(chunks))
+            text = tail
 
     def shell_to_cli(self):
         """ Move _shell to the command line interface (CLI). """
@@ -946,11 +1959,11 @@ class Jaide():
                | edit the device. Requires the _session private variable to be
                | a type of a ncclient.manager.Manager.
         """
-        if isinstance(self._session, manager.Manager):
+        if is_instance(self._session, manager, 'Manager'):
             self._session.unlock()
 
     def _update_timeout(self, value):
-        if isinstance(self._session, manager.Manager):
+        if is_instance(self._session, manager, 'Manager'):
             self._session.timeout = value
         if self._shell:
             self._shell.settimeout(value)
@@ -0,0 +1,509 @@
+""" A local session broker, reusing device sessions across jaide runs.
+
+Every run of the jaide CLI pays for new SSH handshakes and NETCONF hellos,
+which are most of the time of a short command. 'jaide daemon' keeps the
+sessions of the devices it has worked on open in a SessionPool, and runs
+device jobs for CLI runs given the --broker option, which hand each device
+job to it over a Unix domain socket instead of connecting themselves.
+
+A session is only reused for the same host, port, username and password,
+and for the same kind of session: NETCONF for the commands that use
+ncclient, SSH for operational and shell commands and SCP transfers, so
+that a runbook mixing both doesn't keep swapping one for the other. Idle
+sessions are closed after --idle-timeout seconds, and every session is
+checked with Jaide.alive() before it is handed out again.
+
+Requests and replies are length prefixed pickles, as between the workers of
+the process backend. The socket is created in a directory only the user
+running the daemon can enter, like the sockets of ssh-agent: in
+$XDG_RUNTIME_DIR when it is set, or in a jaide-UID directory of the
+temporary directory. As a reply is unpickled, and a request holds the
+passwords of the devices, both the daemon and its clients refuse a socket
+or directory that is a symlink, belongs to another user, or that other
+users can access.
+"""
+# standard modules
+import cPickle as pickle
+import os
+from os import path
+import socket
+import SocketServer
+import stat
+import struct
+import tempfile
+import threading
+import time
+# intra-Jaide imports
+import wrap
+from result import DeviceResult
+from timing import Timings
+
+if os.environ.get('XDG_RUNTIME_DIR'):
+    DEFAULT_SOCKET = path.join(os.environ['XDG_RUNTIME_DIR'], 'jaide',
+                               'broker.sock')
+else:
+    DEFAULT_SOCKET = path.join(tempfile.gettempdir(), 'jaide-%s' % (
+        os.getuid() if hasattr(os, 'getuid') else 'daemon'), 'broker.sock')
+# the wrap functions the daemon runs, and the kind of session each uses.
+SESSION_KINDS = {
+    'command': 'ssh',
+    'shell': 'ssh',
+    'pull': 'ssh',
+    'push': 'ssh',
+    'playbook': 'ssh',
+    'commit': 'netconf',
+    'compare': 'netconf',
+    'device_info': 'netconf',
+    'device_info_data': 'netconf',
+    'diff_config': 'netconf',
+    'health_check': 'netconf',
+    'health_check_data': 'netconf',
+    'interface_errors': 'netconf',
+    'interface_errors_data': 'netconf',
+}
+# the wrap functions whose first argument can be the path of a file of
+# commands, which is made absolute for the daemon.
+_COMMAND_FILES = ('command', 'commit', 'compare', 'shell')
+_LENGTH = struct.Struct('!I')
+# Windows has no Unix domain sockets, where BrokerServer refuses to start.
+_UnixStreamServer = getattr(SocketServer, 'UnixStreamServer', object)
+
+
+class BrokerError(Exception):
+
+    """ The jaide daemon could not be reached, or failed to answer. """
+
+
+class UnsafeSocketError(BrokerError):
+
+    """ The socket of the jaide daemon could be reached by other users. """
+
+
+class SessionPool(object):
+
+    """ Idle Jaide sessions, ready to be handed out again. """
+
+    def __init__(self, idle_timeout=300, max_sessions=1000):
+        """ Initialize the pool.
+
+        @param idle_timeout: The seconds a session is kept without being
+                           | used.
+        @type idle_timeout: int
+        @param max_sessions: The most idle sessions kept. The longest idle
+                           | one is closed to make room for another.
+        @type max_sessions: int
+        """
+        self.idle_timeout = idle_timeout
+        self.max_sessions = max_sessions
+        # (host, port, username, password, kind): [(Jaide, last used)], the
+        # most recently used last.
+        self._idle = {}
+        self._count = 0
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'dead': 0, 'evicted': 0}
+
+    def checkout(self, function, host, username, password, port=22,
+                 connect_timeout=5, session_timeout=300):
+        """ Take an idle session for a device out of the pool.
+
+        @param function: The wrap function the session is for.
+        @type function: function
+        @param host: The IP or hostname of the device.
+        @type host: str
+        @param username: The username of the session.
+        @type username: str
+        @param password: The password of the session.
+        @type password: str
+        @param port: The port of the device.
+        @type port: int
+        @param connect_timeout: The connection timeout for the session,
+                              | should it reconnect.
+        @type connect_timeout: int
+        @param session_timeout: The session timeout for the job.
+        @type session_timeout: int
+
+        @returns: A connected session with fresh timings, or None if there
+                | isn't one, in which case the caller connects a new one.
+        @rtype: jaide.Jaide
+        """
+        key = (host.strip(), port, username, password,
+               SESSION_KINDS.get(function.__name__, 'netconf'))
+        while True:
+            with self._lock:
+                sessions = self._idle.get(key)
+                if not sessions:
+                    self.stats['misses'] += 1
+                    return None
+                jaide, _ = sessions.pop()
+                self._count -= 1
+            # checked outside of the lock, it can take a moment.
+            if jaide.alive():
+                break
+            self.stats['dead'] += 1
+            _close(jaide)
+        self.stats['hits'] += 1
+        jaide.timings = Timings(jaide.host)
+        jaide.connect_timeout = connect_timeout
+        jaide.session_timeout = session_timeout
+        jaide._update_timeout(session_timeout)
+        return jaide
+
+    def checkin(self, jaide, function):
+        """ Put a session back in the pool, once its job is done.
+
+        @param jaide: The session.
+        @type jaide: jaide.Jaide
+        @param function: The wrap function the session was used for.
+        @type function: function
+
+        @returns: None
+        """
+        key = (jaide.host, jaide.port, jaide.username, jaide.password,
+               SESSION_KINDS.get(function.__name__, 'netconf'))
+        oldest = None
+        with self._lock:
+            self._idle.setdefault(key, []).append((jaide, time.time()))
+            self._count += 1
+            if self._count > self.max_sessions:
+                oldest = min(self._idle, key=lambda k: self._idle[k][0][1]
+                             if self._idle[k] else float('inf'))
+                oldest = self._idle[oldest].pop(0)[0]
+                self._count -= 1
+                self.stats['evicted'] += 1
+        if oldest is not None:
+            _close(oldest)
+
+    def evict(self):
+        """ Close the idle sessions that expired or were dropped.
+
+        @returns: The number of sessions closed.
+        @rtype: int
+        """
+        expired = time.time() - self.idle_timeout
+        closed = []
+        with self._lock:
+            for key, sessions in list(self._idle.items()):
+                keep = []
+                for jaide, used in sessions:
+                    if used < expired:
+                        self.stats['evicted'] += 1
+                        closed.append(jaide)
+                    elif not jaide.alive():
+                        self.stats['dead'] += 1
+                        closed.append(jaide)
+                    else:
+                        keep.append((jaide, used))
+                if keep:
+                    self._idle[key] = keep
+                else:
+                    del self._idle[key]
+            self._count -= len(closed)
+        for jaide in closed:
+            _close(jaide)
+        return len(closed)
+
+    def close(self):
+        """ Close every idle session. """
+        with self._lock:
+            sessions = [jaide for idle in self._idle.values()
+                        for jaide, _ in idle]
+            self._idle = {}
+            self._count = 0
+        for jaide in sessions:
+            _close(jaide)
+
+    def status(self):
+        """ Describe the pool.
+
+        @returns: A dictionary with the 'sessions' (the idle sessions per
+                | 'host kind'), 'idle' (their count), and the 'hits',
+                | 'misses', 'dead' and 'evicted' counters.
+        @rtype: dict
+        """
+        with self._lock:
+            sessions = dict(('%s %s' % (key[0], key[4]), len(idle))
+                            for key, idle in self._idle.items() if idle)
+            status = dict(self.stats, sessions=sessions, idle=self._count)
+        return status
+
+
+def _close(jaide):
+    """ Close a session, ignoring a connection that is already gone. """
+    try:
+        jaide.disconnect()
+    except Exception:
+        pass
+
+
+def _check_private(socket_path):
+    """ Make sure only the current user can reach a socket.
+
+    Purpose: A predictable directory in /tmp can be created by another
+           | user first, who could then listen on the socket, read the
+           | passwords of the requests, and answer with a pickle that runs
+           | code in the client. The directory of the socket, and the
+           | socket itself when it exists, must belong to the current user
+           | and not be symlinks. The directory must not be accessible by
+           | the group or other users.
+
+    @param socket_path: The path of the Unix domain socket.
+    @type socket_path: str
+
+    @returns: None
+
+    @raises UnsafeSocketError: If the directory or socket can't be trusted.
+    """
+    directory = path.dirname(socket_path) or '.'
+    for name, is_directory in ((directory, True), (socket_path, False)):
+        try:
+            info = os.lstat(name)
+        except OSError:
+            if is_directory:
+                raise BrokerError('The directory of the jaide daemon '
+                                  'socket %s does not exist.' % directory)
+            return
+        if stat.S_ISLNK(info.st_mode):
+            problem = 'is a symlink'
+        elif info.st_uid != os.getuid():
+            problem = 'belongs to another user'
+        elif is_directory and not stat.S_ISDIR(info.st_mode):
+            problem = 'is not a directory'
+        elif is_directory and info.st_mode & 0o077:
+            problem = 'can be accessed by other users'
+        elif not is_directory and not stat.S_ISSOCK(info.st_mode):
+            problem = 'is not a socket'
+        else:
+            continue
+        raise UnsafeSocketError('Refusing the jaide daemon socket %s: %s '
+                                '%s.' % (socket_path, name, problem))
+
+
+def _send(sock, message):
+    data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+    sock.sendall(_LENGTH.pack(len(data)) + data)
+
+
+def _receive(sock):
+    length = _LENGTH.unpack(_read(sock, _LENGTH.size))[0]
+    return pickle.loads(_read(sock, length))
+
+
+def _read(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            raise EOFError('the connection was closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return ''.join(chunks)
+
+
+class _Handler(SocketServer.BaseRequestHandler):
+
+    """ Answers one request of a client. """
+
+    def handle(self):
+        try:
+            request = _receive(self.request)
+        except (EOFError, socket.error, pickle.UnpicklingError):
+            return
+        operation = request.get('operation')
+        if operation == 'job':
+            reply = self.server.run_job(*request['job'])
+        elif operation == 'status':
+            reply = dict(self.server.pool.status(), pid=os.getpid(),
+                         started=self.server.started)
+        elif operation == 'stop':
+            reply = {'stopping': True}
+            # shutdown() waits for serve_forever(), this thread can't.
+            threading.Thread(target=self.server.shutdown).start()
+        else:
+            reply = {'error': 'unknown operation %r' % operation}
+        try:
+            _send(self.request, reply)
+        except socket.error:  # the client gave up on it
+            pass
+
+
+class BrokerServer(SocketServer.ThreadingMixIn, _UnixStreamServer):
+
+    """ Runs the device jobs of jaide clients, on pooled sessions. """
+
+    daemon_threads = True
+
+    def __init__(self, socket_path=DEFAULT_SOCKET, idle_timeout=300,
+                 max_sessions=1000):
+        """ Initialize the server, and listen on the socket.
+
+        @param socket_path: The path of the Unix domain socket. Its
+                          | directory is created, only accessible by the
+                          | current user. A directory that already exists
+                          | must belong to the current user and be private
+                          | to them. A socket left behind by a daemon that
+                          | is no longer running is replaced.
+        @type socket_path: str
+        @param idle_timeout: The seconds an unused session is kept open.
+        @type idle_timeout: int
+        @param max_sessions: The most idle sessions kept open.
+        @type max_sessions: int
+
+        @raises BrokerError: If another daemon is listening on the socket,
+                           | the socket or its directory can't be trusted,
+                           | or there are no Unix domain sockets.
+        """
+        if not hasattr(socket, 'AF_UNIX'):
+            raise BrokerError('The jaide daemon needs Unix domain sockets.')
+        directory = path.dirname(socket_path)
+        try:
+            os.makedirs(directory, 0o700)
+        except OSError:  # already exists, checked below
+            pass
+        _check_private(socket_path)
+        if path.exists(socket_path):
+            try:
+                status(socket_path)
+            except BrokerError:
+                os.remove(socket_path)
+            else:
+                raise BrokerError('A jaide daemon is already listening on %s'
+                                  % socket_path)
+        self.pool = SessionPool(idle_timeout, max_sessions)
+        self.started = time.time()
+        self._stopped = threading.Event()
+        _UnixStreamServer.__init__(self, socket_path, _Handler)
+        os.chmod(socket_path, 0o600)
+
+    def run_job(self, ip, username, password, function, args, conn_timeout,
+                sess_timeout, port):
+        """ Run a device job on a pooled session.
+
+        @param function: The name of the jaide.wrap function, one of
+                       | SESSION_KINDS. The other parameters are those of
+                       | jaide.wrap.open_connection().
+        @type function: str
+
+        @returns: The result of the job.
+        @rtype: jaide.result.DeviceResult
+        """
+        if function not in SESSION_KINDS:
+            return DeviceResult(ip).fail('The jaide daemon does not run %s.'
+                                         % function, 'BrokerError')
+        try:
+            return wrap.open_connection(
+                ip, username, password, getattr(wrap, function), args,
+                conn_timeout=conn_timeout, sess_timeout=sess_timeout,
+                port=port, pool=self.pool)
+        except Exception as e:
+            return DeviceResult(ip).fail('Device %s raised %s: %s' % (
+                ip, e.__class__.__name__, e), e.__class__.__name__)
+
+    def serve(self):
+        """ Answer requests until stopped, closing the idle sessions that
+        expire, then close every session and remove the socket.
+
+        @returns: None
+        """
+        reaper = threading.Thread(target=self._reap)
+        reaper.daemon = True
+        reaper.start()
+        try:
+            self.serve_forever()
+        finally:
+            self._stopped.set()
+            self.server_close()
+            self.pool.close()
+
+    def server_close(self):
+        """ Stop listening, and remove the socket. """
+        _UnixStreamServer.server_close(self)
+        try:
+            os.remove(self.server_address)
+        except OSError:
+            pass
+
+    def _reap(self):
+        interval = max(1, min(self.pool.idle_timeout / 2.0, 30))
+        while not self._stopped.wait(interval):
+            self.pool.evict()
+
+
+def request(socket_path, message, timeout=None):
+    """ Send a request to the daemon, and return its reply.
+
+    @param socket_path: The socket of the daemon.
+    @type socket_path: str
+    @param message: The request, a dictionary with an 'operation'.
+    @type message: dict
+    @param timeout: The seconds to wait for the reply, or None to wait as
+                  | long as the request takes.
+    @type timeout: float
+
+    @returns: The reply.
+
+    @raises BrokerError: If the daemon can't be reached, doesn't reply, or
+                       | its socket can't be trusted.
+    """
+    if not hasattr(socket, 'AF_UNIX'):
+        raise BrokerError('The jaide daemon needs Unix domain sockets.')
+    _check_private(socket_path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path)
+        _send(sock, message)
+        return _receive(sock)
+    except (EOFError, socket.error, pickle.UnpicklingError) as e:
+        raise BrokerError('No reply from a jaide daemon on %s: %s' %
+                          (socket_path, e))
+    finally:
+        sock.close()
+
+
+def status(socket_path=DEFAULT_SOCKET):
+    """ Return the status of the daemon, see SessionPool.status().
+
+    @raises BrokerError: If no daemon is listening on the socket.
+    """
+    return request(socket_path, {'operation': 'status'}, timeout=5)
+
+
+def stop(socket_path=DEFAULT_SOCKET):
+    """ Ask the daemon to close its sessions and exit.
+
+    @raises BrokerError: If no daemon is listening on the socket.
+    """
+    return request(socket_path, {'operation': 'stop'}, timeout=5)
+
+
+def broker_connection(socket_path, ip, username, password, function, args,
+                      write=False, conn_timeout=5, sess_timeout=300, port=22):
+    """ Run a device job in the jaide daemon.
+
+    Purpose: Used in place of jaide.wrap.open_connection() by the --broker
+           | option, taking the same parameters after the socket. Relative
+           | paths of command files are made absolute first, as the daemon
+           | has its own working directory.
+
+    @param socket_path: The socket of the daemon.
+    @type socket_path: str
+
+    @returns: A DeviceResult, or a tuple of write and the DeviceResult,
+            | like jaide.wrap.open_connection().
+    @rtype: Tuple or jaide.result.DeviceResult
+    """
+    name = function.__name__
+    if (name in _COMMAND_FILES and args and
+            isinstance(args[0], basestring) and path.isfile(args[0])):
+        args = [path.abspath(args[0])] + list(args[1:])
+    started = time.time()
+    try:
+        result = request(socket_path, {'operation': 'job', 'job': (
+            ip.strip(), username, password, name, list(args), conn_timeout,
+            sess_timeout, port)})
+    except BrokerError as e:
+        result = DeviceResult(ip.strip()).fail(str(e), 'BrokerError')
+        result.timings['total'] = time.time() - started
+    if write is not False:
+        return write, result
+    return result
@@ -13,3 +13,10 @@ class InvalidCommandError(JaideError):
     """ Raised for invalid commands sent towards device. """
 
     pass
+
+
+class DeviceTimeoutError(JaideError):
+
+    """ Raised in a worker when a device exceeds its wall-clock deadline. """
+
+    pass
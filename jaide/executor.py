@@ -0,0 +1,280 @@
+""" Executors for running a jaide job against many devices at once.
+
+The work the CLI does per device is almost entirely waiting on the network,
+so the default back end is a pool of threads, which can hold hundreds of
+concurrent sessions for the memory cost of one process. The process back
+end is still available for CPU heavy work (large xpath filtering, diffs),
+where the GIL would otherwise serialize parsing.
+"""
+# standard modules
+import math
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import Queue
+import signal
+import threading
+import time
+# intra-Jaide imports
+from errors import DeviceTimeoutError
+
+BACKENDS = ['thread', 'process']
+# the number of workers used when none is requested, per back end.
+DEFAULT_THREADS = 64
+
+
+def default_workers(backend, jobs=None):
+    """ Return the default number of workers for a back end.
+
+    @param backend: One of BACKENDS.
+    @type backend: str
+    @param jobs: The number of jobs that will be submitted, if known. There's
+               | no point in starting more workers than that.
+    @type jobs: int
+
+    @returns: The number of workers.
+    @rtype: int
+    """
+    if backend == 'process':
+        workers = multiprocessing.cpu_count() * 2
+    else:
+        workers = DEFAULT_THREADS
+    if jobs:
+        workers = min(workers, jobs)
+    return max(workers, 1)
+
+
+class Executor(object):
+
+    """ A pool of workers for running device jobs, backed by threads or processes.
+
+    Both back ends share the multiprocessing.Pool interface, so jobs are
+    submitted the same way regardless of the back end.
+    """
+
+    def __init__(self, backend='thread', workers=None, jobs=None):
+        """ Initialize the executor and start its workers.
+
+        @param backend: 'thread' for a pool of threads, or 'process' for a
+                      | pool of processes.
+        @type backend: str
+        @param workers: The number of concurrent workers. Defaults to
+                      | default_workers() for the back end.
+        @type workers: int
+        @param jobs: The number of jobs that will be submitted, if known.
+                   | Used to size the default pool.
+        @type jobs: int
+        """
+        if backend not in BACKENDS:
+            raise ValueError("backend must be one of: %s" %
+                             ', '.join(BACKENDS))
+        self.backend = backend
+        self.workers = workers or default_workers(backend, jobs)
+        if backend == 'process':
+            self._pool = multiprocessing.Pool(self.workers)
+        else:
+            self._pool = ThreadPool(self.workers)
+        self._manager = None
+
+    def submit(self, function, args=(), callback=None):
+        """ Queue a job for one of the workers.
+
+        @param function: The function to run. For the process back end it
+                       | must be importable (picklable) by the workers.
+        @type function: function
+        @param args: The arguments for the function.
+        @type args: tuple
+        @param callback: Called in the parent with the return value of the
+                       | function when the job completes.
+        @type callback: function
+
+        @returns: The pending result.
+        @rtype: multiprocessing.pool.AsyncResult
+        """
+        return self._pool.apply_async(function, args=tuple(args),
+                                      callback=callback)
+
+    def queue(self):
+        """ Create a queue that the workers can put results on.
+
+        @returns: A Queue.Queue for threads, or a manager queue that can be
+                | passed to other processes.
+        @rtype: Queue
+        """
+        if self.backend == 'thread':
+            return Queue.Queue()
+        if self._manager is None:
+            self._manager = multiprocessing.Manager()
+        return self._manager.Queue()
+
+    def run(self, function, jobs, callback, on_failure=None,
+            device_timeout=None, job_timeout=None):
+        """ Run a function for many jobs, streaming results as they complete.
+
+        Purpose: Every job is submitted to the pool, and `callback` is
+               | called in this thread with each result as soon as that job
+               | finishes, in completion order. A job that runs longer than
+               | device_timeout seconds (measured from when a worker picked
+               | it up), or that hasn't finished when job_timeout seconds
+               | have passed since the start, is reported to `on_failure`
+               | and no longer waited for. With the process back end, a
+               | timed out job is interrupted inside the worker with
+               | SIGALRM where the platform allows it, and any leftover
+               | workers are terminated at the end. Threads can't be
+               | stopped, so timed out jobs are abandoned to finish (or
+               | hang) in the background, and a new thread takes the place
+               | of each, so that the jobs queued behind them still start.
+
+        @param function: The function to run. For the process back end it
+                       | must be importable (picklable) by the workers.
+        @type function: function
+        @param jobs: A list of (key, args) tuples. The key identifies the
+                   | job (usually the device) in failure reports. Keys
+                   | don't need to be unique, as jobs are tracked by their
+                   | position in the list.
+        @type jobs: list
+        @param callback: Called with the return value of each job.
+        @type callback: function
+        @param on_failure: Called with (key, reason, message, error_class)
+                         | for every job that failed, where reason is
+                         | 'error' if it raised an exception, 'timeout' if
+                         | it overran device_timeout, or 'cancelled' if
+                         | job_timeout passed first. error_class is the name
+                         | of the exception class, if any.
+        @type on_failure: function
+        @param device_timeout: Wall-clock seconds a single job may run.
+        @type device_timeout: int
+        @param job_timeout: Wall-clock seconds for all of the jobs together.
+        @type job_timeout: int
+
+        @returns: The (key, message) tuples of the jobs that timed out or
+                | were cancelled, in the order they were given up on.
+        @rtype: list
+        """
+        results = self.queue()
+        pending = set()
+        # jobs are tracked by their index, so that the same device given
+        # twice is run and reported twice; the key is only for display.
+        keys = []
+        for index, (key, args) in enumerate(jobs):
+            keys.append(key)
+            pending.add(index)
+            self.submit(_tracked, (results, index, function, tuple(args),
+                                   device_timeout))
+        on_failure = on_failure or (lambda key, reason, message, cls: None)
+        started = {}
+        stragglers = []
+        deadline = time.time() + job_timeout if job_timeout else None
+        while pending:
+            wait = .5
+            now = time.time()
+            if deadline is not None:
+                wait = min(wait, max(deadline - now, 0))
+            try:
+                kind, index, value = results.get(True, wait)
+            except Queue.Empty:
+                pass
+            else:
+                if kind == 'start':
+                    started[index] = value
+                elif index in pending:
+                    if kind == 'done':
+                        pending.discard(index)
+                        callback(value)
+                    elif kind == 'error':
+                        pending.discard(index)
+                        on_failure(keys[index], kind,
+                                   'raised %s: %s' % value, value[0])
+                    else:  # interrupted in the worker by its alarm
+                        started[index] = 0
+            now = time.time()
+            if device_timeout:
+                for index in sorted(i for i in pending if i in started and
+                                    now - started[i] > device_timeout):
+                    pending.discard(index)
+                    message = ('exceeded the per-device deadline of %s '
+                               'seconds and was cancelled.' % device_timeout)
+                    stragglers.append((keys[index], message))
+                    on_failure(keys[index], 'timeout', message, '')
+                    if self.backend == 'thread':
+                        self._replace_worker()
+            if deadline is not None and now >= deadline:
+                for index in sorted(pending):
+                    if index in started:
+                        message = ('was still running when the job deadline '
+                                   'of %s seconds passed, and was cancelled.'
+                                   % job_timeout)
+                    else:
+                        message = ('was not started before the job deadline '
+                                   'of %s seconds passed.' % job_timeout)
+                    stragglers.append((keys[index], message))
+                    on_failure(keys[index], 'cancelled', message, '')
+                pending.clear()
+        if not stragglers:
+            self._pool.close()
+            self._pool.join()
+        else:
+            self._pool.terminate()
+            # a thread stuck on a device can't be joined; it is a daemon
+            # thread, so it won't hold up the interpreter on exit either.
+            if self.backend == 'process':
+                self._pool.join()
+        return stragglers
+
+    def _replace_worker(self):
+        """ Start another thread in place of one held by a hung job. """
+        # ThreadPool has no public way to grow. Its worker handler starts
+        # threads until there are _processes of them, and the hung thread
+        # stays in the pool, taking jobs again if it ever returns.
+        self._pool._processes += 1
+        self._pool._repopulate_pool()
+
+    def join(self):
+        """ Wait for every submitted job to complete, then stop the workers.
+
+        Queues from queue() stay usable until the executor is discarded.
+        """
+        self._pool.close()
+        self._pool.join()
+
+
+def _tracked(results, key, function, args, device_timeout):
+    """ Run one job in a worker, reporting its start and outcome on a queue.
+
+    @param results: The queue Executor.run() is reading.
+    @type results: Queue
+    @param key: The index of the job, that its start and outcome are
+              | reported under.
+    @type key: int
+    @param function: The job function.
+    @type function: function
+    @param args: The arguments for the function.
+    @type args: tuple
+    @param device_timeout: The per-job deadline in seconds, or None. Used to
+                         | arm SIGALRM when running as the main thread of a
+                         | worker process.
+    @type device_timeout: int
+
+    @returns: None
+    """
+    results.put(('start', key, time.time()))
+    alarm = (device_timeout and hasattr(signal, 'SIGALRM') and
+             threading.current_thread().name == 'MainThread')
+    if alarm:
+        signal.signal(signal.SIGALRM, _alarm)
+        signal.alarm(int(math.ceil(device_timeout)))
+    try:
+        result = function(*args)
+    except DeviceTimeoutError:
+        results.put(('timeout', key, None))
+    except Exception as e:
+        results.put(('error', key, (e.__class__.__name__, str(e))))
+    else:
+        results.put(('done', key, result))
+    finally:
+        if alarm:
+            signal.alarm(0)
+
+
+def _alarm(signum, frame):
+    """ SIGALRM handler interrupting a job that overran its deadline. """
+    raise DeviceTimeoutError('The per-device deadline was exceeded.')
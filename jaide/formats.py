@@ -0,0 +1,125 @@
+""" Output formats for device results.
+
+The default text format is meant for people. The jsonl and csv formats emit
+one record per device, as each device completes, for pipelines that would
+otherwise have to regex-parse the colored text.
+"""
+# standard modules
+from collections import OrderedDict
+import csv
+import json
+from StringIO import StringIO
+# intra-Jaide imports
+from color_utils import strip_color
+from spool import text
+
+FORMATS = ['text', 'jsonl', 'csv']
+# the columns of the csv format. Structured data is JSON encoded.
+CSV_FIELDS = ['host', 'command', 'status', 'error_class', 'error',
+              'connect_time', 'total_time', 'bytes', 'output', 'data']
+
+
+class Formatter(object):
+
+    """ Turn DeviceResults into text, JSON Lines or CSV records. """
+
+    def __init__(self, format='text', command=None, arguments=None):
+        """ Initialize the formatter.
+
+        @param format: One of FORMATS.
+        @type format: str
+        @param command: The name of the jaide command that was run, added to
+                      | every record.
+        @type command: str
+        @param arguments: The arguments of the command, added to every
+                        | jsonl record.
+        @type arguments: dict
+        """
+        if format not in FORMATS:
+            raise ValueError('format must be one of: %s' % ', '.join(FORMATS))
+        self.format = format
+        self.command = command
+        self.arguments = arguments or {}
+
+    @property
+    def extension(self):
+        """ The file extension for the format. """
+        return 'txt' if self.format == 'text' else self.format
+
+    def header(self):
+        """ The text that has to start a file or stream, if any. """
+        if self.format == 'csv':
+            return _csv_line(CSV_FIELDS)
+        return ''
+
+    def record(self, result):
+        """ Build the record for a result.
+
+        @param result: The result of a device job.
+        @type result: jaide.result.DeviceResult
+
+        @returns: The record, with the keys 'host', 'command', 'arguments',
+                | 'status', 'error_class', 'error', 'timings', 'bytes',
+                | 'output' and 'data'. The output is stripped of color, and
+                | bytes that aren't valid UTF-8 are replaced, so that a
+                | device sending them can't stop the run.
+        @rtype: OrderedDict
+        """
+        return _decode(OrderedDict([
+            ('host', result.host),
+            ('command', self.command),
+            ('arguments', self.arguments),
+            ('status', result.status),
+            ('error_class', result.error_class or None),
+            ('error', result.error.strip() or None),
+            ('timings', result.timings),
+            ('bytes', result.payload_bytes),
+            ('output', strip_color(text(result.output))),
+            ('data', result.data),
+        ]))
+
+    def format_result(self, result):
+        """ Render a result in the format.
+
+        @param result: The result of a device job.
+        @type result: jaide.result.DeviceResult
+
+        @returns: The rendered result. Records of the jsonl and csv formats
+                | end with a newline.
+        @rtype: str
+        """
+        if self.format == 'text':
+            return result.render()
+        record = self.record(result)
+        if self.format == 'jsonl':
+            return json.dumps(record) + '\n'
+        timings = record.pop('timings')
+        record['connect_time'] = _seconds(timings.get('connect'))
+        record['total_time'] = _seconds(timings.get('total'))
+        if record['data'] is not None:
+            record['data'] = json.dumps(record['data'])
+        return _csv_line([record[field] for field in CSV_FIELDS])
+
+
+def _decode(value):
+    """ Turn the byte strings in a record into unicode, recursively. """
+    if isinstance(value, str):
+        return value.decode('utf-8', 'replace')
+    if isinstance(value, dict):
+        return value.__class__((_decode(key), _decode(item))
+                               for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [_decode(item) for item in value]
+    return value
+
+
+def _seconds(value):
+    return '' if value is None else '%.3f' % value
+
+
+def _csv_line(values):
+    line = StringIO()
+    csv.writer(line, lineterminator='\n').writerow([
+        value.encode('utf-8') if isinstance(value, unicode) else
+        '' if value is None else value for value in values])
+    return line.getvalue()
@@ -0,0 +1,231 @@
+""" A pool of processes for the CPU heavy stages of device jobs.
+
+The thread back end runs hundreds of device sessions at once, which is
+right for waiting on the network, but everything those threads parse takes
+turns on the GIL: xpath filtering a full routing table in xml, or diffing
+two configurations, uses a single core however many are free. With the
+--parse-workers option, the CLI starts a pool of processes before any
+thread, and the I/O threads hand their replies to it through offload().
+A bounded number of payloads are in flight at once. When they are all
+taken, an I/O thread waits for one to complete before reading more, so
+that replies don't pile up in memory faster than they can be parsed.
+
+Replies that were spooled to a temporary file are parsed by a worker
+straight from the file, without sending the reply itself over the pipe.
+
+A worker that dies in the middle of a job, killed for running out of
+memory for example, never returns its result. The jobs waiting when the
+workers of the pool change are parsed in place instead, and no job is
+waited for longer than the session timeout of its device.
+"""
+# standard modules
+import multiprocessing
+import os
+import signal
+import threading
+import time
+# intra-Jaide imports
+from errors import JaideError
+from spool import SpoolBuffer
+from utils import etree
+
+# the pool offload() hands work to, set by start().
+_pipeline = None
+
+
+class PipelineError(JaideError):
+
+    """ A parse job didn't complete in the pool. """
+
+    pass
+
+
+class WorkerLostError(PipelineError):
+
+    """ A worker of the pool exited while a job was waiting on it. """
+
+    pass
+
+
+class ParsePool(object):
+
+    """ A process pool taking a bounded number of jobs from I/O threads. """
+
+    def __init__(self, workers, backlog=None):
+        """ Start the worker processes.
+
+        @param workers: The number of processes.
+        @type workers: int
+        @param backlog: The most jobs in flight at once, twice the number of
+                      | workers by default. Callers wait for a free slot
+                      | past that.
+        @type backlog: int
+        """
+        self.workers = max(workers, 1)
+        self.backlog = backlog or self.workers * 2
+        self.pid = os.getpid()
+        self._slots = threading.BoundedSemaphore(self.backlog)
+        # set when a job was given up on, which join() would wait for.
+        self._abandoned = False
+        self._pool = multiprocessing.Pool(self.workers,
+                                          initializer=_init_worker)
+
+    def run(self, function, *args, **kwargs):
+        """ Run a function in a worker process, and return its result.
+
+        @param function: A module level function, so that it can be sent
+                       | to the workers.
+        @type function: function
+        @param args: The arguments of the function. A spilled SpoolBuffer
+                   | is sent as the path of its temporary file, which the
+                   | function gets as an open file, and a SpoolBuffer kept
+                   | in memory as a string.
+        @param timeout: The keyword argument 'timeout' is the most seconds
+                      | to wait for the result, or None to wait as long as
+                      | the pool is intact.
+
+        @returns: What the function returned.
+
+        @raises: What the function raised. WorkerLostError if a worker of
+               | the pool exited before the result came, as the job may
+               | have been lost with it, and PipelineError if the timeout
+               | passed first.
+        """
+        timeout = kwargs.pop('timeout', None)
+        payload = tuple(_Spooled(arg.name) if isinstance(arg, SpoolBuffer)
+                        and arg.spilled else arg for arg in args)
+        deadline = time.time() + timeout if timeout else None
+        with self._slots:
+            workers = self._workers()
+            job = self._pool.apply_async(_call, (function, payload))
+            # waiting with a timeout keeps the thread interruptible.
+            while not job.ready():
+                job.wait(.5)
+                if job.ready():
+                    break
+                if self._workers() != workers:
+                    self._abandoned = True
+                    raise WorkerLostError('A parse worker exited while '
+                                          'running %s.' % function.__name__)
+                if deadline is not None and time.time() > deadline:
+                    self._abandoned = True
+                    raise PipelineError('%s did not complete in the parse '
+                                        'workers within %s seconds.' %
+                                        (function.__name__, timeout))
+            ok, value = job.get()
+        if ok:
+            return value
+        if isinstance(value, _ParseFailure):
+            raise etree.XMLSyntaxError(*value.args)
+        raise value
+
+    def _workers(self):
+        """ The process ids of the workers, which change as they exit. """
+        return set(worker.pid for worker in self._pool._pool)
+
+    def close(self):
+        """ Stop the worker processes once their jobs are done.
+
+        Purpose: A job lost with a worker never completes, so the workers
+               | are terminated instead if any job was given up on.
+        """
+        if self._abandoned:
+            self._pool.terminate()
+        else:
+            self._pool.close()
+        self._pool.join()
+
+
+class _Spooled(object):
+
+    """ The temporary file of a spilled SpoolBuffer, sent to a worker. """
+
+    def __init__(self, name):
+        self.name = name
+
+
+class _ParseFailure(object):
+
+    """ An lxml syntax error, which can't be pickled itself. """
+
+    def __init__(self, error):
+        line, column = error.position
+        self.args = (error.msg, error.code, line, column)
+
+
+def _init_worker():
+    # Ctrl-C is handled by the parent, which closes the pool.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def _call(function, args):
+    """ Run a function in a worker, returning (ok, result or error). """
+    files = []
+    try:
+        call_args = []
+        for arg in args:
+            if isinstance(arg, _Spooled):
+                arg = open(arg.name, 'rb')
+                files.append(arg)
+            call_args.append(arg)
+        return True, function(*call_args)
+    except etree.XMLSyntaxError as e:
+        return False, _ParseFailure(e)
+    except Exception as e:
+        return False, e
+    finally:
+        for handle in files:
+            handle.close()
+
+
+def start(workers, backlog=None):
+    """ Start the pool that offload() uses.
+
+    Purpose: Must be called before any thread is started, since the worker
+           | processes are forked from the caller.
+
+    @param workers: The number of processes.
+    @type workers: int
+    @param backlog: The most jobs in flight at once.
+    @type backlog: int
+
+    @returns: The pool.
+    @rtype: ParsePool
+    """
+    global _pipeline
+    stop()
+    _pipeline = ParsePool(workers, backlog)
+    return _pipeline
+
+
+def stop():
+    """ Stop the pool, if one was started. """
+    global _pipeline
+    if _pipeline is not None:
+        pipeline, _pipeline = _pipeline, None
+        pipeline.close()
+
+
+def offload(function, *args, **kwargs):
+    """ Run a function in the pool if there is one, or else in place.
+
+    Purpose: The pool is only used from the process that started it, so a
+           | process forked later, such as a worker of the process back
+           | end, parses in place. So is a job that may have been lost
+           | with a worker of the pool that exited.
+
+    @param function: A module level function.
+    @type function: function
+    @param args: The arguments of the function, see ParsePool.run().
+    @param timeout: The keyword argument 'timeout' is the most seconds to
+                  | wait for the pool, see ParsePool.run().
+
+    @returns: What the function returned.
+    """
+    pipeline = _pipeline
+    if pipeline is None or pipeline.pid != os.getpid():
+        return function(*args)
+    try:
+        return pipeline.run(function, *args, **kwargs)
+    except WorkerLostError:
+        return function(*args)
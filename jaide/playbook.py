@@ -0,0 +1,373 @@
+""" Multi-step playbooks, run on each device over the sessions it already has.
+
+A change window usually chains several jaide commands against the same
+devices: compare the change, commit it confirmed, check that the device is
+still healthy, then confirm the commit. Run as separate jaide commands, every
+step connects to every device again. A playbook is a JSON file listing those
+steps, which 'jaide playbook' runs one after the other on each device, over
+one SSH session for the operational and shell steps and SCP transfers, and
+one NETCONF session for the other steps, each opened at most once.
+
+    {
+        "name": "bgp-edge-peer",
+        "steps": [
+            {"name": "preview", "action": "compare",
+             "commands": "bgp-edge-peer.set"},
+            {"name": "apply", "action": "commit",
+             "commands": "bgp-edge-peer.set", "confirm": 300,
+             "comment": "CHG-1234", "when": "preview.changed"},
+            {"action": "wait", "seconds": 60},
+            {"name": "verify", "action": "operational",
+             "commands": "show bgp summary", "refuse": "Active|Connect"},
+            {"action": "commit", "blank": true, "comment": "CHG-1234"}
+        ]
+    }
+
+Each step has an action, the parameters of that action, as for the jaide
+command of the same name, and optionally:
+
+  name: How the step is shown and referred to by later steps. Defaults to
+      its number, starting at 1.
+  when: When to run the step. 'ok' (the default) runs it if no step has
+      failed so far, 'failed' only if one has, and 'always' in any case.
+      'STEP.ok', 'STEP.failed', 'STEP.skipped', 'STEP.changed' and
+      'STEP.unchanged' depend on an earlier step: 'changed' is a compare
+      step that found differences.
+  expect: A regular expression that the output of the step must match.
+  refuse: A regular expression that the output of the step must not match.
+
+A commit step fails unless the device reports the commit (or the commit
+check) as complete, so a rejected change stops the playbook, and a commit
+confirmed that isn't confirmed by a later step is rolled back by the device.
+"""
+# standard modules
+import json
+from os import path
+import re
+import time
+# intra-Jaide imports
+import wrap
+from core import Jaide
+from errors import JaideError
+from color_utils import color, color_diffs, strip_color
+
+# a parameter that a step has to give.
+REQUIRED = object()
+# the parameters of each action, and their defaults.
+ACTIONS = {
+    'operational': {'commands': REQUIRED, 'format': 'text', 'xpath': False,
+                    'batch': False, 'parallel': 1},
+    'shell': {'commands': REQUIRED, 'batch': True},
+    'compare': {'commands': REQUIRED},
+    'commit': {'commands': '', 'check': False, 'sync': False,
+               'comment': None, 'confirm': None, 'at_time': None,
+               'blank': False},
+    'info': {},
+    'health': {},
+    'errors': {'fpcs': None},
+    'diff_config': {'second_host': REQUIRED, 'mode': 'set'},
+    'pull': {'source': REQUIRED, 'destination': REQUIRED},
+    'push': {'source': REQUIRED, 'destination': REQUIRED},
+    'wait': {'seconds': REQUIRED},
+}
+# the actions that use the NETCONF session, all others use the SSH session.
+NETCONF_ACTIONS = ('compare', 'commit', 'info', 'health', 'errors',
+                   'diff_config')
+# the parameters that can be the path of a file, relative to the playbook.
+_FILE_PARAMETERS = ('commands',)
+_LOCAL_PATHS = {'pull': 'destination', 'push': 'source'}
+_STEP_KEYS = ('name', 'action', 'when', 'expect', 'refuse')
+_STATES = ('ok', 'failed', 'skipped', 'changed', 'unchanged')
+# what wrap.commit() says when the commit or commit check went through.
+_COMMITTED = ('Commit complete on device', 'Commit staged to happen at',
+              'configuration check succeeds')
+
+
+class PlaybookError(JaideError):
+
+    """ Raised for a playbook that can't be read or isn't valid. """
+
+    pass
+
+
+class Playbook(object):
+
+    """ The steps of a playbook, run on one device at a time. """
+
+    def __init__(self, steps, name=None):
+        """ Initialize the playbook, checking its steps.
+
+        @param steps: The steps, as dictionaries with an 'action', the
+                    | parameters of the action, and optionally a 'name',
+                    | 'when', 'expect' and 'refuse'.
+        @type steps: list
+        @param name: The name of the playbook, shown in the results.
+        @type name: str
+
+        @raises PlaybookError: If a step is not valid.
+        """
+        self.name = name
+        self.steps = []
+        if not isinstance(steps, list) or not steps:
+            raise PlaybookError('A playbook needs a list of steps.')
+        for number, step in enumerate(steps, 1):
+            self.steps.append(self._check_step(number, step))
+
+    def _check_step(self, number, step):
+        """ Check a step, and fill in its defaults. """
+        if not isinstance(step, dict):
+            raise PlaybookError('Step %d is not an object.' % number)
+        action = step.get('action')
+        if action not in ACTIONS:
+            raise PlaybookError("Step %d has an unknown action '%s', use one "
+                                'of: %s.' % (number, action,
+                                             ', '.join(sorted(ACTIONS))))
+        name = unicode(step.get('name', number))
+        if name in [other['name'] for other in self.steps]:
+            raise PlaybookError("Step %d has the name '%s' of an earlier step."
+                                % (number, name))
+        unknown = set(step) - set(_STEP_KEYS) - set(ACTIONS[action])
+        if unknown:
+            raise PlaybookError('Step %s has unknown parameters for %s: %s.'
+                                % (name, action, ', '.join(sorted(unknown))))
+        checked = {'name': name, 'action': action,
+                   'when': self._check_when(name, step.get('when', 'ok'))}
+        for key in ('expect', 'refuse'):
+            try:
+                checked[key] = step.get(key) and re.compile(step[key],
+                                                            re.MULTILINE)
+            except (re.error, TypeError) as e:
+                raise PlaybookError('Step %s has an invalid %s expression: %s'
+                                    % (name, key, e))
+        params = {}
+        for key, default in ACTIONS[action].items():
+            params[key] = step.get(key, default)
+            if params[key] is REQUIRED:
+                raise PlaybookError('Step %s needs the %s parameter for %s.'
+                                    % (name, key, action))
+        if action == 'commit' and not (params['commands'] or
+                                       params['blank']):
+            raise PlaybookError('Step %s needs commands, or "blank": true.'
+                                % name)
+        if action == 'wait' and not isinstance(params['seconds'],
+                                               (int, float)):
+            raise PlaybookError('Step %s needs a number of seconds.' % name)
+        checked['params'] = params
+        return checked
+
+    def _check_when(self, name, when):
+        """ Check the condition of a step against the steps before it. """
+        if when in ('ok', 'failed', 'always'):
+            return when
+        step, _, state = unicode(when).rpartition('.')
+        if state not in _STATES or step not in [other['name'] for other
+                                                in self.steps]:
+            raise PlaybookError(
+                "Step %s has the condition '%s', use ok, failed, always, or "
+                'STEP.%s with the name of an earlier step.' % (
+                    name, when, '|'.join(_STATES)))
+        return when
+
+    @classmethod
+    def load(cls, filename):
+        """ Read a playbook from a JSON file.
+
+        Purpose: The files of commands and the local paths of pull and push
+               | steps are taken relative to the directory of the playbook,
+               | so that a playbook and its files can be kept together and
+               | run from anywhere.
+
+        @param filename: The path of the playbook.
+        @type filename: str
+
+        @returns: The playbook.
+        @rtype: Playbook
+
+        @raises PlaybookError: If the file can't be read, or isn't valid.
+        """
+        try:
+            with open(filename, 'rb') as playbook_file:
+                book = json.load(playbook_file)
+        except (IOError, ValueError) as e:
+            raise PlaybookError('Could not read the playbook %s: %s' %
+                                (filename, e))
+        if isinstance(book, list):
+            book = {'steps': book}
+        if not isinstance(book, dict):
+            raise PlaybookError('A playbook is an object with a list of '
+                                'steps.')
+        base = path.dirname(path.abspath(filename))
+        for step in book.get('steps') or []:
+            if not isinstance(step, dict):
+                continue
+            for key in _FILE_PARAMETERS:
+                value = step.get(key)
+                if (isinstance(value, basestring) and
+                        path.isfile(path.join(base, value))):
+                    step[key] = path.join(base, value)
+            local = _LOCAL_PATHS.get(step.get('action'))
+            if isinstance(step.get(local), basestring):
+                step[local] = path.join(base, path.expanduser(step[local]))
+        return cls(book.get('steps'),
+                   book.get('name') or path.splitext(
+                       path.basename(filename))[0])
+
+    def run(self, jaide, check=False):
+        """ Run the steps on a device.
+
+        Purpose: The SSH steps use the session of the jaide object, and
+               | the NETCONF steps a second session to the device, which is
+               | opened by the first of them and closed at the end, so that
+               | neither is closed to open the other between steps.
+
+        @param jaide: The jaide connection to the device.
+        @type jaide: jaide.Jaide object
+        @param check: Set to True to run the commit steps as commit checks,
+                    | for a dry run of the playbook.
+        @type check: bool
+
+        @returns: The output of the steps, and their results.
+        @rtype: tuple
+        """
+        netconf = None
+        results = {}
+        failed = False
+        output = ""
+        started = time.time()
+        try:
+            for number, step in enumerate(self.steps, 1):
+                output += color('Step %d/%d: %s (%s)\n' % (
+                    number, len(self.steps), step['name'], step['action']),
+                    'yel')
+                result = {'name': step['name'], 'action': step['action'],
+                          'status': 'skipped', 'changed': None,
+                          'seconds': 0.0, 'output': '', 'error': None}
+                results[step['name']] = result
+                if not self._should_run(step['when'], results, failed):
+                    output += ('Skipped, an earlier step failed.\n'
+                               if step['when'] == 'ok' else
+                               'Skipped, the condition %s is not met.\n' %
+                               step['when'])
+                    continue
+                if step['action'] in NETCONF_ACTIONS:
+                    if netconf is None:
+                        netconf = Jaide(jaide.host, jaide.username,
+                                        jaide.password,
+                                        connect_timeout=jaide.connect_timeout,
+                                        session_timeout=jaide.session_timeout,
+                                        connect=False, port=jaide.port)
+                        # one set of timings for both sessions.
+                        netconf.timings = jaide.timings
+                    conn = netconf
+                else:
+                    conn = jaide
+                step_started = time.time()
+                self._run_step(conn, step, result, check)
+                result['seconds'] = round(time.time() - step_started, 3)
+                output += result['output']
+                if result['status'] == 'ok':
+                    output += color('Step %s ok, %.1fs\n' % (
+                        step['name'], result['seconds']))
+                else:
+                    failed = True
+                    output += color('Step %s failed, %.1fs: %s\n' % (
+                        step['name'], result['seconds'], result['error']),
+                        'red')
+        finally:
+            if netconf is not None:
+                netconf.disconnect()
+        steps = [results[step['name']] for step in self.steps
+                 if step['name'] in results]
+        counts = dict((status, len([step for step in steps
+                                    if step['status'] == status]))
+                      for status in ('ok', 'failed', 'skipped'))
+        counts['skipped'] += len(self.steps) - len(steps)
+        output += color('Playbook %s %s on %s: %d ok, %d failed, %d skipped.'
+                        '\n' % (self.name, 'failed' if failed else
+                                'completed', jaide.host, counts['ok'],
+                                counts['failed'], counts['skipped']),
+                        'red' if failed else 'grn')
+        for step in steps:
+            step['output'] = strip_color(step['output'])
+        return output, {'playbook': self.name, 'ok': not failed,
+                        'check': check, 'seconds': round(time.time() -
+                                                         started, 3),
+                        'counts': counts, 'steps': steps}
+
+    @staticmethod
+    def _should_run(when, results, failed):
+        """ Evaluate the condition of a step. """
+        if when == 'always':
+            return True
+        if when == 'ok':
+            return not failed
+        if when == 'failed':
+            return failed
+        name, _, state = when.rpartition('.')
+        result = results[name]
+        if state == 'changed':
+            return result['changed'] is True
+        if state == 'unchanged':
+            return result['changed'] is False
+        return result['status'] == state
+
+    @staticmethod
+    def _run_step(jaide, step, result, check):
+        """ Run one step, filling in its result. """
+        params = step['params']
+        action = step['action']
+        try:
+            if action == 'operational':
+                output = wrap.command(jaide, params['commands'],
+                                      params['format'], params['xpath'],
+                                      params['batch'], params['parallel'])
+            elif action == 'shell':
+                output = wrap.shell(jaide, params['commands'],
+                                    params['batch'])
+            elif action == 'compare':
+                diff = jaide.compare_config(params['commands']) or ''
+                result['changed'] = bool(diff.strip())
+                output = color('show | compare:\n', 'yel') + color_diffs(diff)
+            elif action == 'commit':
+                output = wrap.commit(jaide, params['commands'],
+                                     params['check'] or check, params['sync'],
+                                     params['comment'], params['confirm'],
+                                     params['at_time'], params['blank'])
+            elif action == 'info':
+                output = wrap.device_info(jaide)
+            elif action == 'health':
+                output = wrap.health_check(jaide)
+            elif action == 'errors':
+                output = wrap.interface_errors(jaide, fpcs=params['fpcs'])
+            elif action == 'diff_config':
+                output = wrap.diff_config(jaide, params['second_host'],
+                                          params['mode'])
+            elif action == 'pull':
+                output = wrap.pull(jaide, params['source'],
+                                   params['destination'], False, True)
+            elif action == 'push':
+                output = wrap.push(jaide, params['source'],
+                                   params['destination'], False)
+            else:  # wait
+                time.sleep(params['seconds'])
+                output = 'Waited %s seconds.\n' % params['seconds']
+        except Exception as e:
+            result['status'] = 'failed'
+            result['error'] = '%s: %s' % (e.__class__.__name__, e)
+            return
+        if not output.endswith('\n'):
+            output += '\n'
+        result['output'] = output
+        plain = strip_color(output)
+        if action == 'commit' and not any(marker in plain
+                                          for marker in _COMMITTED):
+            result['error'] = 'the commit did not complete'
+        elif action in ('pull', 'push') and '!!! ' in plain:
+            result['error'] = 'the copy failed'
+        elif step['expect'] and not step['expect'].search(plain):
+            result['error'] = 'the output does not match /%s/' % (
+                step['expect'].pattern)
+        elif step['refuse'] and step['refuse'].search(plain):
+            result['error'] = 'the output matches /%s/' % (
+                step['refuse'].pattern)
+        result['status'] = 'failed' if result['error'] else 'ok'
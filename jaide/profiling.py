@@ -0,0 +1,213 @@
+""" CPU and memory profiling of CLI runs, for the --profile option.
+
+Every device job is run under its own cProfile profiler in the worker
+(thread or process) that picks it up, and the parent is profiled for the
+whole run. The per-job statistics are written to DIR/jobs/ and merged into
+a single pstats file for the command when the run is over, along with a
+text report of the top functions.
+
+Memory is reported with tracemalloc when the interpreter has it. Where it
+doesn't (Python 2), the report falls back to the growth in live objects per
+type from the gc module, and the peak resident size from the resource
+module.
+"""
+from __future__ import print_function
+# standard modules
+import cProfile
+import gc
+import glob
+import os
+from os import path
+import pstats
+import re
+import sys
+import time
+from StringIO import StringIO
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+try:
+    import tracemalloc
+except ImportError:  # Python 2
+    tracemalloc = None
+
+# the number of entries in the text reports.
+TOP = 40
+
+
+def run_profiled(directory, name, function, *args):
+    """ Run a function under cProfile, saving its statistics and memory use.
+
+    Purpose: Used in place of the job function in the workers. The
+           | statistics are written to DIR/jobs/NAME.pstats, and the
+           | memory report to DIR/jobs/NAME.memory.txt.
+
+    @param directory: The --profile directory.
+    @type directory: str
+    @param name: The name of the job, usually the device.
+    @type name: str
+    @param function: The job function.
+    @type function: function
+    @param args: The arguments for the function.
+
+    @returns: What the function returned.
+    """
+    jobs = path.join(directory, 'jobs')
+    filename = path.join(jobs, _safe(name))
+    memory = MemoryTracker()
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        return function(*args)
+    finally:
+        profiler.disable()
+        try:
+            os.makedirs(jobs)
+        except OSError:  # already exists
+            pass
+        profiler.dump_stats(filename + '.pstats')
+        with open(filename + '.memory.txt', 'w') as report:
+            report.write(memory.report(name))
+
+
+class MemoryTracker(object):
+
+    """ Measure the memory allocated between creation and report(). """
+
+    def __init__(self):
+        self.started = time.time()
+        if tracemalloc is not None:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+            self._snapshot = tracemalloc.take_snapshot()
+        else:
+            self._counts = _type_counts()
+
+    def report(self, title, top=10):
+        """ Describe the memory use since the tracker was created.
+
+        @param title: The heading of the report.
+        @type title: str
+        @param top: The number of allocation sites (or object types) listed.
+        @type top: int
+
+        @returns: The report.
+        @rtype: str
+        """
+        lines = ['== %s (%.2fs)' % (title, time.time() - self.started)]
+        if tracemalloc is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            lines.append('traced memory: %s current, %s peak' % (
+                _size(current), _size(peak)))
+            stats = tracemalloc.take_snapshot().compare_to(self._snapshot,
+                                                          'lineno')
+            lines.append('top allocations since the start:')
+            lines.extend('  %s' % stat for stat in stats[:top])
+        else:
+            counts = _type_counts()
+            growth = sorted(((counts[kind] - self._counts.get(kind, 0), kind)
+                             for kind in counts), reverse=True)
+            lines.append('live objects: %d (tracemalloc is not available, '
+                         'counting objects per type instead; with threads '
+                         'this includes the work of other jobs)' %
+                         sum(counts.values()))
+            lines.append('top growth in live objects since the start:')
+            lines.extend('  %+9d %s' % (delta, kind)
+                         for delta, kind in growth[:top] if delta > 0)
+        if resource is not None:
+            maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # ru_maxrss is in bytes on OS X, kilobytes elsewhere.
+            if sys.platform != 'darwin':
+                maxrss *= 1024
+            lines.append('peak resident size of the process: %s' %
+                         _size(maxrss))
+        return '\n'.join(lines) + '\n'
+
+
+class Profile(object):
+
+    """ Profile the parent of a CLI run, and merge in the worker profiles. """
+
+    def __init__(self, directory, command):
+        """ Initialize the profile.
+
+        @param directory: The --profile directory. It is created if needed.
+        @type directory: str
+        @param command: The name of the jaide command being run, used for
+                      | the names of the merged files.
+        @type command: str
+        """
+        self.directory = directory
+        self.command = command
+        self.jobs = path.join(directory, 'jobs')
+        self._profiler = cProfile.Profile()
+        self._memory = None
+
+    def start(self):
+        """ Clear the statistics of a previous run and start profiling. """
+        for pattern in ('*.pstats', '*.memory.txt'):
+            for old in glob.glob(path.join(self.jobs, pattern)):
+                os.remove(old)
+        try:
+            os.makedirs(self.jobs)
+        except OSError:  # already exists
+            pass
+        self._memory = MemoryTracker()
+        self._profiler.enable()
+        return self
+
+    def stop(self):
+        """ Stop profiling and write the merged reports.
+
+        Purpose: Writes DIR/COMMAND.pstats with the statistics of the
+               | parent and every job, DIR/COMMAND-profile.txt with the top
+               | functions by cumulative and by internal time, and
+               | DIR/COMMAND-memory.txt with the memory report of the parent
+               | followed by those of the jobs.
+
+        @returns: The paths of the files written.
+        @rtype: list
+        """
+        self._profiler.disable()
+        base = path.join(self.directory, self.command)
+        parent = path.join(self.jobs, 'parent.pstats')
+        self._profiler.dump_stats(parent)
+        files = sorted(glob.glob(path.join(self.jobs, '*.pstats')))
+        stats = pstats.Stats(*files)
+        stats.dump_stats(base + '.pstats')
+        text = StringIO()
+        stats.stream = text
+        text.write('Merged profile of the parent and %d jobs\n' %
+                   (len(files) - 1))
+        stats.sort_stats('cumulative').print_stats(TOP)
+        stats.sort_stats('time').print_stats(TOP)
+        with open(base + '-profile.txt', 'w') as report:
+            report.write(text.getvalue())
+        with open(base + '-memory.txt', 'w') as report:
+            report.write(self._memory.report('parent'))
+            for filename in sorted(glob.glob(path.join(self.jobs,
+                                                       '*.memory.txt'))):
+                with open(filename) as job:
+                    report.write('\n' + job.read())
+        return [base + '.pstats', base + '-profile.txt', base + '-memory.txt']
+
+
+def _type_counts():
+    counts = {}
+    for obj in gc.get_objects():
+        kind = type(obj).__name__
+        counts[kind] = counts.get(kind, 0) + 1
+    return counts
+
+
+def _safe(name):
+    return re.sub(r'[^\w.-]', '_', name)
+
+
+def _size(num):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(num) < 1024.0:
+            return '%.1f %s' % (num, unit)
+        num /= 1024.0
+    return '%.1f TB' % num
@@ -0,0 +1,330 @@
+""" Aggregated progress reporting for SCP transfers to many devices.
+
+SCP progress callbacks fire on every chunk of every file. Instead of having
+each worker print those directly, a ProgressReporter on the worker side
+turns them into rate-limited byte counters and puts them on a queue. A
+single ProgressMonitor in the parent reads that queue, keeps the state of
+every device, and periodically renders one aggregated view (or hands the
+summary to a callback for library users).
+"""
+from __future__ import print_function
+# standard modules
+from os import path
+import os
+import Queue
+import sys
+import threading
+import time
+# non-standard modules:
+import click
+
+
+class ProgressReporter(object):
+
+    """ Worker side: turn SCP progress callbacks into rate-limited events.
+
+    An instance is passed as the `progress` argument of Jaide.scp_pull() or
+    Jaide.scp_push(). Events are tuples of (host, state, bytes_done,
+    bytes_total, detail) and are put on `queue`, or handed to `callback`.
+    State is one of 'progress', 'done' or 'failed'. bytes_total is None
+    when the size of the whole transfer isn't known up front (pulling a
+    directory), and detail is the current filename, or the error message
+    when the state is 'failed'.
+    """
+
+    def __init__(self, host, queue=None, callback=None, total=None,
+                 interval=0.5):
+        """ Initialize the reporter.
+
+        @param host: The device the transfer is for.
+        @type host: str
+        @param queue: A Queue.Queue or multiprocessing queue shared with a
+                    | ProgressMonitor.
+        @type queue: Queue
+        @param callback: A function receiving each event instead, when no
+                       | queue is given.
+        @type callback: function
+        @param total: The total number of bytes of the transfer, if known.
+        @type total: int
+        @param interval: The minimum number of seconds between two
+                       | progress events.
+        @type interval: float
+        """
+        self.host = host
+        self.queue = queue
+        self.callback = callback
+        self.total = total
+        self.interval = interval
+        self._filename = None
+        self._finished = 0  # bytes of the files that are already complete
+        self._current = 0  # bytes sent of the file in flight
+        self._last = 0
+
+    @property
+    def sent(self):
+        """ The number of bytes transferred so far. """
+        return self._finished + self._current
+
+    def __call__(self, filename, size, sent, *args):
+        """ The SCP progress callback.
+
+        Purpose: Matches the signature of the scp module progress callback.
+               | Counters are updated on every call, but an event is only
+               | emitted when a file completes or `interval` has passed.
+        """
+        if filename != self._filename:
+            self._filename = filename
+            self._current = 0
+        size, sent = int(size), int(sent)
+        if sent >= size:
+            self._finished += size
+            self._current = 0
+            self._filename = None
+        else:
+            self._current = sent
+        now = time.time()
+        if sent >= size or now - self._last >= self.interval:
+            self._last = now
+            self._emit('progress', path.normpath(filename))
+
+    def done(self):
+        """ Report the transfer as successfully completed. """
+        self._emit('done', '')
+
+    def fail(self, error):
+        """ Report the transfer as failed.
+
+        @param error: The reason for the failure.
+        @type error: str or Exception
+        """
+        self._emit('failed', str(error))
+
+    def _emit(self, state, detail):
+        event = (self.host, state, self.sent, self.total, detail)
+        if self.queue is not None:
+            self.queue.put(event)
+        elif self.callback is not None:
+            self.callback(event)
+
+
+class ProgressMonitor(object):
+
+    """ Parent side: aggregate the events from every ProgressReporter.
+
+    The monitor runs a thread that drains the queue and, at most every
+    `interval` seconds, either renders one status line to stderr or calls
+    `callback` with the current summary() dictionary. The status line is
+    only redrawn when stderr is a terminal; otherwise only the final
+    summary is written, so that logs don't fill up with refreshes.
+    """
+
+    def __init__(self, hosts, queue=None, callback=None, interval=0.5):
+        """ Initialize the monitor.
+
+        @param hosts: The devices that are expected to report.
+        @type hosts: list
+        @param queue: The queue the reporters put their events on. A
+                    | Queue.Queue is created if not given, which is only
+                    | suitable for reporters in threads of this process.
+                    | Use a multiprocessing.Manager().Queue() for workers in
+                    | other processes.
+        @type queue: Queue
+        @param callback: A function that receives the summary() dictionary
+                       | on every refresh, instead of printing it.
+        @type callback: function
+        @param interval: Seconds between refreshes.
+        @type interval: float
+        """
+        self.queue = queue if queue is not None else Queue.Queue()
+        self.callback = callback
+        self.interval = interval
+        self.devices = dict((host, {'state': 'waiting', 'sent': 0,
+                                    'total': None, 'file': '',
+                                    'error': ''}) for host in hosts)
+        self._started = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._width = 0
+
+    def start(self):
+        """ Start consuming events in a background thread. """
+        self._started = time.time()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """ Drain the queue, stop the thread and render the final summary.
+
+        Any device that never reported completion is marked as failed.
+
+        @returns: The final summary.
+        @rtype: dict
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._drain()
+        for device in self.devices.values():
+            if device['state'] not in ('done', 'failed'):
+                device['state'] = 'failed'
+                device['error'] = device['error'] or 'did not complete'
+        summary = self.summary()
+        self._render(summary, final=True)
+        return summary
+
+    def update(self, event):
+        """ Apply a single event from a ProgressReporter. """
+        host, state, sent, total, detail = event
+        device = self.devices.setdefault(host, {'state': 'waiting',
+                                                'sent': 0, 'total': None,
+                                                'file': '', 'error': ''})
+        device['sent'] = sent
+        device['total'] = total
+        if state == 'failed':
+            device['state'] = 'failed'
+            device['error'] = detail
+        elif state == 'done':
+            device['state'] = 'done'
+        else:
+            device['state'] = 'copying'
+            device['file'] = detail
+
+    def summary(self):
+        """ Build the aggregated view of every device.
+
+        @returns: A dictionary with the keys 'devices' (per device state,
+                | bytes sent, total and percent), 'sent' (bytes across all
+                | devices), 'throughput' (bytes/sec), 'eta' (seconds, None
+                | if unknown), 'done' and 'failed' (lists of hosts).
+        @rtype: dict
+        """
+        elapsed = max(time.time() - (self._started or time.time()), 1e-6)
+        sent = sum(d['sent'] for d in self.devices.values())
+        throughput = sent / elapsed
+        devices = {}
+        remaining = 0
+        for host, device in self.devices.items():
+            percent = None
+            if device['state'] == 'done':
+                percent = 100.0
+            elif device['total']:
+                percent = min(100.0, 100.0 * device['sent'] / device['total'])
+            devices[host] = dict(device, percent=percent)
+            if device['state'] in ('waiting', 'copying'):
+                if device['total'] is None:
+                    remaining = None
+                elif remaining is not None:
+                    remaining += max(device['total'] - device['sent'], 0)
+        eta = None
+        if remaining is not None and throughput > 0:
+            eta = remaining / throughput
+        return {
+            'devices': devices,
+            'sent': sent,
+            'elapsed': elapsed,
+            'throughput': throughput,
+            'eta': eta,
+            'done': sorted(h for h, d in devices.items()
+                           if d['state'] == 'done'),
+            'failed': sorted(h for h, d in devices.items()
+                             if d['state'] == 'failed'),
+        }
+
+    def _drain(self):
+        while True:
+            try:
+                self.update(self.queue.get(False))
+            except Queue.Empty:
+                return
+            except (EOFError, IOError):  # manager queue went away
+                return
+
+    def _run(self):
+        while not self._stop.is_set():
+            deadline = time.time() + self.interval
+            while time.time() < deadline and not self._stop.is_set():
+                try:
+                    self.update(self.queue.get(True, .1))
+                except Queue.Empty:
+                    pass
+                except (EOFError, IOError):
+                    return
+            self._render(self.summary())
+
+    def _render(self, summary, final=False):
+        if self.callback is not None:
+            self.callback(summary)
+            return
+        line = '%d/%d done, %d failed | %s at %s/s | ETA %s' % (
+            len(summary['done']), len(summary['devices']),
+            len(summary['failed']), _size(summary['sent']),
+            _size(summary['throughput']), _duration(summary['eta']))
+        active = sorted((h, d) for h, d in summary['devices'].items()
+                        if d['state'] == 'copying')
+        if active and not final:
+            line += ' | ' + ' '.join(
+                '%s %s' % (h, '%.0f%%' % d['percent']
+                           if d['percent'] is not None else _size(d['sent']))
+                for h, d in active)
+        if not _stderr_tty():
+            if final:
+                click.echo(line, err=True)
+        else:
+            width = _terminal_width()
+            line = line[:width - 1]
+            click.echo('\r' + line + ' ' * max(self._width - len(line), 0),
+                       nl=final, err=True)
+            self._width = len(line)
+        if final:
+            for host in summary['failed']:
+                click.echo('Transfer failed for %s: %s' % (
+                    host, summary['devices'][host]['error']), err=True)
+
+
+def local_size(source):
+    """ Return the number of bytes under a local file or directory.
+
+    @param source: The local filepath or dirpath.
+    @type source: str
+
+    @returns: The total size in bytes, or None if it can't be determined.
+    @rtype: int
+    """
+    try:
+        if not path.isdir(source):
+            return path.getsize(source)
+        return sum(path.getsize(path.join(root, name))
+                   for root, _, files in os.walk(source) for name in files)
+    except OSError:
+        return None
+
+
+def _size(num):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if num < 1024.0:
+            return '%.1f %s' % (num, unit)
+        num /= 1024.0
+    return '%.1f TB' % num
+
+
+def _duration(seconds):
+    if seconds is None:
+        return '?'
+    seconds = int(seconds)
+    return '%d:%02d:%02d' % (seconds // 3600, seconds // 60 % 60, seconds % 60)
+
+
+def _stderr_tty():
+    try:
+        return sys.stderr.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+
+def _terminal_width():
+    try:
+        return click.get_terminal_size()[0]
+    except (AttributeError, OSError, ValueError):
+        return 80
@@ -0,0 +1,289 @@
+""" An interactive shell for running jaide commands against a fleet.
+
+'jaide repl' connects to the devices once, and then reads jaide commands
+at a prompt, running each one on the selected devices over the same open
+sessions, kept in a jaide.daemon.SessionPool. The commands are those of the
+jaide CLI, with the same options, such as 'operational "show bgp summary"
+-x //peer-state' or 'compare setcommands.txt'. Lines starting with a Junos
+operational verb, such as 'show route 10/8', run as operational commands.
+
+The selection can be narrowed at any time with 'select' and 'exclude', by
+hostname or glob pattern, and a single line can be sent to other devices by
+starting it with '@PATTERN', such as '@edge-* show chassis alarms'.
+"""
+from __future__ import print_function
+# standard modules
+import cmd
+from fnmatch import fnmatch
+from os import path
+import shlex
+# intra-Jaide imports
+import wrap
+from daemon import SessionPool
+from executor import Executor
+from color_utils import color
+# non-standard modules
+import click
+
+# lines starting with these run as an operational command.
+OPERATIONAL_VERBS = ('show', 'request', 'ping', 'traceroute', 'file',
+                     'clear', 'monitor', 'test')
+# the jaide CLI commands that make no sense inside the shell.
+_EXCLUDED = ('repl',)
+HISTORY = path.expanduser('~/.jaide_history')
+
+
+def match_hosts(hosts, patterns):
+    """ Pick the hosts matching any of some patterns.
+
+    @param hosts: The hosts to pick from, in order.
+    @type hosts: list
+    @param patterns: Hostnames or glob patterns such as 'edge-*', separated
+                   | by commas or whitespace.
+    @type patterns: str
+
+    @returns: The matching hosts, in their original order.
+    @rtype: list
+    """
+    patterns = patterns.replace(',', ' ').split()
+    return [host for host in hosts
+            if any(fnmatch(host, pattern) for pattern in patterns)]
+
+
+class FleetShell(cmd.Cmd):
+
+    """ The 'jaide repl' interactive shell. """
+
+    intro = ("Type a jaide command, such as 'operational \"show version\"' "
+             "or just 'show version'. 'help' lists the commands.")
+
+    def __init__(self, group, obj):
+        """ Initialize the shell.
+
+        @param group: The jaide click group, whose commands are run.
+        @type group: click.Group
+        @param obj: The context object built by the main() group from the
+                  | jaide options, with the inventory in 'hosts'.
+        @type obj: dict
+        """
+        cmd.Cmd.__init__(self)
+        self.group = group
+        self.inventory = [ip.strip() for ip in obj['hosts']]
+        self.selected = list(self.inventory)
+        self.pool = SessionPool(idle_timeout=86400,
+                                max_sessions=4 * len(self.inventory) or 1)
+        # the sessions are shared by the threads of each command, so the
+        # commands run on threads, and not in the jaide daemon.
+        self.obj = dict(obj, pool=self.pool, backend='thread', broker=None)
+        self._update_prompt()
+
+    def _update_prompt(self):
+        self.prompt = 'jaide [%d/%d]> ' % (len(self.selected),
+                                            len(self.inventory))
+
+    def connect(self):
+        """ Open the SSH session of every device, in parallel.
+
+        Purpose: Done once when the shell starts, so that the first command
+               | doesn't pay for connecting. The NETCONF sessions of the
+               | other commands are opened by the first of those commands.
+
+        @returns: None
+        """
+        failures = []
+        conn = self.obj['conn']
+        jobs = [(ip, (ip, conn['username'], conn['password'], wrap.command,
+                      [[]], False, conn['connect_timeout'],
+                      conn['session_timeout'], conn['port'], self.pool))
+                for ip in self.inventory]
+
+        def finished(result):
+            if not result.ok:
+                failures.append((result.host, result.error.strip()))
+
+        def failed(ip, reason, message, error_class):
+            failures.append((ip, message))
+
+        click.echo('Connecting to %d devices...' % len(jobs), err=True)
+        Executor('thread', self.obj['workers'], jobs=len(jobs)).run(
+            wrap.open_connection, jobs, finished, on_failure=failed,
+            job_timeout=self.obj['job_timeout'])
+        click.echo('Connected to %d of %d devices.' % (
+            len(jobs) - len(failures), len(jobs)), err=True)
+        for host, error in failures:
+            click.echo(color('  %s: %s' % (host, error), 'red'), err=True)
+
+    def run_command(self, name, args, hosts):
+        """ Run a jaide CLI command on some of the devices.
+
+        @param name: The name of the command, or a prefix of it.
+        @type name: str
+        @param args: The command line arguments of the command.
+        @type args: list
+        @param hosts: The devices to run it on.
+        @type hosts: list
+
+        @returns: None
+        """
+        if not hosts:
+            click.echo(color('No devices selected.', 'red'), err=True)
+            return
+        parent = click.Context(self.group, info_name='jaide',
+                               obj=dict(self.obj, hosts=hosts))
+        try:
+            command = self.group.get_command(parent, name)
+            if command is None or command.name in _EXCLUDED:
+                raise click.ClickException('No such command %r.' % name)
+            with command.make_context(command.name, args,
+                                      parent=parent) as ctx:
+                command.invoke(ctx)
+        except click.ClickException as e:
+            e.show()
+        except click.Abort:
+            click.echo('Aborted!', err=True)
+        except SystemExit:  # after --help
+            pass
+        except KeyboardInterrupt:
+            click.echo('\nInterrupted.', err=True)
+
+    def onecmd(self, line):
+        """ Run a line, sending it to other devices with '@PATTERN'. """
+        hosts = self.selected
+        if line.startswith('@'):
+            pattern, _, line = line[1:].partition(' ')
+            hosts = match_hosts(self.inventory, pattern)
+            if not hosts:
+                click.echo(color('No devices match %r.' % pattern, 'red'),
+                           err=True)
+                return False
+        self._hosts = hosts
+        return cmd.Cmd.onecmd(self, line)
+
+    def default(self, line):
+        """ Run a jaide command, or an operational command. """
+        name, _, rest = line.partition(' ')
+        if name in OPERATIONAL_VERBS:
+            self.run_command('operational', [line], self._hosts)
+            return
+        try:
+            args = shlex.split(rest)
+        except ValueError as e:  # unbalanced quotes
+            click.echo(color('Invalid command line: %s' % e, 'red'), err=True)
+            return
+        self.run_command(name, args, self._hosts)
+
+    def emptyline(self):
+        """ Do nothing, instead of repeating the last command. """
+
+    def completenames(self, text, *ignored):
+        names = cmd.Cmd.completenames(self, text, *ignored)
+        return names + [name for name in self.group.list_commands(None)
+                        if name.startswith(text) and name not in _EXCLUDED]
+
+    def do_help(self, line):
+        """ Show the help of a command: help [COMMAND] """
+        if line and line not in self._shell_commands():
+            self.run_command(line, ['--help'], self.inventory)
+            return
+        cmd.Cmd.do_help(self, line)
+        if not line:
+            click.echo('jaide commands (run "help COMMAND" for their '
+                       'options):\n  %s\n\nLines starting with %s run as '
+                       'operational commands.\nStart a line with @PATTERN to '
+                       'run it on other devices, such as\n"@edge-* show '
+                       'chassis alarms".\n' % (
+                           ' '.join(name for name in
+                                    self.group.list_commands(None)
+                                    if name not in _EXCLUDED),
+                           ', '.join(OPERATIONAL_VERBS)))
+
+    def _shell_commands(self):
+        return [name[3:] for name in self.get_names()
+                if name.startswith('do_')]
+
+    def get_names(self):
+        # EOF is only there for Ctrl-D, keep it out of the help.
+        return [name for name in cmd.Cmd.get_names(self) if name != 'do_EOF']
+
+    def do_hosts(self, line):
+        """ List the devices, marking the selected ones with '*': hosts """
+        selected = set(self.selected)
+        for host in self.inventory:
+            click.echo('%s %s' % ('*' if host in selected else ' ', host))
+
+    def do_select(self, line):
+        """ Select the devices matching hostnames or glob patterns from
+        the inventory, or all of them: select PATTERN... | select all """
+        if not line.strip() or line.strip() == 'all':
+            self.selected = list(self.inventory)
+        else:
+            hosts = match_hosts(self.inventory, line)
+            if not hosts:
+                click.echo(color('No devices match %r, the selection is '
+                                 'unchanged.' % line, 'red'), err=True)
+                return
+            self.selected = hosts
+        self._update_prompt()
+
+    def do_exclude(self, line):
+        """ Remove the devices matching hostnames or glob patterns from the
+        selection: exclude PATTERN... """
+        excluded = set(match_hosts(self.selected, line))
+        self.selected = [host for host in self.selected
+                         if host not in excluded]
+        self._update_prompt()
+
+    def do_sessions(self, line):
+        """ Show the open sessions and how often they were reused:
+        sessions """
+        status = self.pool.status()
+        click.echo('%d idle sessions, %d reused, %d new, %d dropped' % (
+            status['idle'], status['hits'], status['misses'],
+            status['dead']))
+        for session, count in sorted(status['sessions'].items()):
+            click.echo('  %s: %d' % (session, count))
+
+    def do_exit(self, line):
+        """ Close the sessions and leave: exit """
+        return True
+
+    do_quit = do_exit
+
+    def do_EOF(self, line):
+        """ Leave on Ctrl-D. """
+        click.echo()
+        return True
+
+    def cmdloop(self, intro=None):
+        """ Read and run lines until exit, closing the sessions at the end.
+
+        Purpose: Ctrl-C abandons the line being typed instead of leaving
+               | the shell. The line history is kept in ~/.jaide_history
+               | where readline is available.
+
+        @returns: None
+        """
+        try:
+            import readline
+        except ImportError:  # Windows
+            readline = None
+        else:
+            try:
+                readline.read_history_file(HISTORY)
+            except IOError:  # no history yet
+                pass
+        click.echo(intro or self.intro)
+        try:
+            while True:
+                try:
+                    cmd.Cmd.cmdloop(self, intro='')
+                    break
+                except KeyboardInterrupt:
+                    click.echo('^C')
+        finally:
+            if readline is not None:
+                try:
+                    readline.write_history_file(HISTORY)
+                except IOError:
+                    pass
+            self.pool.close()
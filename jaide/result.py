@@ -0,0 +1,137 @@
+""" The result of running a jaide job against a single device.
+
+Workers used to hand back one large colored string per device, which the
+CLI then had to split apart again to find out which device it was for.
+A DeviceResult keeps the pieces separate: what happened (status, error),
+how long it took, and the output itself. Color and layout are applied only
+when the result is rendered for a terminal or a file.
+"""
+# intra-Jaide imports
+from color_utils import color
+from spool import SpoolBuffer
+
+# the possible values of DeviceResult.status
+OK = 'ok'
+ERROR = 'error'
+TIMEOUT = 'timeout'
+CANCELLED = 'cancelled'
+
+
+class DeviceResult(object):
+
+    """ The outcome of a job on one device.
+
+    Attributes:
+        host: The IP or hostname of the device.
+        status: One of 'ok', 'error', 'timeout' or 'cancelled'.
+        error: The error message, when the status isn't 'ok'.
+        error_class: The name of the exception class behind the error.
+        timings: A dictionary of phase name to seconds, always including
+               | 'total' once the job has finished. The phases are those of
+               | jaide.timing.PHASES, plus 'connect' and 'total'.
+        spans: The (phase, detail, seconds, bytes) tuples of every timed
+             | span, see jaide.timing.Span.
+        output: The output of the job, as rendered by the jaide.wrap
+              | function. A large output can be a jaide.spool.SpoolBuffer
+              | that has moved to a temporary file.
+        data: Structured data from the job, for functions that provide it.
+    """
+
+    def __init__(self, host, status=OK, output='', error='', error_class='',
+                 timings=None, data=None, spans=None):
+        """ Initialize the result.
+
+        @param host: The IP or hostname of the device.
+        @type host: str
+        @param status: One of 'ok', 'error', 'timeout' or 'cancelled'.
+        @type status: str
+        @param output: The output of the job.
+        @type output: str or jaide.spool.SpoolBuffer
+        @param error: The error message, if the job failed.
+        @type error: str
+        @param error_class: The name of the exception class behind the
+                          | error, if any.
+        @type error_class: str
+        @param timings: Seconds spent per phase of the job.
+        @type timings: dict
+        @param data: Structured data from the job.
+        @type data: dict
+        @param spans: The timed spans of the job.
+        @type spans: list
+        """
+        self.host = host
+        self.status = status
+        self.output = output
+        self.error = error
+        self.error_class = error_class
+        self.timings = timings if timings is not None else {}
+        self.data = data
+        self.spans = spans if spans is not None else []
+
+    @property
+    def ok(self):
+        """ True if the job completed without an error. """
+        return self.status == OK
+
+    @property
+    def payload_bytes(self):
+        """ The size of the output in bytes. """
+        return len(self.output)
+
+    def fail(self, error, error_class='', status=ERROR):
+        """ Mark the result as failed.
+
+        @param error: The error message.
+        @type error: str
+        @param error_class: The name of the exception class, if any.
+        @type error_class: str
+        @param status: The failed status, 'error' by default.
+        @type status: str
+
+        @returns: The result itself, to allow chaining.
+        @rtype: DeviceResult
+        """
+        self.status = status
+        self.error = error
+        self.error_class = error_class
+        return self
+
+    def header(self):
+        """ The banner line that starts the output for a device.
+
+        Purpose: A blank line separates the banner from the output, as it
+               | always has, for any scripts that parse the output.
+        """
+        return color('=' * 50 + '\nResults from device: %s\n' % self.host,
+                     'yel') + '\n'
+
+    def render(self):
+        """ Render the result as colored text for a terminal or a file.
+
+        @returns: The header, followed by the output, and the error in red
+                | if the job failed.
+        @rtype: str
+        """
+        return ''.join(self.chunks())
+
+    def chunks(self):
+        """ Render the result piece by piece, as render() does.
+
+        Purpose: Lets a spooled output be written out from its temporary
+               | file, without reading all of it into memory.
+        """
+        yield self.header()
+        if isinstance(self.output, SpoolBuffer):
+            for chunk in self.output.chunks():
+                yield chunk
+        else:
+            yield self.output
+        if self.error:
+            yield color(self.error, 'red')
+
+    def __str__(self):
+        return self.render()
+
+    def __repr__(self):
+        return '<DeviceResult %s %s, %d bytes>' % (self.host, self.status,
+                                                   self.payload_bytes)
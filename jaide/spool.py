@@ -0,0 +1,222 @@
+""" Memory bounded buffers for device replies.
+
+Replies used to be read by adding every chunk to a growing string, which
+copies everything read so far each time, and keeps the whole reply in
+memory however large it gets. Many full routing tables read at the same
+time could then push a collector into swap. A SpoolBuffer keeps the
+chunks in a list instead, and moves them to a temporary file once they
+pass a set size. It can be read like a file, or chunk by chunk, so that
+lxml and the output writers can use a large reply without joining it
+back into one string.
+"""
+# standard modules
+import tempfile
+
+# the size in bytes past which a buffer moves to a temporary file.
+SPOOL_SIZE = 16 << 20
+# the size of the blocks read back from a temporary file.
+BLOCK_SIZE = 1 << 16
+
+
+class SpoolBuffer(object):
+
+    """ A write once, read many buffer that spills to a temporary file.
+
+    Purpose: Data is written to the end of the buffer, and read back from
+           | the position of read() and seek(), which writing doesn't
+           | move. Pickling a buffer gives the plain string of its
+           | contents, so that a result can still be sent to another
+           | process or to the jaide daemon.
+    """
+
+    def __init__(self, spool_size=SPOOL_SIZE):
+        """ Initialize the buffer.
+
+        @param spool_size: The number of bytes to keep in memory, past which
+                         | the buffer moves to a temporary file. None keeps
+                         | everything in memory.
+        @type spool_size: int
+        """
+        self.spool_size = spool_size
+        self._chunks = []
+        self._file = None
+        self._size = 0
+        self._pos = 0
+        # the index of the chunk read last, and the position it starts at,
+        # so that reading on doesn't walk the chunks from the start again.
+        self._cursor = (0, 0)
+
+    def write(self, data):
+        """ Add data to the end of the buffer.
+
+        @param data: The data, or another SpoolBuffer to copy.
+        @type data: str or SpoolBuffer
+        """
+        if isinstance(data, SpoolBuffer):
+            for chunk in data.chunks():
+                self.write(chunk)
+            return
+        if not data:
+            return
+        self._size += len(data)
+        if self._file is not None:
+            self._file.seek(0, 2)
+            self._file.write(data)
+            return
+        self._chunks.append(data)
+        if self.spool_size is not None and self._size > self.spool_size:
+            self._file = tempfile.NamedTemporaryFile(prefix='jaide-')
+            for chunk in self._chunks:
+                self._file.write(chunk)
+            self._chunks = []
+            self._cursor = (0, 0)
+
+    @property
+    def spilled(self):
+        """ True once the buffer has moved to a temporary file. """
+        return self._file is not None
+
+    @property
+    def name(self):
+        """ The path of the temporary file, or None while in memory. """
+        if self._file is None:
+            return None
+        # so that what was written can be read through the path.
+        self._file.flush()
+        return self._file.name
+
+    def __len__(self):
+        return self._size
+
+    def tail(self, size):
+        """ The last bytes of the buffer, without reading the rest.
+
+        @param size: The most bytes to return.
+        @type size: int
+
+        @rtype: str
+        """
+        size = min(size, self._size)
+        if size <= 0:
+            return ''
+        if self._file is not None:
+            self._file.seek(-size, 2)
+            return self._file.read(size)
+        chunks = []
+        length = 0
+        for chunk in reversed(self._chunks):
+            chunks.append(chunk)
+            length += len(chunk)
+            if length >= size:
+                break
+        return ''.join(reversed(chunks))[-size:]
+
+    def endswith(self, suffix):
+        """ True if the buffer ends with suffix. """
+        return self.tail(len(suffix)) == suffix
+
+    def chunks(self, size=BLOCK_SIZE):
+        """ Iterate over the contents, from the start, in pieces.
+
+        @param size: The size of the blocks read from a temporary file.
+        @type size: int
+        """
+        if self._file is None:
+            for chunk in self._chunks:
+                yield chunk
+            return
+        offset = 0
+        while offset < self._size:
+            self._file.seek(offset)
+            block = self._file.read(min(size, self._size - offset))
+            if not block:
+                return
+            offset += len(block)
+            yield block
+
+    def getvalue(self):
+        """ The whole contents as one string. """
+        if self._file is None:
+            if len(self._chunks) > 1:
+                self._chunks = [''.join(self._chunks)]
+                self._cursor = (0, 0)
+            return self._chunks[0] if self._chunks else ''
+        self._file.seek(0)
+        return self._file.read()
+
+    def read(self, size=-1):
+        """ Read from the current position, as with a file.
+
+        @param size: The most bytes to read, all of the rest if negative.
+        @type size: int
+
+        @rtype: str
+        """
+        if size is None or size < 0:
+            size = self._size - self._pos
+        size = min(size, self._size - self._pos)
+        if size <= 0:
+            return ''
+        if self._file is not None:
+            self._file.seek(self._pos)
+            data = self._file.read(size)
+        else:
+            index, start = self._cursor
+            # move the cursor to the chunk holding the position.
+            while start > self._pos:
+                index -= 1
+                start -= len(self._chunks[index])
+            while start + len(self._chunks[index]) <= self._pos:
+                start += len(self._chunks[index])
+                index += 1
+            pieces = []
+            end = self._pos + size
+            while True:
+                chunk = self._chunks[index]
+                pieces.append(chunk[max(self._pos - start, 0):end - start])
+                if start + len(chunk) >= end:
+                    break
+                start += len(chunk)
+                index += 1
+            self._cursor = (index, start)
+            data = ''.join(pieces)
+        self._pos += len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        """ Move the read position, as with a file. """
+        if whence == 1:
+            offset += self._pos
+        elif whence == 2:
+            offset += self._size
+        self._pos = min(max(offset, 0), self._size)
+
+    def tell(self):
+        """ The read position. """
+        return self._pos
+
+    def close(self):
+        """ Drop the contents, and remove the temporary file. """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._chunks = []
+        self._size = self._pos = 0
+        self._cursor = (0, 0)
+
+    def __str__(self):
+        return self.getvalue()
+
+    def __reduce__(self):
+        return str, (self.getvalue(),)
+
+    def __repr__(self):
+        return '<SpoolBuffer %d bytes%s>' % (
+            self._size, ', spilled to %s' % self.name if self.spilled else '')
+
+
+def text(output):
+    """ The output of a job as a string, joining a SpoolBuffer if needed. """
+    if isinstance(output, SpoolBuffer):
+        return output.getvalue()
+    return output
@@ -0,0 +1,247 @@
+""" Per-device, per-phase timing instrumentation.
+
+Every Jaide object records spans for the phases of its work: resolving the
+host (dns), the TCP connection (tcp), the SSH handshake and authentication
+(ssh_auth), opening a NETCONF session including the hello exchange
+(netconf_session), opening the interactive CLI channel of batched commands
+(cli_session), each RPC or command (rpc), parsing the replies (parse) and
+SCP transfers (transfer). Spans carry the number of bytes involved
+where that is known.
+
+Library users can watch spans as they complete with add_hook(). The CLI
+collects them in each DeviceResult, and FleetTimings summarizes them with
+percentiles across the fleet for the --timings option.
+"""
+from __future__ import print_function
+# standard modules
+from contextlib import contextmanager
+import threading
+import time
+
+# the phases that are recorded, in the order they usually happen.
+PHASES = ['dns', 'tcp', 'ssh_auth', 'netconf_session', 'cli_session', 'rpc',
+          'parse', 'transfer']
+
+_hooks = []
+_hooks_lock = threading.Lock()
+
+
+def add_hook(callback):
+    """ Call a function for every span that completes, on any device.
+
+    @param callback: Called with (host, span) in the thread that did the
+                   | work. Hooks only see spans of Jaide objects in this
+                   | process, not those of process pool workers.
+    @type callback: function
+
+    @returns: None
+    """
+    with _hooks_lock:
+        _hooks.append(callback)
+
+
+def remove_hook(callback):
+    """ Stop calling a function registered with add_hook().
+
+    @param callback: The registered function.
+    @type callback: function
+
+    @returns: None
+    """
+    with _hooks_lock:
+        if callback in _hooks:
+            _hooks.remove(callback)
+
+
+class Span(object):
+
+    """ One timed phase of the work on a device. """
+
+    def __init__(self, name, detail=''):
+        """ Initialize the span.
+
+        @param name: The phase, one of PHASES.
+        @type name: str
+        @param detail: What the phase was for, such as the RPC name.
+        @type detail: str
+        """
+        self.name = name
+        self.detail = detail
+        self.start = time.time()
+        self.duration = None
+        self.bytes = None
+
+    def as_tuple(self):
+        """ A compact (name, detail, seconds, bytes) tuple of the span. """
+        return (self.name, self.detail, self.duration, self.bytes)
+
+    def __repr__(self):
+        return '<Span %s %s %.3fs>' % (self.name, self.detail,
+                                       self.duration or 0)
+
+
+class Timings(object):
+
+    """ The spans recorded for one device. """
+
+    def __init__(self, host):
+        """ Initialize the recorder.
+
+        @param host: The device the spans are for.
+        @type host: str
+        """
+        self.host = host
+        self.spans = []
+
+    @contextmanager
+    def span(self, name, detail=''):
+        """ Time the enclosed block as a span.
+
+        Purpose: Used as `with timings.span('rpc', 'get-software-information')
+               | as span:`. The byte count can be set on the yielded span
+               | inside the block. The span is recorded and the hooks are
+               | called even when the block raises.
+
+        @param name: The phase, one of PHASES.
+        @type name: str
+        @param detail: What the phase was for.
+        @type detail: str
+
+        @returns: The span being timed.
+        @rtype: Span
+        """
+        span = Span(name, detail)
+        try:
+            yield span
+        finally:
+            span.duration = time.time() - span.start
+            self.spans.append(span)
+            for hook in list(_hooks):
+                hook(self.host, span)
+
+    def totals(self):
+        """ The seconds spent per phase.
+
+        @returns: Phase name to the summed duration of its spans.
+        @rtype: dict
+        """
+        totals = {}
+        for span in self.spans:
+            totals[span.name] = totals.get(span.name, 0) + span.duration
+        return totals
+
+    def byte_totals(self):
+        """ The bytes moved per phase, for phases that count them.
+
+        @returns: Phase name to the summed bytes of its spans.
+        @rtype: dict
+        """
+        totals = {}
+        for span in self.spans:
+            if span.bytes is not None:
+                totals[span.name] = totals.get(span.name, 0) + span.bytes
+        return totals
+
+
+def reply_size(reply):
+    """ Return the size of the raw XML of an ncclient RPC reply.
+
+    @param reply: The reply of an ncclient manager RPC.
+    @type reply: ncclient.xml_.NCElement or ncclient.operations.RPCReply
+
+    @returns: The number of bytes, or None if it can't be determined.
+    @rtype: int
+    """
+    # junos replies are wrapped in an NCElement, which keeps the RPCReply
+    # privately, so reach through the name mangling to get at the raw xml.
+    reply = getattr(reply, '_NCElement__result', reply)
+    raw = getattr(reply, 'xml', None)
+    return len(raw) if isinstance(raw, basestring) else None
+
+
+def percentile(values, percent):
+    """ Return a percentile of a list of numbers, by nearest rank.
+
+    @param values: The numbers, in any order.
+    @type values: list
+    @param percent: The percentile, from 0 to 100.
+    @type percent: float
+
+    @returns: The value at the percentile, or None for an empty list.
+    @rtype: float
+    """
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(round(percent / 100.0 * (len(values) - 1)))
+    return values[max(0, min(rank, len(values) - 1))]
+
+
+class FleetTimings(object):
+
+    """ Collect the per-phase timings of many devices, and summarize them. """
+
+    def __init__(self):
+        self.seconds = {}
+        self.bytes = {}
+        self.devices = 0
+
+    def add(self, result):
+        """ Add the timings of a device.
+
+        @param result: The result of a device job.
+        @type result: jaide.result.DeviceResult
+
+        @returns: None
+        """
+        self.devices += 1
+        for name, seconds in result.timings.items():
+            self.seconds.setdefault(name, []).append(seconds)
+        for name, _, _, size in result.spans:
+            if size is not None:
+                self.bytes[name] = self.bytes.get(name, 0) + size
+
+    def summary(self, percents=(50, 90, 99)):
+        """ Summarize every phase across the devices.
+
+        @param percents: The percentiles to compute.
+        @type percents: tuple
+
+        @returns: A list of dictionaries, one per phase, with the keys
+                | 'phase', 'devices', 'p<N>' for each percentile, 'max'
+                | and 'bytes'.
+        @rtype: list
+        """
+        order = PHASES + ['connect', 'total']
+        names = sorted(self.seconds, key=lambda name: (
+            order.index(name) if name in order else len(order), name))
+        rows = []
+        for name in names:
+            row = {'phase': name, 'devices': len(self.seconds[name]),
+                   'max': max(self.seconds[name]),
+                   'bytes': self.bytes.get(name)}
+            for percent in percents:
+                row['p%d' % percent] = percentile(self.seconds[name], percent)
+            rows.append(row)
+        return rows
+
+    def render(self, percents=(50, 90, 99)):
+        """ Render the summary as a text table.
+
+        @param percents: The percentiles to compute.
+        @type percents: tuple
+
+        @returns: The table.
+        @rtype: str
+        """
+        columns = ['p%d' % percent for percent in percents] + ['max']
+        lines = ['Timings across %d devices (seconds):' % self.devices,
+                 '%-16s %7s ' % ('phase', 'devices') +
+                 ' '.join('%9s' % column for column in columns) +
+                 ' %12s' % 'bytes']
+        for row in self.summary(percents):
+            lines.append('%-16s %7d ' % (row['phase'], row['devices']) +
+                         ' '.join('%9.3f' % row[column] for column in columns) +
+                         ' %12s' % ('-' if row['bytes'] is None
+                                    else row['bytes']))
+        return '\n'.join(lines) + '\n'
@@ -1,10 +1,92 @@
 """ Jaide standalone utility functions. """
 
 from os import path
-from lxml import etree, objectify
+import importlib
+import sys
+import threading
 import xml.etree.ElementTree as ET
 
 
+class LazyModule(object):
+
+    """ A module that is only imported when one of its attributes is used.
+
+    Purpose: ncclient, paramiko, scp and lxml take most of the time of
+           | starting the jaide CLI, while many runs never use them in the
+           | parent process, such as 'jaide --help', or only need some of
+           | them, such as the operational command which doesn't use
+           | NETCONF. Standing in for the module at the top of a file, a
+           | LazyModule imports it the first time it is used instead.
+    """
+
+    def __init__(self, name, on_error=None, first=()):
+        """ Initialize the lazy module.
+
+        @param name: The full name of the module, such as 'lxml.etree'.
+        @type name: str
+        @param on_error: Called with the name of the module and the
+                       | ImportError if the import fails, before the error
+                       | is raised.
+        @type on_error: function
+        @param first: Modules to import before this one, for packages whose
+                    | modules only import in a certain order.
+        @type first: tuple
+        """
+        self.__name = name
+        self.__on_error = on_error
+        self.__first = first
+        self.__module = None
+        self.__lock = threading.Lock()
+
+    def __load(self):
+        if self.__module is None:
+            with self.__lock:
+                if self.__module is None:
+                    try:
+                        for name in self.__first:
+                            importlib.import_module(name)
+                        self.__module = importlib.import_module(self.__name)
+                    except ImportError as e:
+                        if self.__on_error is not None:
+                            self.__on_error(self.__name, e)
+                        raise
+        return self.__module
+
+    def __getattr__(self, attribute):
+        return getattr(self.__load(), attribute)
+
+    def __repr__(self):
+        return '<lazy module %r%s>' % (self.__name, '' if self.loaded()
+                                       else ' (not loaded)')
+
+    def loaded(self):
+        """ Return True if the module has been imported, by any means. """
+        return sys.modules.get(self.__name) is not None
+
+
+def is_instance(obj, module, name):
+    """ isinstance() against a class of a LazyModule, without importing it.
+
+    Purpose: An object can't be an instance of a class whose module hasn't
+           | been imported yet, so the check is False without importing
+           | the module.
+
+    @param obj: The object to check.
+    @param module: The module of the class.
+    @type module: LazyModule
+    @param name: The name of the class in the module, such as 'Manager'.
+    @type name: str
+
+    @returns: True if obj is an instance of the class.
+    @rtype: bool
+    """
+    return module.loaded() and isinstance(obj, getattr(module, name))
+
+
+etree = LazyModule('lxml.etree')
+objectify = LazyModule('lxml.objectify')
+
+
 def clean_lines(commands):
     """ Generate strings that are not comments or lines with only whitespace.
 
@@ -62,8 +144,12 @@ def xpath(source_xml, xpath_expr, req_format='string'):
            | subtrees that match the Xpath expression. It can also return
            | an xml object if desired.
 
-    @param source_xml: Plain text XML that will be filtered
-    @type source_xml: str or lxml.etree.ElementTree.Element object
+    @param source_xml: Plain text XML that will be filtered. A
+                     | jaide.spool.SpoolBuffer is parsed chunk by chunk,
+                     | and any other file-like object read as a file,
+                     | without joining them into one string first.
+    @type source_xml: str, file, jaide.spool.SpoolBuffer or
+                    | lxml.etree.ElementTree.Element object
     @param xpath_expr: Xpath expression that we will filter the XML by.
     @type xpath_expr: str
     @param req_format: the desired format of the response, accepts string or
@@ -75,7 +161,14 @@ def xpath(source_xml, xpath_expr, req_format='string'):
     @rtype: str or ElementTree
     """
     tree = source_xml
-    if not isinstance(source_xml, ET.Element):
+    if hasattr(source_xml, 'chunks'):
+        parser = objectify.makeparser()
+        for chunk in source_xml.chunks():
+            parser.feed(chunk)
+        tree = parser.close()
+    elif hasattr(source_xml, 'read'):
+        tree = objectify.parse(source_xml).getroot()
+    elif not isinstance(source_xml, ET.Element):
         tree = objectify.fromstring(source_xml)
     # clean up the namespace in the tags, as namespaces appear to confuse
     # xpath method
@@ -15,22 +15,31 @@ https://github.com/NetworkAutomation/jaide
 # standard modules
 from os import path
 import socket
-import lxml
+import time
 # intra-Jaide imports
-from core import Jaide
-from utils import clean_lines
+from baseline import BaselineStore, CounterSnapshot
+from core import (Jaide, describe_errors, describe_health,
+                  significant_errors)
+from utils import LazyModule, clean_lines, etree
 from color_utils import color, color_diffs
+from progress import ProgressReporter, local_size
+from result import DeviceResult
+from spool import SpoolBuffer
 # The rest are non-standard modules:
-from ncclient.transport import errors
-from ncclient.operations.rpc import RPCError
-from paramiko import SSHException, AuthenticationException
-from scp import SCPException
 import click
+# these are only needed for their exceptions, so they are imported when an
+# exception is first matched against them.
+# ncclient.transport can't be imported before ncclient.operations.
+errors = LazyModule('ncclient.transport.errors',
+                    first=('ncclient.operations',))
+rpc = LazyModule('ncclient.operations.rpc')
+paramiko = LazyModule('paramiko')
+scp = LazyModule('scp')
 
 
 # TODO: [2.1] @rfe make this a decorator function, handing the Jaide object downstream?
 def open_connection(ip, username, password, function, args, write=False,
-                    conn_timeout=5, sess_timeout=300, port=22):
+                    conn_timeout=5, sess_timeout=300, port=22, pool=None):
     """ Open a Jaide session with the device.
 
     To open a Jaide session to the device, and run the appropriate function
@@ -45,7 +54,12 @@ def open_connection(ip, username, password, function, args, write=False,
     @type password: str
     @param function: The downstream jaide.wrap function we'll be handing
                    | off the jaide.Jaide() object to execute the command
-                   | once we've established the connection.
+                   | once we've established the connection. If it returns
+                   | anything other than a string, such as the dictionary
+                   | of device_info_data(), that is stored as the data of
+                   | the result instead of its output. A tuple is the
+                   | output and the data, as returned with the with_data
+                   | argument of health_check() and interface_errors().
     @type function: function pointer.
     @param args: The arguments that we will hand off to the downstream
                | function.
@@ -64,46 +78,90 @@ def open_connection(ip, username, password, function, args, write=False,
     @type sess_timeout: int
     @param port: The port to connect to the device on. Defaults to 22.
     @type port: int
-
-    @returns: We could return either just a string of the output from the
-            | device, or a tuple containing the information needed to write
-            | to a file and the string output from the device.
-    @rtype: Tuple or str
+    @param pool: Sessions to reuse, as kept by the jaide daemon and the
+               | jaide repl shell. A session is taken from the pool if it
+               | has one for the device, and put back once the function
+               | completes.
+    @type pool: jaide.daemon.SessionPool
+
+    @returns: A DeviceResult with the output from the device, or a tuple
+            | containing the information needed to write to a file and the
+            | DeviceResult.
+    @rtype: Tuple or jaide.result.DeviceResult
     """
-    # start with the header line on the output.
-    output = color('=' * 50 + '\nResults from device: %s\n' % ip, 'yel')
+    ip = ip.strip()
+    result = DeviceResult(ip)
+    started = time.time()
+    # conn is the session to close at the end, and session the one whose
+    # timings are kept, even once it went back to the pool.
+    conn = session = None
     try:
-        # create the Jaide session object for the device.
-        conn = Jaide(ip, username, password, connect_timeout=conn_timeout,
-                     session_timeout=sess_timeout, port=port)
-        if write is not False:
-            return write, output + function(conn, *args)
+        if pool is not None:
+            conn = pool.checkout(function, ip, username, password, port,
+                                 conn_timeout, sess_timeout)
+        if conn is None:
+            # create the Jaide session object for the device. It connects
+            # separately, so that the timings of a failed connection are
+            # kept.
+            conn = Jaide(ip, username, password, connect_timeout=conn_timeout,
+                         session_timeout=sess_timeout, connect=False,
+                         port=port)
+            session = conn
+            conn.conn_type = 'paramiko'
+            conn.connect()
+        session = conn
+        result.timings['connect'] = time.time() - started
+        output = function(conn, *args)
+        if isinstance(output, (basestring, SpoolBuffer)):
+            result.output = output
+        elif isinstance(output, tuple):
+            result.output, result.data = output
         else:
-            return output + function(conn, *args)
-    except errors.SSHError:
-        output += color('Unable to connect to port %s on device: %s\n' %
-                        (str(port), ip), 'red')
-    except errors.AuthenticationError:  # NCClient auth failure
-        output += color('Authentication failed for device: %s' % ip, 'red')
-    except AuthenticationException:  # Paramiko auth failure
-        output += color('Authentication failed for device: %s' % ip, 'red')
-    except SSHException as e:
-        output += color('Error connecting to device: %s\nError: %s' %
-                        (ip, str(e)), 'red')
-    except socket.timeout:
-        output += color('Timeout exceeded connecting to device: %s' % ip, 'red')
-    except socket.gaierror:
-        output += color('No route to host, or invalid hostname: %s' % ip, 'red')
-    except socket.error:
-        output += color('The device refused the connection on port %s, or '
-                        'no route to host.' % port, 'red')
+            result.data = output
+        if pool is not None:
+            pool.checkin(conn, function)
+            conn = None
+    except errors.SSHError as e:
+        result.fail('Unable to connect to port %s on device: %s\n' %
+                    (str(port), ip), e.__class__.__name__)
+    except errors.AuthenticationError as e:  # NCClient auth failure
+        result.fail('Authentication failed for device: %s' % ip,
+                    e.__class__.__name__)
+    except paramiko.AuthenticationException as e:  # Paramiko auth failure
+        result.fail('Authentication failed for device: %s' % ip,
+                    e.__class__.__name__)
+    except paramiko.SSHException as e:
+        result.fail('Error connecting to device: %s\nError: %s' %
+                    (ip, str(e)), e.__class__.__name__)
+    except socket.timeout as e:
+        result.fail('Timeout exceeded connecting to device: %s' % ip,
+                    e.__class__.__name__)
+    except socket.gaierror as e:
+        result.fail('No route to host, or invalid hostname: %s' % ip,
+                    e.__class__.__name__)
+    except socket.error as e:
+        result.fail('The device refused the connection on port %s, or '
+                    'no route to host.' % port, e.__class__.__name__)
+    finally:
+        # a session that isn't going back to the pool is closed, or its
+        # transport thread and socket would outlive the job.
+        if conn is not None:
+            try:
+                conn.disconnect()
+            except Exception:
+                pass
+    if session is not None:
+        result.timings.update(session.timings.totals())
+        result.spans = [span.as_tuple() for span in session.timings.spans]
+    result.timings['total'] = time.time() - started
     if write is not False:
-        return write, output
+        return write, result
     else:
-        return output
+        return result
 
 
-def command(jaide, commands, format="text", xpath=False):
+def command(jaide, commands, format="text", xpath=False, batch=False,
+            parallel=1, spool_size=None):
     """ Run an operational command.
 
     @param jaide: The jaide connection to the device.
@@ -116,14 +174,31 @@ def command(jaide, commands, format="text", xpath=False):
     @param xpath: The xpath expression to filter the results from the device.
                 | If set, this forces the output to be requested in xml format.
     @type xpath: str
+    @param batch: Set to True to send all of the commands over a single CLI
+                | channel with Jaide.op_batch(), instead of a new channel
+                | per command.
+    @type batch: bool
+    @param parallel: The most commands to run at the same time, each on its
+                   | own channel with Jaide.op_parallel(). The output is
+                   | still in the order of the commands.
+    @type parallel: int
+    @param spool_size: If set, replies and the output are read into
+                     | temporary files past this many bytes, and an output
+                     | that didn't fit is returned as the SpoolBuffer
+                     | holding it. Otherwise the output is always a string.
+    @type spool_size: int
 
     @returns: The output from the device, and xpath filtered if desired.
-    @rtype: str
+    @rtype: str or jaide.spool.SpoolBuffer
     """
-    output = ""
+    spool = spool_size is not None
+    if spool:
+        jaide.spool_size = spool_size
+    output = SpoolBuffer(spool_size)
+    requests = []
     for cmd in clean_lines(commands):
         expression = ""
-        output += color('> ' + cmd + '\n', 'yel')
+        shown = '> ' + cmd + '\n'
         # Get xpath expression from the command, if it is there.
         # If there is an xpath expr, the output will be xml,
         # overriding the req_format parameter
@@ -133,17 +208,45 @@ def command(jaide, commands, format="text", xpath=False):
             expression = cmd.split('%')[1].strip()
             cmd = cmd.split('%')[0] + '\n'
         elif xpath is not False:
-            expression = xpath
+            expression = xpath or ""
+        requests.append((shown, cmd, expression))
+    if (batch or parallel > 1) and requests:
+        cmds = [cmd for _, cmd, _ in requests]
+        expressions = [expr for _, _, expr in requests]
+        if batch:
+            replies = jaide.op_batch(cmds, req_format=format,
+                                     xpath_exprs=expressions)
+        else:
+            replies = jaide.op_parallel(cmds, req_format=format,
+                                        xpath_exprs=expressions,
+                                        channels=parallel, spool=spool)
+        for (shown, _, _), reply in zip(requests, replies):
+            output.write(color(shown, 'yel'))
+            if reply is None:
+                output.write(color('Xpath expression resulted in no '
+                                   'response.\n', 'red'))
+            else:
+                output.write(reply)
+                output.write('\n')
+            if isinstance(reply, SpoolBuffer):
+                reply.close()
+        return output if output.spilled else output.getvalue()
+    for shown, cmd, expression in requests:
+        output.write(color(shown, 'yel'))
         if expression:
             try:
-                output += jaide.op_cmd(command=cmd, req_format='xml',
-                                       xpath_expr=expression) + '\n'
-            except lxml.etree.XMLSyntaxError:
-                output += color('Xpath expression resulted in no response.\n',
-                                'red')
+                output.write(jaide.op_cmd(command=cmd, req_format='xml',
+                                          xpath_expr=expression) + '\n')
+            except etree.XMLSyntaxError:
+                output.write(color('Xpath expression resulted in no '
+                                   'response.\n', 'red'))
         else:
-            output += jaide.op_cmd(cmd, req_format=format) + '\n'
-    return output
+            reply = jaide.op_cmd(cmd, req_format=format, spool=spool)
+            output.write(reply)
+            output.write('\n')
+            if isinstance(reply, SpoolBuffer):
+                reply.close()
+    return output if output.spilled else output.getvalue()
 
 
 def commit(jaide, commands, check, sync, comment, confirm, at_time, blank):
@@ -200,7 +303,7 @@ def commit(jaide, commands, check, sync, comment, confirm, at_time, blank):
         output += color("show | compare:\n", 'yel')
         try:
             output += color_diffs(jaide.compare_config(commands)) + '\n'
-        except RPCError as e:
+        except rpc.RPCError as e:
             output += color("Could not get config comparison results before"
                             " committing due to the following error:\n%s" %
                             str(e))
@@ -209,7 +312,7 @@ def commit(jaide, commands, check, sync, comment, confirm, at_time, blank):
         output += color("Commit check results from: %s\n" % jaide.host, 'yel')
         try:
             output += jaide.commit_check(commands) + '\n'
-        except RPCError:
+        except rpc.RPCError:
             output += color("Uncommitted changes left on the device or someone"
                             " else is in edit mode, couldn't lock the "
                             "candidate configuration.\n", 'red')
@@ -224,7 +327,7 @@ def commit(jaide, commands, check, sync, comment, confirm, at_time, blank):
             results = jaide.commit(confirmed=confirm, comment=comment,
                                    at_time=at_time, synchronize=sync,
                                    commands=commands)
-        except RPCError as e:
+        except rpc.RPCError as e:
             output += color('Commit could not be completed on this device, due'
                             ' to the following error(s):\n' + str(e), 'red')
         # Jaide command succeeded, parse results
@@ -278,6 +381,18 @@ def device_info(jaide):
     return jaide.device_info()
 
 
+def device_info_data(jaide):
+    """ Retrieve basic device information as a dictionary.
+
+    @param jaide: The jaide connection to the device.
+    @type jaide: jaide.Jaide object
+
+    @returns: The device information, see Jaide.device_info_data().
+    @rtype dict
+    """
+    return jaide.device_info_data()
+
+
 def diff_config(jaide, second_host, mode):
     """ Perform a show | compare with some set commands.
 
@@ -303,10 +418,10 @@ def diff_config(jaide, second_host, mode):
     except errors.AuthenticationError:  # NCClient auth failure
         output = color('Authentication failed for device: %s' %
                        second_host, 'red')
-    except AuthenticationException:  # Paramiko auth failure
+    except paramiko.AuthenticationException:  # Paramiko auth failure
         output = color('Authentication failed for device: %s' %
                        second_host, 'red')
-    except SSHException as e:
+    except paramiko.SSHException as e:
         output = color('Error connecting to device: %s\nError: %s' %
                        (second_host, str(e)), 'red')
     except socket.timeout:
@@ -327,35 +442,138 @@ def diff_config(jaide, second_host, mode):
     return output
 
 
-def health_check(jaide):
+def health_check(jaide, with_data=False):
     """ Retrieve alarm, CPU, RAM, and temperature status.
 
     @param jaide: The jaide connection to the device.
     @type jaide: jaide.Jaide object
+    @param with_data: Set to True to also return the structured health
+                    | information the output is made from, for fleet
+                    | summaries of the text output.
+    @type with_data: bool
+
+    @returns: The output from the device, or with with_data a tuple of the
+            | output and the health information.
+    @rtype str or tuple
+    """
+    health = jaide.health_check_data()
+    output = describe_health(health)
+    return (output, health) if with_data else output
 
-    @returns: The output from the device.
-    @rtype str
+
+def health_check_data(jaide):
+    """ Retrieve alarm, CPU, RAM, and temperature status as a dictionary.
+
+    @param jaide: The jaide connection to the device.
+    @type jaide: jaide.Jaide object
+
+    @returns: The health information, see Jaide.health_check_data().
+    @rtype dict
     """
-    return jaide.health_check()
+    return jaide.health_check_data()
 
 
-def interface_errors(jaide):
+def interface_errors(jaide, baseline=None, fpcs=None, with_data=False):
     """ Retrieve any interface errors from all interfaces on a device.
 
     @param jaide: The jaide connection to the device.
     @type jaide: jaide.Jaide object
-
-    @returns: The output from the device.
-    @rtype str
+    @param baseline: A directory of counter baselines. When given, only the
+                   | errors since the previous run with the same directory
+                   | are shown, see jaide.baseline.
+    @type baseline: str
+    @param fpcs: FPC slot numbers to request the interfaces of one at a
+               | time, see Jaide.interface_counters().
+    @type fpcs: list
+    @param with_data: Set to True to also return the structured errors the
+                    | output is made from, for fleet summaries of the text
+                    | output.
+    @type with_data: bool
+
+    @returns: The output from the device, or with with_data a tuple of the
+            | output and the errors, see interface_errors_data().
+    @rtype str or tuple
     """
-    response = jaide.interface_errors()
-    if 'No interface errors' in response:
-        return response
+    data = interface_errors_data(jaide, baseline, fpcs)
+    if not baseline:
+        output = describe_errors(data)
+        if data:
+            output = color(output, 'red')
+    elif data['since'] is None:
+        # the first run against this baseline, show the totals.
+        output = describe_errors(data['errors'])
+        if data['errors']:
+            output = color(output, 'red')
+        output += ('Counter baseline recorded for %d interfaces. Later runs '
+                   'with this baseline only show new errors.\n' %
+                   data['interfaces'])
+    elif not data['errors']:
+        output = ('No new interface errors in the %d seconds since %s.\n' %
+                  (data['interval'], time.strftime(
+                      '%Y-%m-%d %H:%M:%S', time.localtime(data['since']))))
     else:
-        return color(response, 'red')
+        output = color('\n'.join('%s (%s) has %d new %s, %.3f per second.' % (
+            error['interface'], error['status'], error['delta'],
+            'flaps' if error['counter'] == 'carrier-transitions' else
+            error['counter'], error['rate']) for error in data['errors']) +
+            '\n', 'red')
+    return (output, data) if with_data else output
+
+
+def interface_errors_data(jaide, baseline=None, fpcs=None):
+    """ Retrieve any interface errors from all interfaces as a list.
+
+    @param jaide: The jaide connection to the device.
+    @type jaide: jaide.Jaide object
+    @param baseline: A directory of counter baselines, see
+                   | interface_errors().
+    @type baseline: str
+    @param fpcs: FPC slot numbers, see interface_errors().
+    @type fpcs: list
+
+    @returns: Without a baseline, a dictionary per error counter, see
+            | Jaide.interface_errors_data(). With a baseline, a dictionary
+            | with the keys 'since' (the time of the previous snapshot, or
+            | None on the first run), 'interval' (seconds since it),
+            | 'interfaces' (the number of interfaces recorded) and 'errors'.
+            | The errors are the counters that grew since the previous
+            | snapshot, see jaide.baseline.CounterSnapshot.growth(), or on
+            | the first run the significant errors.
+    @rtype list or dict
+    """
+    if not baseline:
+        return jaide.interface_errors_data(fpcs)
+    store = BaselineStore(baseline)
+    previous = store.load(jaide.host)
+    counters = jaide.interface_counters(fpcs)
+    snapshot = CounterSnapshot.from_counters(jaide.host, counters)
+    store.save(snapshot)
+    if previous is None:
+        return {'since': None, 'interval': None, 'interfaces': len(counters),
+                'errors': significant_errors(counters)}
+    return {'since': previous.taken,
+            'interval': snapshot.taken - previous.taken,
+            'interfaces': len(counters),
+            'errors': previous.growth(counters, snapshot.taken)}
+
+
+def playbook(jaide, book, check=False):
+    """ Run the steps of a playbook on a device.
 
+    @param jaide: The jaide connection to the device.
+    @type jaide: jaide.Jaide object
+    @param book: The playbook to run, see jaide.playbook.
+    @type book: jaide.playbook.Playbook
+    @param check: Set to True to run the commit steps as commit checks.
+    @type check: bool
 
-def pull(jaide, source, destination, progress, multi):
+    @returns: The output of the steps, and the result of each step.
+    @rtype tuple
+    """
+    return book.run(jaide, check)
+
+
+def pull(jaide, source, destination, progress, multi, progress_queue=None):
     """ Copy file(s) from a device to the local machine.
 
     @param jaide: The jaide connection to the device.
@@ -371,6 +589,10 @@ def pull(jaide, source, destination, progress, multi):
     @param multi: Flagged to true if we're copying from multiple devices.
                 | Used to name the destination files.
     @type multi: bool
+    @param progress_queue: If set, progress is sent as rate-limited events
+                         | on this queue for a jaide.progress.ProgressMonitor
+                         | instead of being printed by this process.
+    @type progress_queue: Queue
 
     @returns: The output of the copy.
     @rtype str
@@ -386,25 +608,35 @@ def pull(jaide, source, destination, progress, multi):
     source = source[:-1] if source[-1] == '/' else source
     source_file = path.basename(source) if not '' else path.basename(path.join(source, '..'))
     dest_file = destination + jaide.host + '_' + source_file if multi else destination + source_file
+    reporter = None
+    if progress and progress_queue is not None:
+        progress = reporter = ProgressReporter(jaide.host, progress_queue)
     try:
         jaide.scp_pull(source, dest_file, progress)
-        if progress:  # move to the next line if we were printing the progress
+        if progress is True:  # move to the next line after printing progress
             click.echo('')
-    except SCPException as e:
+    except scp.SCPException as e:
         output += color('!!! Error during copy from ' + jaide.host +
                         '. Some files may have failed to transfer. SCP Module'
                         ' error:\n' + str(e) + ' !!!\n', 'red')
+        if reporter:
+            reporter.fail(e)
     except (IOError, OSError) as e:
         output += color('!!! The local filepath was not found! Note that \'~\''
                         ' cannot be used. Error:\n' + str(e) + ' !!!\n',
                         'red')
+        if reporter:
+            reporter.fail(e)
     else:
         output += color('Received %s:%s and stored it in %s.\n' %
                         (jaide.host, source, path.normpath(dest_file)))
+        if reporter:
+            reporter.done()
     return output
 
 
-def push(jaide, source, destination, progress, multi=False):
+def push(jaide, source, destination, progress, multi=False,
+         progress_queue=None):
     """ Copy file(s) from the local machine to a junos device.
 
     @param jaide: The jaide connection to the device.
@@ -420,6 +652,10 @@ def push(jaide, source, destination, progress, multi=False):
     @param multi: Flagged to true if we're copying from multiple devices.
                 | Not needed in this function
     @type multi: bool
+    @param progress_queue: If set, progress is sent as rate-limited events
+                         | on this queue for a jaide.progress.ProgressMonitor
+                         | instead of being printed by this process.
+    @type progress_queue: Queue
 
     @returns: The output of the copy.
     @rtype str
@@ -433,37 +669,57 @@ def push(jaide, source, destination, progress, multi=False):
     # remotely, and not just the contents. Basically, this forces the behavior
     # 'scp -r /var/log /dest/loc' instead of 'scp -r /var/log/* /dest/loc'
     source = source[:-1] if source[-1] == '/' else source
+    reporter = None
+    if progress and progress_queue is not None:
+        # the local side is known, so we can give the monitor a total.
+        progress = reporter = ProgressReporter(jaide.host, progress_queue,
+                                               total=local_size(source))
     try:
         jaide.scp_push(source, destination, progress)
-        if progress:
+        if progress is True:
             click.echo('')
-    except SCPException as e:
+    except scp.SCPException as e:
         output += color('!!! Error during copy from ' + jaide.host +
                         '. Some files may have failed to transfer. SCP Module'
                         ' error:\n' + str(e) + ' !!!\n', 'red')
+        if reporter:
+            reporter.fail(e)
     except (IOError, OSError) as e:
         output += color('!!! The local filepath was not found! Note that \'~\''
                         ' cannot be used. Error:\n' + str(e) + ' !!!\n',
                         'red')
+        if reporter:
+            reporter.fail(e)
     else:
         output += color('Pushed %s to %s:%s\n' % (source, jaide.host,
                         destination))
+        if reporter:
+            reporter.done()
     return output
 
 
-def shell(jaide, commands):
+def shell(jaide, commands, batch=True):
     """ Send shell commands to a device.
 
     @param jaide: The jaide connection to the device.
     @type jaide: jaide.Jaide object
     @param commands: The shell commands to send to the device.
     @type commands: str or list.
+    @param batch: Set to False to send the commands one at a time with
+                | Jaide.shell_cmd(), instead of all at once with
+                | Jaide.shell_batch().
+    @type batch: bool
 
     @returns: The output of the commands.
     @rtype str
     """
     out = ""
-    for cmd in clean_lines(commands):
+    commands = list(clean_lines(commands))
+    if batch:
+        replies = jaide.shell_batch(commands)
+    else:
+        replies = (jaide.shell_cmd(cmd) for cmd in commands)
+    for cmd, reply in zip(commands, replies):
         out += color('> %s\n' % cmd, 'yel')
-        out += jaide.shell_cmd(cmd) + '\n'
+        out += reply + '\n'
     return out
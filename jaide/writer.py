@@ -0,0 +1,297 @@
+""" Buffered output writer for the -w/--write option.
+
+Writing each device result used to mean opening the destination file,
+appending to it and closing it again, on the same thread that delivers
+results. The OutputWriter instead takes results on a queue and does the
+file work on its own thread. It keeps a bounded number of file handles
+open, batches small writes together, and can stream every device output
+into a single tar or zip archive instead of thousands of separate files.
+Outputs spooled to temporary files are copied out chunk by chunk. Like
+click.echo() to a file, the text format is written without color codes.
+"""
+from __future__ import print_function
+# standard modules
+from collections import OrderedDict
+from os import path
+import Queue
+from StringIO import StringIO
+import tarfile
+import threading
+import time
+import zipfile
+# intra-Jaide imports
+from color_utils import color, strip_color
+from spool import SpoolBuffer
+# non-standard modules:
+import click
+
+# the accepted -w modes, mapped to their canonical names.
+MODES = {
+    's': 'single',
+    'single': 'single',
+    'm': 'multiple',
+    'multiple': 'multiple',
+    't': 'tar',
+    'tar': 'tar',
+    'z': 'zip',
+    'zip': 'zip',
+}
+
+
+class OutputWriter(object):
+
+    """ Write device results to files from a background thread.
+
+    Modes:
+        single: Every result is appended to the destination file.
+        multiple: Each result is appended to its own file, named by
+                | prefixing the destination filename with the device.
+        tar: Each result is a member of a streamed tar archive at the
+           | destination (compressed if it ends in .gz/.tgz or .bz2).
+        zip: Each result is a member of a zip archive at the destination.
+    """
+
+    def __init__(self, mode, dest_file, max_open=64, buffer_size=1 << 20,
+                 echo=True, formatter=None):
+        """ Initialize the writer.
+
+        @param mode: One of the keys of MODES.
+        @type mode: str
+        @param dest_file: The destination filepath.
+        @type dest_file: str
+        @param max_open: The number of file handles to keep open in the
+                       | multiple mode. The least recently used is closed
+                       | when another is needed.
+        @type max_open: int
+        @param buffer_size: The number of bytes to buffer before writing
+                          | out, when results arrive faster than the
+                          | writer empties the queue.
+        @type buffer_size: int
+        @param echo: Whether to print the summary line when closing.
+        @type echo: bool
+        @param formatter: Renders each result, and provides the header
+                        | written at the start of every new file or
+                        | archive member. Results are rendered as text when
+                        | it isn't given.
+        @type formatter: jaide.formats.Formatter
+        """
+        if mode.lower() not in MODES:
+            raise ValueError('mode must be one of: %s' %
+                             ', '.join(sorted(MODES)))
+        self.mode = MODES[mode.lower()]
+        self.dest_file = dest_file
+        self.max_open = max(max_open, 1)
+        self.buffer_size = buffer_size
+        self.echo = echo
+        self.formatter = formatter
+        self.written = 0
+        self.files = set()
+        self.errors = []
+        self._queue = Queue.Queue()
+        self._handles = OrderedDict()
+        self._pending = OrderedDict()
+        self._buffered = 0
+        self._archive = None
+        self._thread = None
+
+    def start(self):
+        """ Start writing in a background thread. """
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def write(self, result):
+        """ Queue a device result to be written.
+
+        @param result: The result of a device job.
+        @type result: jaide.result.DeviceResult
+        """
+        if isinstance(result.output, SpoolBuffer) and (
+                self.formatter is None or self.formatter.format == 'text'):
+            # rendered from its temporary file on the writer thread.
+            output = result
+        elif self.formatter is not None:
+            output = self.formatter.format_result(result)
+        else:
+            output = result.render()
+        self._queue.put((result.host, output))
+
+    def close(self):
+        """ Write out everything that was queued, and close all files.
+
+        @returns: The number of results written.
+        @rtype: int
+        """
+        self._queue.put(None)
+        if self._thread is not None:
+            self._thread.join()
+        else:
+            self._run()
+        if self.echo:
+            if self.mode in ('tar', 'zip'):
+                where = self.dest_file
+            elif len(self.files) == 1:
+                where = list(self.files)[0]
+            else:
+                where = '%d files named like %s' % (
+                    len(self.files), self._filename('IP'))
+            click.echo(color('Output for %d devices written to: %s' %
+                             (self.written, where)))
+        for filename, error, output in self.errors:
+            print(color("Could not write output file '%s'. Output would "
+                        "have been:\n%s" % (filename, output), 'red'))
+            print(color('Here is the error for opening the output file:' +
+                        str(error), 'red'))
+        return self.written
+
+    def _filename(self, host):
+        """ The file (or archive member) name for a device. """
+        if self.mode == 'single':
+            return self.dest_file
+        folder, name = path.split(self.dest_file)
+        if self.mode == 'multiple':
+            return path.join(folder, host + "_" + name)
+        # archive members are named after the archive itself.
+        for ext in ('.tar.gz', '.tar.bz2', '.tgz', '.tar', '.zip'):
+            if name.endswith(ext):
+                name = name[:-len(ext)]
+                break
+        extension = self.formatter.extension if self.formatter else 'txt'
+        return host + "_" + (name or 'output') + '.' + extension
+
+    def _run(self):
+        done = False
+        while not done:
+            try:
+                item = self._queue.get(True, .5)
+            except Queue.Empty:
+                self._flush()
+                continue
+            while True:
+                if item is None:
+                    done = True
+                    break
+                self._add(*item)
+                # keep taking what is already queued, as long as the buffer
+                # has room, so that bursts become a single write per file.
+                if self._buffered >= self.buffer_size:
+                    break
+                try:
+                    item = self._queue.get(False)
+                except Queue.Empty:
+                    break
+            self._flush()
+        self._close_all()
+
+    def _add(self, host, output):
+        if isinstance(output, unicode):
+            output = output.encode('utf-8')
+        self.written += 1
+        filename = self._filename(host)
+        if not isinstance(output, basestring):
+            self._add_spooled(filename, output)
+            return
+        if self._plain:
+            output = strip_color(output)
+        if self.mode in ('tar', 'zip'):
+            self._add_member(filename, output)
+            return
+        self._pending.setdefault(filename, []).append(output)
+        self._buffered += len(output)
+
+    def _flush(self):
+        for filename, chunks in self._pending.items():
+            output = ''.join(chunks)
+            try:
+                self._handle(filename).write(output)
+            except IOError as e:
+                self.errors.append((filename, e, output))
+                self.written -= len(chunks)
+        self._pending.clear()
+        self._buffered = 0
+
+    def _add_spooled(self, filename, result):
+        """ Write a result whose output is a SpoolBuffer, chunk by chunk. """
+        if self.mode in ('tar', 'zip'):
+            # the member is assembled first, since its size has to be known.
+            member = SpoolBuffer()
+            if self.formatter is not None:
+                member.write(self.formatter.header())
+            for chunk in result.chunks():
+                member.write(strip_color(chunk))
+            self._add_member(filename, member)
+            member.close()
+            return
+        # what is already buffered for the file goes first.
+        self._flush()
+        try:
+            handle = self._handle(filename)
+            for chunk in result.chunks():
+                handle.write(strip_color(chunk))
+        except IOError as e:
+            self.errors.append((filename, e, result.render()))
+            self.written -= 1
+
+    @property
+    def _plain(self):
+        """ Whether results are written as text, without their colors. """
+        return self.formatter is None or self.formatter.format == 'text'
+
+    def _handle(self, filename):
+        """ Return an open file for appending, opening it if needed. """
+        handle = self._handles.pop(filename, None)
+        if handle is None:
+            new = not path.exists(filename) or not path.getsize(filename)
+            handle = open(filename, 'a+b')
+            if new and self.formatter is not None:
+                handle.write(self.formatter.header())
+            self.files.add(filename)
+            if len(self._handles) >= self.max_open:
+                self._handles.popitem(last=False)[1].close()
+        # (re)insert as the most recently used.
+        self._handles[filename] = handle
+        return handle
+
+    def _add_member(self, name, output):
+        # a SpoolBuffer member already starts with the formatter's header.
+        spooled = isinstance(output, SpoolBuffer)
+        if self.formatter is not None and not spooled:
+            output = self.formatter.header() + output
+        try:
+            if self._archive is None:
+                self._archive = self._open_archive()
+            if self.mode == 'zip':
+                if spooled and output.spilled:
+                    self._archive.write(output.name, name)
+                else:
+                    self._archive.writestr(name, str(output))
+            else:
+                info = tarfile.TarInfo(name)
+                info.size = len(output)
+                info.mtime = time.time()
+                self._archive.addfile(info, output if spooled
+                                      else StringIO(output))
+        except (IOError, OSError, tarfile.TarError, zipfile.BadZipfile) as e:
+            self.errors.append((self.dest_file, e, output))
+            self.written -= 1
+
+    def _open_archive(self):
+        if self.mode == 'zip':
+            return zipfile.ZipFile(self.dest_file, 'w', zipfile.ZIP_DEFLATED,
+                                   allowZip64=True)
+        compression = ''
+        if self.dest_file.endswith(('.gz', '.tgz')):
+            compression = 'gz'
+        elif self.dest_file.endswith('.bz2'):
+            compression = 'bz2'
+        return tarfile.open(self.dest_file, 'w|' + compression)
+
+    def _close_all(self):
+        self._flush()
+        while self._handles:
+            self._handles.popitem()[1].close()
+        if self._archive is not None:
+            self._archive.close()
+            self.files.add(self.dest_file)
+
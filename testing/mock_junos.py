@@ -0,0 +1,1080 @@
+#!/usr/bin/env python
+""" Simulated Junos devices for exercising Jaide without real hardware.
+
+A MockDevice is a paramiko SSH server that speaks just enough Junos to
+satisfy everything the Jaide class does: exec channels for operational
+commands, an interactive shell with Junos-like prompts (both the CLI and
+the FreeBSD shell), the NETCONF subsystem, and SCP in both directions.
+Replies are canned, and each device can be slowed down or made to fail
+so that throughput and error handling can be measured reproducibly.
+
+A MockFleet starts many devices on localhost. Each device is bound to its
+own loopback address and all of them share one port, so the jaide CLI
+(which uses a single -P port for every host) can drive the whole fleet:
+
+    $ python testing/mock_junos.py --count 50 --port 2222 -H hosts.txt
+    $ jaide -i hosts.txt -u jaide -p jaide -P 2222 info
+
+The same objects can be used directly from python:
+
+    with MockFleet(10, port=2222) as fleet:
+        session = Jaide(fleet.hosts[0], 'jaide', 'jaide', port=2222)
+"""
+from __future__ import print_function
+# standard modules
+from os import path
+import os
+import random
+import re
+import shlex
+import shutil
+import socket
+import tempfile
+import threading
+import time
+from xml.sax.saxutils import escape
+# non-standard modules
+from lxml import etree
+import paramiko
+import click
+
+NC_DELIM = ']]>]]>'
+NC_NS = 'urn:ietf:params:xml:ns:netconf:base:1.0'
+CAPABILITIES = [
+    'urn:ietf:params:netconf:base:1.0',
+    'urn:ietf:params:xml:ns:netconf:base:1.0',
+    'urn:ietf:params:netconf:capability:candidate:1.0',
+    'urn:ietf:params:netconf:capability:confirmed-commit:1.0',
+    'urn:ietf:params:netconf:capability:validate:1.0',
+    'urn:ietf:params:netconf:capability:url:1.0?scheme=http,ftp,file',
+    'http://xml.juniper.net/netconf/junos/1.0',
+    'http://xml.juniper.net/dmi/system/1.0',
+]
+# Interface families created by the interface generator, in the order
+# they're handed out.
+FAMILIES = ['ge', 'xe', 'et', 'ae', 'fe', 'so', 'irb', 'vlan', 'lo0', 'em',
+            'fxp', 'gr', 'ip', 'lsi', 'pfe', 'vtep']
+INPUT_ERRORS = ['input-errors', 'input-drops', 'framing-errors', 'input-runts',
+                'input-discards', 'input-l3-incompletes',
+                'input-l2-channel-errors', 'input-l2-mismatch-timeouts',
+                'input-fifo-errors', 'input-resource-errors']
+OUTPUT_ERRORS = ['carrier-transitions', 'output-errors', 'output-collisions',
+                 'output-drops', 'aged-packets', 'mtu-errors',
+                 'hs-link-crc-errors', 'output-fifo-errors',
+                 'output-resource-errors']
+
+_host_key = []
+_host_key_lock = threading.Lock()
+
+
+def host_key():
+    """ Return the RSA host key shared by every simulated device.
+
+    Generating a key is slow, so it is created once per process.
+
+    @returns: The server host key.
+    @rtype: paramiko.RSAKey
+    """
+    with _host_key_lock:
+        if not _host_key:
+            _host_key.append(paramiko.RSAKey.generate(1024))
+    return _host_key[0]
+
+
+def interfaces_xml(count, error_rate=0.05, seed=0, names=None):
+    """ Build a 'show interfaces extensive' style interface-information tree.
+
+    Purpose: Generates `count` physical interfaces spread over the Junos
+           | interface families, each with a single logical unit. A share
+           | of the interfaces (error_rate) get non-zero error counters.
+           | The output is deterministic for a given seed, and each
+           | interface gets the same values whether or not names filters
+           | it out of the output.
+
+    @param count: The number of physical interfaces to generate.
+    @type count: int
+    @param error_rate: The fraction of interfaces that should have errors.
+    @type error_rate: float
+    @param seed: The seed for the random number generator.
+    @type seed: int
+    @param names: An optional list of interface name patterns, as used in the
+                | <interface-name> filter of get-interface-information.
+                | Shell style wildcards are honoured.
+    @type names: list
+
+    @returns: The interface-information xml.
+    @rtype: str
+    """
+    patterns = [re.compile(re.escape(n).replace('\\*', '.*') + '$')
+                for n in (names or [])]
+    out = ['<interface-information style="extensive">']
+    for number in range(count):
+        family = FAMILIES[number % len(FAMILIES)]
+        slot = number // len(FAMILIES)
+        if family in ('lo0', 'irb', 'vlan', 'em', 'fxp'):
+            name = family if slot == 0 else '%s%d' % (family.rstrip('0'),
+                                                      slot)
+        else:
+            name = '%s-%d/%d/%d' % (family, slot // 48, (slot // 12) % 4,
+                                    slot % 12)
+        if patterns and not any(p.match(name) for p in patterns):
+            continue
+        rand = random.Random('%s/%s' % (seed, name))
+        broken = rand.random() < error_rate
+        out.append('<physical-interface>\n<name>%s</name>\n'
+                   '<admin-status>up</admin-status>\n'
+                   '<oper-status>%s</oper-status>\n'
+                   '<mtu>1514</mtu>\n<speed>1000mbps</speed>\n' %
+                   (name, 'down' if broken and rand.random() < .3 else 'up'))
+        out.append('<traffic-statistics>\n<input-bytes>%d</input-bytes>\n'
+                   '<output-bytes>%d</output-bytes>\n'
+                   '</traffic-statistics>\n' %
+                   (rand.randint(0, 10 ** 12), rand.randint(0, 10 ** 12)))
+        for face, counters in (('input', INPUT_ERRORS),
+                               ('output', OUTPUT_ERRORS)):
+            out.append('<%s-error-list>\n' % face)
+            for counter in counters:
+                value = 0
+                if broken and rand.random() < .25:
+                    value = rand.randint(1, 5000)
+                out.append('<%s>%d</%s>\n' % (counter, value, counter))
+            out.append('</%s-error-list>\n' % face)
+        out.append('<logical-interface>\n<name>%s.0</name>\n'
+                   '<address-family><address-family-name>inet'
+                   '</address-family-name></address-family>\n'
+                   '</logical-interface>\n' % name)
+        out.append('</physical-interface>\n')
+    out.append('</interface-information>')
+    return ''.join(out)
+
+
+class MockDevice(object):
+
+    """ A single simulated Junos device listening on one address and port. """
+
+    def __init__(self, host='127.0.0.1', port=0, username='jaide',
+                 password='jaide', hostname=None, latency=0.0,
+                 bandwidth=None, auth_failure=0.0, drop_rate=0.0,
+                 hang_rate=0.0, error_rate=0.0, interfaces=48, seed=None,
+                 replies=None, fs_root=None):
+        """ Initialize the simulated device.
+
+        @param host: The address to listen on.
+        @type host: str
+        @param port: The port to listen on. 0 picks a free port, which is
+                   | available from the `port` attribute after start().
+        @type port: int
+        @param username: The username accepted by the device. The user
+                       | 'root' is always accepted with the same password,
+                       | and lands in the shell instead of the CLI.
+        @type username: str
+        @param password: The password accepted by the device.
+        @type password: str
+        @param hostname: The Junos hostname. Defaults to one derived from
+                       | the listening address.
+        @type hostname: str
+        @param latency: Seconds to wait before every reply.
+        @type latency: float
+        @param bandwidth: Bytes per second to throttle replies and file
+                        | transfers to. None for unlimited.
+        @type bandwidth: int
+        @param auth_failure: Probability [0-1] of rejecting valid credentials.
+        @type auth_failure: float
+        @param drop_rate: Probability [0-1] of closing a new connection
+                        | before the SSH handshake.
+        @type drop_rate: float
+        @param hang_rate: Probability [0-1] of never answering a command.
+        @type hang_rate: float
+        @param error_rate: Probability [0-1] of answering a NETCONF rpc with
+                         | an rpc-error, or an op command with a syntax error.
+        @type error_rate: float
+        @param interfaces: The number of physical interfaces to simulate.
+        @type interfaces: int
+        @param seed: Seed for failure injection and the generated data.
+        @type seed: int
+        @param replies: Extra or replacement canned replies, keyed by the
+                      | full operational command ('show version'). Values
+                      | are a (text, xml) tuple; either may be None.
+        @type replies: dict
+        @param fs_root: A local directory standing in for the device file
+                      | system for SCP and the shell. A temporary directory
+                      | is created (and removed on stop) if not given.
+        @type fs_root: str
+        """
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.hostname = hostname or 'mock-' + host.replace('.', '-')
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.auth_failure = auth_failure
+        self.drop_rate = drop_rate
+        self.hang_rate = hang_rate
+        self.error_rate = error_rate
+        self.interfaces = interfaces
+        self.seed = (seed if seed is not None else
+                     hash('%s:%s' % (host, port)) & 0xffff)
+        self._random = random.Random(self.seed)
+        self._own_root = fs_root is None
+        self.fs_root = fs_root or tempfile.mkdtemp(prefix='jaide-mock-')
+        self.candidate = []
+        self.commits = 0
+        self.stats = {'connections': 0, 'commands': 0, 'rpcs': 0,
+                      'bytes_sent': 0}
+        self._replies = self._canned_replies()
+        self._replies.update(replies or {})
+        self._sock = None
+        self._stopped = threading.Event()
+        self._seed_filesystem()
+
+    # ----- life cycle -----
+
+    def start(self):
+        """ Bind the listening socket and start accepting connections. """
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind((self.host, self.port))
+        self.port = self._sock.getsockname()[1]
+        self._sock.listen(128)
+        self._sock.settimeout(.5)
+        _daemon(self._accept_loop)
+        return self
+
+    def stop(self):
+        """ Stop accepting connections and clean up the file system. """
+        self._stopped.set()
+        if self._sock is not None:
+            self._sock.close()
+        if self._own_root:
+            shutil.rmtree(self.fs_root, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def _accept_loop(self):
+        while not self._stopped.is_set():
+            try:
+                client, _ = self._sock.accept()
+            except socket.timeout:
+                continue
+            except socket.error:
+                return
+            _daemon(self._serve_connection, client)
+
+    def _serve_connection(self, client):
+        self.stats['connections'] += 1
+        if self._chance(self.drop_rate):
+            client.close()
+            return
+        transport = paramiko.Transport(client)
+        transport.add_server_key(host_key())
+        try:
+            transport.start_server(server=_Server(self))
+        except (paramiko.SSHException, EOFError, socket.error):
+            return
+        # channels are serviced from the _Server callbacks. The transport
+        # only holds weak references to its channels, so keep the accepted
+        # ones alive here until the client goes away.
+        channels = []
+        while transport.is_active() and not self._stopped.is_set():
+            channel = transport.accept(1)
+            if channel is not None:
+                channels = [c for c in channels if not c.closed]
+                channels.append(channel)
+        transport.close()
+
+    # ----- helpers -----
+
+    def _chance(self, rate):
+        return rate > 0 and self._random.random() < rate
+
+    def _delay(self):
+        if self._chance(self.hang_rate):
+            while not self._stopped.is_set():
+                time.sleep(1)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def send(self, channel, data):
+        """ Send data on a channel, throttled to the device bandwidth. """
+        self.stats['bytes_sent'] += len(data)
+        if not self.bandwidth:
+            channel.sendall(data)
+            return
+        chunk = max(1024, self.bandwidth // 20)
+        for start in range(0, len(data), chunk):
+            piece = data[start:start + chunk]
+            channel.sendall(piece)
+            time.sleep(len(piece) / float(self.bandwidth))
+
+    def local_path(self, device_path):
+        """ Map a path on the device into fs_root. """
+        return path.join(self.fs_root, path.normpath(
+            '/' + device_path).lstrip('/'))
+
+    def _seed_filesystem(self):
+        for folder in ('var/tmp', 'var/log', 'var/home'):
+            if not path.isdir(path.join(self.fs_root, folder)):
+                os.makedirs(path.join(self.fs_root, folder))
+        messages = path.join(self.fs_root, 'var/log/messages')
+        if not path.exists(messages):
+            with open(messages, 'wb') as log:
+                for line in range(2000):
+                    log.write('Jan  1 00:00:%02d %s mgd[%d]: UI_CMDLINE_READ_'
+                              'LINE: User jaide, command "show version"\n' %
+                              (line % 60, self.hostname, 1000 + line))
+
+    # ----- operational commands -----
+
+    def _canned_replies(self):
+        version = '15.1R7.9'
+        software = (
+            '<software-information>\n<host-name>%s</host-name>\n'
+            '<product-model>mx480</product-model>\n'
+            '<product-name>mx480</product-name>\n'
+            '<junos-version>%s</junos-version>\n<package-information>\n'
+            '<name>junos</name>\n<comment>JUNOS Base OS boot [%s]</comment>\n'
+            '</package-information>\n</software-information>' %
+            (self.hostname, version, version))
+        uptime = (
+            '<system-uptime-information>\n<current-time><date-time>'
+            '2016-01-01 00:00:00 UTC</date-time></current-time>\n'
+            '<uptime-information><up-time>100 days, 2:03</up-time>'
+            '</uptime-information>\n</system-uptime-information>')
+        hardware = (
+            '<chassis-inventory>\n<chassis>\n<name>Chassis</name>\n'
+            '<serial-number>JN%08X</serial-number>\n'
+            '<description>MX480</description>\n<chassis-module>\n'
+            '<name>Routing Engine 0</name>\n<serial-number>9009%06d'
+            '</serial-number>\n<description>RE-S-1800x4</description>\n'
+            '</chassis-module>\n</chassis>\n</chassis-inventory>' %
+            (self.seed, self.seed))
+        # the health values differ per device, so that fleet summaries of
+        # the health command have something to show.
+        rand = random.Random(self.seed)
+        health = {'temp': rand.randint(30, 60), 'memory': rand.randint(10, 90),
+                  'user': rand.randint(0, 40), 'kernel': rand.randint(0, 20),
+                  'rpd': rand.uniform(0, 60), 'load': rand.uniform(0, 4)}
+        health['cpu_temp'] = health['temp'] + 3
+        health['idle'] = 100 - health['user'] - health['kernel']
+        route_engine_text = (
+            'Routing Engine status:\n  Slot 0:\n    Current state          '
+            '        Master\n    Temperature                 %(temp)d degrees'
+            ' C\n    CPU temperature             %(cpu_temp)d degrees C\n    '
+            'DRAM                      16384 MB\n    Memory '
+            'utilization          %(memory)d percent\n    CPU utilization:\n'
+            '      User                      %(user)2d percent\n      '
+            'Background                 0 percent\n      Kernel            '
+            '        %(kernel)2d percent\n      Interrupt                  0 '
+            'percent\n      Idle                      %(idle)2d percent\n    '
+            'Uptime                         100 days, 2 hours, 3 minutes\n'
+            % health)
+        route_engine = (
+            '<route-engine-information>\n<route-engine>\n<slot>0</slot>\n'
+            '<mastership-state>master</mastership-state>\n'
+            '<temperature junos:celsius="%(temp)d">%(temp)d degrees C'
+            '</temperature>\n<cpu-temperature junos:celsius="%(cpu_temp)d">'
+            '%(cpu_temp)d degrees C</cpu-temperature>\n<memory-dram-size>'
+            '16384 MB</memory-dram-size>\n<memory-buffer-utilization>'
+            '%(memory)d</memory-buffer-utilization>\n<cpu-user>%(user)d'
+            '</cpu-user>\n<cpu-background>0</cpu-background>\n<cpu-system>'
+            '%(kernel)d</cpu-system>\n<cpu-interrupt>0</cpu-interrupt>\n'
+            '<cpu-idle>%(idle)d</cpu-idle>\n<load-average-one>%(load).2f'
+            '</load-average-one>\n<load-average-five>%(load).2f'
+            '</load-average-five>\n<load-average-fifteen>%(load).2f'
+            '</load-average-fifteen>\n<up-time junos:seconds="8650980">100 '
+            'days, 2 hours, 3 minutes</up-time>\n</route-engine>\n'
+            '</route-engine-information>' % health)
+        processes = (
+            'last pid: 12345;  load averages:  %(load).2f,  %(load).2f,  '
+            '%(load).2f  up 100+02:03:04    00:00:00\n140 processes: 2 '
+            'running, 137 sleeping, 1 zombie\n\nMem: 1024M Active, 512M '
+            'Inact, 256M Wired, 128M Cache, 112M Buf, 14G Free\nSwap: 8192M '
+            'Total, 8192M Free\n\n\n  PID USERNAME  THR PRI NICE   SIZE    '
+            'RES STATE  C   TIME   WCPU COMMAND\n   11 root        4 155 ki31'
+            '     0K    64K CPU3   3 9000:00 380.00%% idle\n 1234 root        '
+            '2  40    0   500M   300M kqread 1  50:00 %(rpd)5.2f%% rpd\n 1240 '
+            'root        1  20    0   100M    50M select 0  10:00  1.20%% mgd'
+            '\n 1300 root        1  20    0    80M    40M select 2   5:00  '
+            '0.50%% chassisd\n 1310 root        1  20    0    60M    30M '
+            'select 1   2:00  0.20%% dcd\n 1320 root        1  20    0    40M'
+            '    20M select 0   1:00  0.10%% snmpd\n 1330 root        1  20 '
+            '   0    30M    15M select 3   0:30  0.00%% eventd\n' % health)
+        alarms = ('<alarm-information>\n<alarm-summary>\n<no-active-alarms/>'
+                  '\n</alarm-summary>\n</alarm-information>')
+        terse = '\n'.join(
+            '%-24sup    up' % name for name in
+            re.findall(r'<name>([^<]+)</name>',
+                       interfaces_xml(min(self.interfaces, 64), 0, self.seed)))
+        config = (
+            'system {\n    host-name %s;\n    services {\n        ssh;\n'
+            '        netconf {\n            ssh;\n        }\n    }\n}\n'
+            'interfaces {\n    ge-0/0/0 {\n        description uplink;\n'
+            '    }\n}\n' % self.hostname)
+        config_set = (
+            'set system host-name %s\nset system services ssh\n'
+            'set system services netconf ssh\n'
+            'set interfaces ge-0/0/0 description uplink\n' % self.hostname)
+        return {
+            'show version': ('Hostname: %s\nModel: mx480\nJunos: %s\n' %
+                             (self.hostname, version), software),
+            'show system uptime': ('Current time: 2016-01-01 00:00:00 UTC\n'
+                                   'System booted: 100 days, 2:03\n', uptime),
+            'show chassis hardware': ('Chassis  JN%08X  MX480\n' % self.seed,
+                                      hardware),
+            'show chassis routing-engine': (route_engine_text, route_engine),
+            'show chassis alarms': ('No alarms currently active\n', alarms),
+            'show system alarms': ('No alarms currently active\n', alarms),
+            'show system processes extensive': (processes, None),
+            'show interfaces terse': (terse + '\n', None),
+            'show interfaces extensive': (None, None),
+            'show route summary': ('Autonomous system number: 65000\n'
+                                   'inet.0: 850000 destinations\n', None),
+            'show configuration': (config, None),
+            'show configuration | display set': (config_set, None),
+            'show system commit': ('0   2016-01-01 00:00:00 UTC by jaide via '
+                                   'netconf\n', None),
+            'set cli screen-length 0': ('', None),
+            'set cli screen-width 0': ('', None),
+        }
+
+    def _expand(self, command):
+        """ Expand abbreviated command words ('sh int ext') to a known key. """
+        if command in self._replies:
+            return command
+        words = command.split()
+        for known in self._replies:
+            known_words = known.split()
+            if (len(known_words) == len(words) and
+                    all(k.startswith(w) for w, k in zip(words, known_words))):
+                return known
+        return None
+
+    def op_reply(self, command):
+        """ Build the reply for an operational command, honouring pipes.
+
+        @param command: The command as typed, including any pipes.
+        @type command: str
+
+        @returns: The text (or xml if '| display xml' was used) reply.
+        @rtype: str
+        """
+        self.stats['commands'] += 1
+        self._delay()
+        parts = [p.strip() for p in command.strip().split('|')]
+        pipes = [p for p in parts[1:] if p and not 'no-more'.startswith(p)]
+        base = parts[0]
+        if 'display set' in pipes:
+            base += ' | display set'
+            pipes.remove('display set')
+        key = self._expand(base)
+        if key is None or self._chance(self.error_rate):
+            return ('                %s\n                ^\nunknown command.\n'
+                    % base)
+        text, xml = self._replies[key]
+        if key == 'show interfaces extensive':
+            xml = interfaces_xml(self.interfaces, seed=self.seed)
+            text = xml
+        if 'display xml' in pipes:
+            pipes.remove('display xml')
+            body = xml if xml is not None else (
+                '<output>%s</output>' % escape(text or ''))
+            return ('<rpc-reply xmlns:junos="http://xml.juniper.net/junos/'
+                    '15.1R7/junos">\n%s\n<cli>\n<banner></banner>\n</cli>\n'
+                    '</rpc-reply>\n' % body)
+        out = text or ''
+        for pipe in pipes:
+            if pipe.startswith('match '):
+                pattern = pipe.split(None, 1)[1].strip('"\'')
+                out = ''.join(line for line in out.splitlines(True)
+                              if re.search(pattern, line))
+            elif pipe == 'count':
+                out = 'Count: %d lines\n' % len(out.splitlines())
+        return out
+
+    # ----- NETCONF -----
+
+    def rpc_reply(self, rpc):
+        """ Answer a single NETCONF rpc.
+
+        @param rpc: The parsed <rpc> element.
+        @type rpc: lxml.etree._Element
+
+        @returns: The serialized <rpc-reply>, without the framing delimiter.
+        @rtype: str
+        """
+        self.stats['rpcs'] += 1
+        self._delay()
+        message_id = rpc.get('message-id', '0')
+        request = rpc[0] if len(rpc) else None
+        tag = etree.QName(request).localname if request is not None else ''
+        body = None
+        if self._chance(self.error_rate):
+            tag = 'injected-failure'
+        if tag == 'command':
+            command = (request.text or '').strip()
+            key = self._expand(command.split('|')[0].strip())
+            if key is None:
+                body = None
+            elif key == 'show interfaces extensive':
+                body = interfaces_xml(self.interfaces, seed=self.seed)
+            elif key.startswith('show configuration'):
+                text = self._replies[self._expand(command) or key][0]
+                body = ('<configuration-information><configuration-output>'
+                        '%s</configuration-output></configuration-information>'
+                        % escape(text))
+            else:
+                text, xml = self._replies[key]
+                if request.get('format') == 'text' or xml is None:
+                    body = '<output>\n%s</output>' % escape(text or '')
+                else:
+                    body = xml
+        elif tag in ('get-software-information',
+                     'get-system-uptime-information',
+                     'get-chassis-inventory', 'get-route-engine-information',
+                     'get-alarm-information', 'get-system-alarm-information'):
+            command = {
+                'get-software-information': 'show version',
+                'get-system-uptime-information': 'show system uptime',
+                'get-chassis-inventory': 'show chassis hardware',
+                'get-route-engine-information': 'show chassis routing-engine',
+                'get-alarm-information': 'show chassis alarms',
+                'get-system-alarm-information': 'show system alarms',
+            }[tag]
+            body = self._replies[command][1]
+        elif tag == 'get-interface-information':
+            names = [e.text for e in request.iter()
+                     if etree.QName(e).localname == 'interface-name']
+            body = interfaces_xml(self.interfaces, seed=self.seed,
+                                  names=names)
+        elif tag == 'lock':
+            body = '<ok/>'
+        elif tag in ('unlock', 'discard-changes', 'close-session'):
+            # the changes a session loaded don't outlive it, so that a
+            # compare only ever shows what its own session loaded.
+            self.candidate = []
+            body = '<ok/>'
+        elif tag == 'load-configuration':
+            for elem in request.iter():
+                if (etree.QName(elem).localname == 'configuration-set' and
+                        elem.text):
+                    self.candidate.extend(
+                        line.strip() for line in elem.text.splitlines()
+                        if line.strip())
+            body = '<load-configuration-results><ok/>' \
+                   '</load-configuration-results>'
+        elif tag == 'get-configuration' and request.get('compare'):
+            diff = ''.join('+  %s\n' % line.replace('set ', '', 1)
+                           for line in self.candidate)
+            body = ('<configuration-information><configuration-output>'
+                    '%s</configuration-output></configuration-information>' %
+                    escape('[edit]\n' + diff if diff else ''))
+        elif tag == 'validate':
+            body = ('<commit-results><routing-engine><name>re0</name>'
+                    '<commit-check-success/></routing-engine>'
+                    '</commit-results>')
+        elif tag in ('commit', 'commit-configuration'):
+            self.commits += 1
+            self.candidate = []
+            body = ('<commit-results><routing-engine><name>re0</name>'
+                    '<commit-success/></routing-engine></commit-results>')
+        if body is None:
+            body = ('<rpc-error><error-type>protocol</error-type><error-tag>'
+                    'operation-failed</error-tag><error-severity>error'
+                    '</error-severity><error-message>syntax error'
+                    '</error-message></rpc-error>')
+        return ('<rpc-reply xmlns="%s" xmlns:junos="http://xml.juniper.net/'
+                'junos/15.1R7/junos" message-id="%s">\n%s\n</rpc-reply>' %
+                (NC_NS, message_id, body))
+
+    def serve_netconf(self, channel):
+        """ Run a NETCONF 1.0 session on a channel until it closes. """
+        hello = ('<?xml version="1.0" encoding="UTF-8"?><hello xmlns="%s">'
+                 '<capabilities>%s</capabilities><session-id>%d</session-id>'
+                 '</hello>' % (NC_NS, ''.join('<capability>%s</capability>' % c
+                                              for c in CAPABILITIES),
+                               self._random.randint(1, 65535)))
+        self.send(channel, hello + NC_DELIM)
+        buf = ''
+        seen_hello = False
+        try:
+            while True:
+                data = channel.recv(65536)
+                if not data:
+                    break
+                buf += data
+                while NC_DELIM in buf:
+                    message, buf = buf.split(NC_DELIM, 1)
+                    if not seen_hello:
+                        seen_hello = True
+                        continue
+                    rpc = etree.fromstring(message.strip())
+                    self.send(channel, self.rpc_reply(rpc) + NC_DELIM)
+                    if len(rpc) and etree.QName(rpc[0]).localname == \
+                            'close-session':
+                        return
+        finally:
+            # a session that drops without discarding its changes doesn't
+            # leave them behind for the next one.
+            self.candidate = []
+            channel.close()
+
+    # ----- exec, shell and scp -----
+
+    def serve_exec(self, channel, command, username):
+        """ Answer an exec request: an op command, a shell command or scp. """
+        try:
+            if command.startswith('scp '):
+                status = _ScpSink(self, channel, command).run()
+            else:
+                if username == 'root':
+                    # root exec channels land in the shell, not the CLI.
+                    out = _Shell(self, channel, username).run_line(command)
+                else:
+                    out = self.op_reply(command)
+                self.send(channel, out)
+                status = 0
+            channel.send_exit_status(status)
+        except socket.error:
+            pass
+        channel.close()
+
+
+class _Server(paramiko.ServerInterface):
+
+    """ paramiko server callbacks for a MockDevice. """
+
+    def __init__(self, device):
+        self.device = device
+        self.username = None
+
+    def get_allowed_auths(self, username):
+        return 'password'
+
+    def check_auth_password(self, username, password):
+        device = self.device
+        if (username in (device.username, 'root') and
+                password == device.password and
+                not device._chance(device.auth_failure)):
+            self.username = username
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_pty_request(self, channel, *args):
+        return True
+
+    def check_channel_window_change_request(self, channel, *args):
+        return True
+
+    def check_channel_shell_request(self, channel):
+        _acknowledge(channel)
+        _daemon(_Shell(self.device, channel, self.username).interact)
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        _acknowledge(channel)
+        _daemon(self.device.serve_exec, channel, command, self.username)
+        return True
+
+    def check_channel_subsystem_request(self, channel, name):
+        if name != 'netconf':
+            return False
+        _acknowledge(channel)
+        _daemon(self.device.serve_netconf, channel)
+        return True
+
+
+class _Shell(object):
+
+    """ An interactive Junos session: the CLI and the FreeBSD shell. """
+
+    def __init__(self, device, channel, username):
+        self.device = device
+        self.channel = channel
+        self.username = username
+        self.cwd = '/var/home/' + username
+        self.echo = True
+        # root logs into the shell, everyone else into the CLI.
+        self.modes = ['shell'] if username == 'root' else ['cli']
+
+    @property
+    def prompt(self):
+        if self.modes[-1] == 'cli':
+            return '%s@%s> ' % (self.username, self.device.hostname)
+        if self.username == 'root':
+            return 'root@%s:RE:0%% ' % self.device.hostname
+        return '%% '
+
+    def write(self, text):
+        self.device.send(self.channel, text.replace('\r\n', '\n').replace(
+            '\n', '\r\n'))
+
+    def interact(self):
+        """ Read lines from the channel and answer them until exit. """
+        try:
+            if self.modes[-1] == 'cli':
+                self.write('--- JUNOS 15.1R7.9 built 2018-01-01 00:00:00 UTC'
+                           '\n\n')
+            self.write(self.prompt)
+            buf = ''
+            while self.modes:
+                data = self.channel.recv(4096)
+                if not data:
+                    break
+                buf += data.replace('\r\n', '\n').replace('\r', '\n')
+                while '\n' in buf and self.modes:
+                    line, buf = buf.split('\n', 1)
+                    if self.echo:
+                        self.write(line + '\n')
+                    out = self.run_line(line)
+                    if out:
+                        self.write(out)
+                    if self.modes:
+                        self.write(self.prompt)
+        except socket.error:
+            pass
+        self.channel.close()
+
+    def run_line(self, line):
+        """ Run one typed line in the current mode, returning its output. """
+        line = line.strip()
+        if not line:
+            return ''
+        if self.modes[-1] == 'cli':
+            return self.run_cli(line)
+        return ''.join(self.run_shell(cmd) for cmd in _split_commands(line))
+
+    def run_cli(self, line):
+        if line.split()[0] in ('exit', 'quit'):
+            self.modes.pop()
+            return ''
+        if line.startswith('start shell'):
+            self.modes.append('shell')
+            return ''
+        return self.device.op_reply(line)
+
+    def run_shell(self, cmd):
+        try:
+            words = shlex.split(cmd)
+        except ValueError:
+            return 'Unmatched quote.\n'
+        if not words:
+            return ''
+        name, args = words[0], words[1:]
+        if name == 'cli':
+            if args[:1] == ['-c'] and len(args) > 1:
+                return self.device.op_reply(args[1])
+            self.modes.append('cli')
+            return ''
+        elif name == 'exit':
+            self.modes.pop()
+            return ''
+        elif name == 'echo':
+            return ' '.join(args) + '\n'
+        elif name == 'stty':
+            if '-echo' in args:
+                self.echo = False
+            elif 'echo' in args:
+                self.echo = True
+            return ''
+        elif name == 'pwd':
+            return self.cwd + '\n'
+        elif name == 'cd':
+            self.cwd = path.normpath(path.join(self.cwd, args[0] if args
+                                               else '/var/home'))
+            return ''
+        elif name == 'sleep':
+            time.sleep(float(args[0]) if args else 0)
+            return ''
+        elif name == 'ls':
+            target = self.device.local_path(path.join(self.cwd, args[-1])
+                                            if args and args[-1][0] != '-'
+                                            else self.cwd)
+            if not path.isdir(target):
+                return 'ls: %s: No such file or directory\n' % target
+            return ''.join(n + '\n' for n in sorted(os.listdir(target)))
+        elif name == 'cat':
+            out = ''
+            for arg in args:
+                target = self.device.local_path(path.join(self.cwd, arg))
+                if path.isfile(target):
+                    with open(target, 'rb') as fp:
+                        out += fp.read()
+                else:
+                    out += 'cat: %s: No such file or directory\n' % arg
+            return out
+        elif name in ('touch', 'rm', 'mkdir'):
+            return ''
+        self.device.stats['commands'] += 1
+        return '%s: Command not found.\n' % name
+
+
+class _ScpSink(object):
+
+    """ Server side of the scp protocol, for both 'scp -t' and 'scp -f'. """
+
+    def __init__(self, device, channel, command):
+        self.device = device
+        self.channel = channel
+        self.args = command.split()[1:]
+        self.buf = ''
+
+    def run(self):
+        target = [a for a in self.args if not a.startswith('-')]
+        target = target[0] if target else '.'
+        if '-t' in self.args:
+            return self.receive(self.device.local_path(target))
+        return self.transmit(self.device.local_path(target), '-p' in self.args)
+
+    def _read(self, count):
+        while len(self.buf) < count:
+            data = self.channel.recv(max(65536, count - len(self.buf)))
+            if not data:
+                raise EOFError()
+            self.buf += data
+        data, self.buf = self.buf[:count], self.buf[count:]
+        return data
+
+    def _readline(self):
+        while '\n' not in self.buf:
+            data = self.channel.recv(4096)
+            if not data:
+                return ''
+            self.buf += data
+        line, self.buf = self.buf.split('\n', 1)
+        return line
+
+    def receive(self, dest):
+        """ scp -t: accept files and directories pushed by the client. """
+        self.channel.sendall('\0')
+        current = dest
+        stack = []
+        while True:
+            line = self._readline()
+            if not line:
+                return 0
+            kind = line[0]
+            if kind == 'C':
+                mode, size, name = line[1:].split(' ', 2)
+                self.channel.sendall('\0')
+                target = (path.join(current, name) if path.isdir(current)
+                          else current)
+                remaining = int(size)
+                with open(target, 'wb') as fp:
+                    while remaining:
+                        data = self._read(min(remaining, 65536))
+                        fp.write(data)
+                        remaining -= len(data)
+                self._read(1)
+                self.channel.sendall('\0')
+            elif kind == 'D':
+                mode, size, name = line[1:].split(' ', 2)
+                stack.append(current)
+                current = path.join(current, name)
+                if not path.isdir(current):
+                    os.makedirs(current)
+                self.channel.sendall('\0')
+            elif kind == 'E':
+                current = stack.pop() if stack else dest
+                self.channel.sendall('\0')
+            else:  # 'T' time stamps and anything else we don't care about.
+                self.channel.sendall('\0')
+
+    def transmit(self, source, preserve):
+        """ scp -f: send the requested file or directory to the client. """
+        self._read(1)
+        if not path.exists(source):
+            self.channel.sendall('\x01scp: %s: No such file or directory\n' %
+                                 source)
+            return 1
+        self._send_path(source, preserve)
+        return 0
+
+    def _send_path(self, source, preserve):
+        name = path.basename(source)
+        if preserve:
+            stats = os.stat(source)
+            self.channel.sendall('T%d 0 %d 0\n' % (stats.st_mtime,
+                                                   stats.st_atime))
+            self._read(1)
+        if path.isdir(source):
+            self.channel.sendall('D0755 0 %s\n' % name)
+            self._read(1)
+            for child in sorted(os.listdir(source)):
+                self._send_path(path.join(source, child), preserve)
+            self.channel.sendall('E\n')
+            self._read(1)
+            return
+        size = path.getsize(source)
+        self.channel.sendall('C0644 %d %s\n' % (size, name))
+        self._read(1)
+        with open(source, 'rb') as fp:
+            self.device.send(self.channel, fp.read())
+        self.channel.sendall('\0')
+        self._read(1)
+
+
+def _acknowledge(channel):
+    """ Confirm a channel request before the handler thread starts talking.
+
+    paramiko only sends the success reply after the check_channel_*
+    callback returns, so a fast handler thread could send its output (or
+    even close the channel) first. Sending the reply here keeps the order
+    right; the duplicate reply paramiko sends afterwards is ignored by the
+    client.
+    """
+    message = paramiko.Message()
+    message.add_byte(paramiko.common.cMSG_CHANNEL_SUCCESS)
+    message.add_int(channel.remote_chanid)
+    channel.transport._send_user_message(message)
+
+
+def _split_commands(line):
+    """ Split a shell line on ';', leaving quoted semicolons alone. """
+    commands, current, quote = [], '', None
+    for char in line:
+        if quote:
+            quote = None if char == quote else quote
+        elif char in '"\'':
+            quote = char
+        elif char == ';':
+            commands.append(current)
+            current = ''
+            continue
+        current += char
+    commands.append(current)
+    return [c for c in commands if c.strip()]
+
+
+def _daemon(target, *args):
+    thread = threading.Thread(target=target, args=args)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+class MockFleet(object):
+
+    """ Many MockDevices on consecutive loopback addresses and one port.
+
+    Platforms that only answer on 127.0.0.1 (OS X) can use spread='port'
+    instead, which puts every device on base_ip with consecutive ports.
+    """
+
+    def __init__(self, count, port=2222, base_ip='127.0.1.1', spread='ip',
+                 **kwargs):
+        """ Create (but don't start) the simulated devices.
+
+        @param count: How many devices to simulate.
+        @type count: int
+        @param port: The port every device listens on.
+        @type port: int
+        @param base_ip: The loopback address of the first device. Each
+                      | following device gets the next address.
+        @type base_ip: str
+        @param spread: 'ip' to give each device its own address, or 'port'
+                     | to give each device its own port on base_ip.
+        @type spread: str
+        @param kwargs: Passed on to every MockDevice.
+        @type kwargs: dict
+        """
+        first = sum(int(octet) << (8 * (3 - i))
+                    for i, octet in enumerate(base_ip.split('.')))
+        self.devices = []
+        for number in range(count):
+            options = dict(kwargs)
+            if spread == 'port':
+                host, device_port = base_ip, port + number
+                options.setdefault('hostname', 'mock-%d' % device_port)
+            else:
+                address = first + number
+                host = '.'.join(str((address >> shift) & 255)
+                                for shift in (24, 16, 8, 0))
+                device_port = port
+            self.devices.append(MockDevice(host=host, port=device_port,
+                                           **options))
+
+    @property
+    def hosts(self):
+        """ The addresses of every device in the fleet. """
+        return [device.host for device in self.devices]
+
+    @property
+    def addresses(self):
+        """ The (host, port) of every device in the fleet. """
+        return [(device.host, device.port) for device in self.devices]
+
+    def start(self):
+        for device in self.devices:
+            device.start()
+        return self
+
+    def stop(self):
+        for device in self.devices:
+            device.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
+
+
+@click.command(context_settings=CONTEXT_SETTINGS,
+               help="Run simulated Junos devices on localhost until Ctrl-C.")
+@click.option('-n', '--count', default=1, help="Number of devices.")
+@click.option('-P', '--port', default=2222, help="Port for every device.")
+@click.option('-b', '--base-ip', default='127.0.1.1', help="Address of the "
+              "first device.")
+@click.option('--spread', type=click.Choice(['ip', 'port']), default='ip',
+              help="Give each device its own loopback address (default), or "
+              "its own port on the base address.")
+@click.option('-u', '--username', default='jaide')
+@click.option('-p', '--password', default='jaide')
+@click.option('-l', '--latency', default=0.0, help="Seconds before replies.")
+@click.option('-B', '--bandwidth', default=0, help="Bytes/sec, 0 for no limit")
+@click.option('--auth-failure', default=0.0, help="Auth failure probability.")
+@click.option('--drop-rate', default=0.0, help="Dropped connection "
+              "probability.")
+@click.option('--hang-rate', default=0.0, help="Hung command probability.")
+@click.option('--error-rate', default=0.0, help="Command error probability.")
+@click.option('-I', '--interfaces', default=48, help="Interfaces per device.")
+@click.option('-H', '--hosts-file', type=click.Path(dir_okay=False),
+              help="Write the device addresses to this file.")
+def main(count, port, base_ip, spread, username, password, latency,
+         bandwidth, auth_failure, drop_rate, hang_rate, error_rate,
+         interfaces, hosts_file):
+    """ Serve a fleet of simulated devices from the command line. """
+    fleet = MockFleet(count, port=port, base_ip=base_ip, spread=spread,
+                      username=username,
+                      password=password, latency=latency,
+                      bandwidth=bandwidth or None, auth_failure=auth_failure,
+                      drop_rate=drop_rate, hang_rate=hang_rate,
+                      error_rate=error_rate, interfaces=interfaces)
+    host_key()
+    fleet.start()
+    if hosts_file:
+        with open(hosts_file, 'w') as fp:
+            fp.write('\n'.join(fleet.hosts) + '\n')
+    print('Serving %d devices: %s' % (count, ', '.join(
+        '%s:%d' % address for address in fleet.addresses)))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        fleet.stop()
+
+if __name__ == '__main__':
+    main()
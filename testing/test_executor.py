@@ -0,0 +1,89 @@
+""" Tests for the executor back ends, which need no device.
+
+    $ python -m unittest discover -s testing -p 'test_executor.py'
+"""
+# standard modules
+import time
+import unittest
+# intra-Jaide imports
+from jaide.executor import Executor
+
+
+def job(value, seconds=0):
+    """ A device job that takes some time, and fails for 'bad'. """
+    time.sleep(seconds)
+    if value == 'bad':
+        raise ValueError(value)
+    return value
+
+
+class ExecutorTests(object):
+
+    """ The tests of both back ends. """
+
+    backend = None
+
+    def run_jobs(self, jobs, workers=2, **kwargs):
+        self.done = []
+        self.failed = []
+        started = time.time()
+        stragglers = Executor(self.backend, workers, jobs=len(jobs)).run(
+            job, jobs, self.done.append,
+            on_failure=lambda key, reason, message, cls:
+            self.failed.append((key, reason, cls)), **kwargs)
+        return stragglers, time.time() - started
+
+    def test_results(self):
+        stragglers, _ = self.run_jobs([('a', ('a',)), ('b', ('bad',))])
+        self.assertEqual(self.done, ['a'])
+        self.assertEqual(self.failed, [('b', 'error', 'ValueError')])
+        self.assertEqual(stragglers, [])
+
+    def test_duplicate_keys(self):
+        self.run_jobs([('a', ('a',)), ('a', ('a',)), ('b', ('bad',)),
+                       ('b', ('bad',))])
+        self.assertEqual(self.done, ['a', 'a'])
+        self.assertEqual(self.failed, [('b', 'error', 'ValueError')] * 2)
+
+    def test_device_timeout(self):
+        # the hung job must not hold up the jobs queued behind it.
+        stragglers, took = self.run_jobs(
+            [('hung', ('hung', 20)), ('a', ('a',)), ('b', ('b',))],
+            workers=1, device_timeout=1)
+        self.assertLess(took, 10)
+        self.assertEqual(sorted(self.done), ['a', 'b'])
+        self.assertEqual(self.failed, [('hung', 'timeout', '')])
+        self.assertEqual([key for key, _ in stragglers], ['hung'])
+
+    def test_duplicate_timeouts(self):
+        stragglers, took = self.run_jobs(
+            [('hung', ('hung', 20)), ('hung', ('hung', 20)), ('a', ('a',))],
+            workers=2, device_timeout=1)
+        self.assertLess(took, 10)
+        self.assertEqual(self.done, ['a'])
+        self.assertEqual([key for key, _ in stragglers], ['hung', 'hung'])
+
+    def test_job_timeout(self):
+        stragglers, took = self.run_jobs(
+            [('hung', ('hung', 20)), ('later', ('later',))], workers=1,
+            job_timeout=1)
+        self.assertLess(took, 10)
+        self.assertEqual(self.done, [])
+        self.assertEqual(self.failed, [('hung', 'cancelled', ''),
+                                       ('later', 'cancelled', '')])
+        self.assertIn('still running', stragglers[0][1])
+        self.assertIn('not started', stragglers[1][1])
+
+
+class TestThreadExecutor(ExecutorTests, unittest.TestCase):
+
+    backend = 'thread'
+
+
+class TestProcessExecutor(ExecutorTests, unittest.TestCase):
+
+    backend = 'process'
+
+
+if __name__ == '__main__':
+    unittest.main()
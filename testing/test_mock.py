@@ -0,0 +1,181 @@
+""" Tests for the Jaide class against simulated devices.
+
+Unlike test_core.py, these need no hardware: each test case starts a
+MockDevice from mock_junos.py on a free localhost port. Run them from the
+top of the repository with:
+
+    $ python -m unittest discover -s testing -p 'test_mock.py'
+"""
+# standard modules
+import gc
+import os
+import socket
+import threading
+import time
+import unittest
+# intra-Jaide imports
+from jaide import Jaide, wrap
+from jaide.errors import JaideError
+from mock_junos import MockDevice
+
+
+class MockTestCase(unittest.TestCase):
+
+    """ Starts a simulated device for the tests of a case. """
+
+    def setUp(self):
+        self.device = MockDevice().start()
+        self.addCleanup(self.device.stop)
+
+    def session(self, **kwargs):
+        """ Connect a Jaide session to the device, closed after the test. """
+        session = Jaide(self.device.host, 'jaide', 'jaide',
+                        port=self.device.port, **kwargs)
+        self.addCleanup(session.disconnect)
+        return session
+
+
+class TestCandidate(MockTestCase):
+
+    """ The candidate configuration doesn't outlive the session using it. """
+
+    commands = 'set system host-name compared\nset system location x'
+
+    def test_back_to_back_compares(self):
+        first = self.session().compare_config(self.commands)
+        second = self.session().compare_config(self.commands)
+        self.assertIn('host-name compared', first)
+        self.assertEqual(first, second)
+
+    def test_compares_in_one_session(self):
+        session = self.session()
+        first = session.compare_config(self.commands)
+        self.assertEqual(first, session.compare_config(self.commands))
+
+    def test_discard_changes(self):
+        self.session().compare_config(self.commands)
+        self.assertEqual(self.device.candidate, [])
+
+
+class TestSessions(MockTestCase):
+
+    """ Device jobs close their sessions when they complete. """
+
+    def counts(self):
+        """ The number of threads and open file descriptors. """
+        gc.collect()
+        time.sleep(.3)
+        return threading.active_count(), len(os.listdir('/proc/self/fd'))
+
+    def run_jobs(self, function, args, jobs=10):
+        # the first job imports the modules of its session type.
+        wrap.open_connection(self.device.host, 'jaide', 'jaide', function,
+                             args, port=self.device.port)
+        before = self.counts()
+        for _ in range(jobs):
+            result = wrap.open_connection(self.device.host, 'jaide', 'jaide',
+                                          function, args,
+                                          port=self.device.port)
+            self.assertTrue(result.ok, result.render())
+        self.assertEqual(before, self.counts())
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'), 'needs /proc')
+    def test_operational(self):
+        self.run_jobs(wrap.command, ['show version'])
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'), 'needs /proc')
+    def test_netconf(self):
+        self.run_jobs(wrap.device_info, [])
+
+    @unittest.skipUnless(os.path.isdir('/proc/self/fd'), 'needs /proc')
+    def test_compare(self):
+        self.run_jobs(wrap.compare, ['set system host-name compared'])
+
+
+class TestRpcPipeline(MockTestCase):
+
+    """ Pipelined RPCs give the same replies as RPCs sent one by one. """
+
+    def test_sequential_fallback(self):
+        session = self.session()
+        self.assertTrue(session.interface_errors())
+        self.assertTrue(session._can_pipeline())
+        pipelined = session.interface_errors(), session.health_check()
+        # as with an ncclient missing the parts pipelining uses.
+        session._can_pipeline = lambda: False
+        self.assertEqual(pipelined, (session.interface_errors(),
+                                     session.health_check()))
+
+
+class TestAddresses(MockTestCase):
+
+    """ Every address of a host is tried, not just the first. """
+
+    def setUp(self):
+        super(TestAddresses, self).setUp()
+        getaddrinfo = socket.getaddrinfo
+        port = self.device.port
+
+        def dual_stack(host, *args, **kwargs):
+            if host != 'dual-stack.test':
+                return getaddrinfo(host, *args, **kwargs)
+            # the first address, like an unreachable IPv6 one, refuses.
+            return [(socket.AF_INET, socket.SOCK_STREAM, 6, '',
+                     (address, port)) for address in ('127.0.0.2',
+                                                      self.device.host)]
+        socket.getaddrinfo = dual_stack
+        self.addCleanup(setattr, socket, 'getaddrinfo', getaddrinfo)
+
+    def test_ssh(self):
+        session = Jaide('dual-stack.test', 'jaide', 'jaide',
+                        port=self.device.port)
+        self.addCleanup(session.disconnect)
+        self.assertIn('Hostname', session.op_cmd('show version'))
+
+    def test_netconf(self):
+        session = Jaide('dual-stack.test', 'jaide', 'jaide',
+                        port=self.device.port, connect='ncclient')
+        self.addCleanup(session.disconnect)
+        self.assertIn('Hostname', session.device_info())
+        self.assertIn('dns', session.timings.totals())
+
+
+class TestShellBatch(MockTestCase):
+
+    """ shell_batch() splits the shell output at its markers. """
+
+    def test_replies(self):
+        replies = self.session().shell_batch(['pwd', 'cd /var/tmp', 'pwd',
+                                              'echo one; echo two'])
+        self.assertEqual(replies, ['/var/home/jaide', '', '/var/tmp',
+                                   'one\ntwo'])
+
+    def test_carriage_returns(self):
+        # the progress of a command, redrawn on the same line.
+        with open(self.device.local_path('/var/tmp/progress'), 'wb') as fp:
+            fp.write('10%\r50%\rdone\r\n\r\nfinished\n')
+        replies = self.session().shell_batch(['cat /var/tmp/progress'])
+        self.assertEqual(replies, ['10%\r50%\rdone\n\nfinished'])
+
+    def test_reused_shell(self):
+        session = self.session()
+        self.assertEqual(session.shell_batch(['cd /var/tmp']), [''])
+        self.assertEqual(session.shell_batch(['pwd']), ['/var/tmp'])
+
+    def test_missing_marker(self):
+        session = self.session()
+        session.shell_batch(['pwd'])
+        read_shell = session._read_shell
+
+        def drop_marker(end):
+            # lose the line of the marker that learns the prompt.
+            return '\n'.join(line for line in read_shell(end).split('\n')
+                             if not line.endswith(':prompt'))
+        session._read_shell = drop_marker
+        with self.assertRaises(JaideError) as raised:
+            session.shell_batch(['pwd'])
+        self.assertIn(':prompt', str(raised.exception))
+
+
+if __name__ == '__main__':
+    unittest.main()
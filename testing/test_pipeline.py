@@ -0,0 +1,57 @@
+""" Tests for the pool of parse workers, which need no device.
+
+    $ python -m unittest discover -s testing -p 'test_pipeline.py'
+"""
+# standard modules
+import os
+import signal
+import time
+import unittest
+# intra-Jaide imports
+from jaide import pipeline
+
+PARENT = os.getpid()
+
+
+def where(seconds=0):
+    """ Return the process a job ran in, after some time. """
+    time.sleep(seconds)
+    return os.getpid()
+
+
+def crash():
+    """ Kill the worker running the job, as the OOM killer would. """
+    if os.getpid() == PARENT:
+        return 'in place'
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+class TestParsePool(unittest.TestCase):
+
+    """ A job is never waited for forever. """
+
+    def setUp(self):
+        self.pool = pipeline.start(2)
+        self.addCleanup(pipeline.stop)
+
+    def test_run(self):
+        self.assertNotEqual(pipeline.offload(where), PARENT)
+
+    def test_timeout(self):
+        started = time.time()
+        with self.assertRaises(pipeline.PipelineError):
+            self.pool.run(where, 20, timeout=1)
+        self.assertLess(time.time() - started, 10)
+
+    def test_lost_worker(self):
+        with self.assertRaises(pipeline.WorkerLostError):
+            self.pool.run(crash)
+        # the pool replaced the worker, and takes jobs again.
+        self.assertNotEqual(self.pool.run(where), PARENT)
+
+    def test_offload_falls_back(self):
+        self.assertEqual(pipeline.offload(crash), 'in place')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,234 @@
+""" Tests for checking and running playbooks, which need no device.
+
+    $ python -m unittest discover -s testing -p 'test_playbook.py'
+"""
+# standard modules
+import json
+from os import path
+import shutil
+import tempfile
+import unittest
+# intra-Jaide imports
+from jaide.playbook import ACTIONS, REQUIRED, Playbook, PlaybookError
+
+
+class FakeJaide(object):
+
+    """ Stands in for the session of a device, for steps that don't use it. """
+
+    host = '127.0.0.1'
+
+
+class TestCheckSteps(unittest.TestCase):
+
+    """ Invalid playbooks are refused before any device is connected to. """
+
+    def assertInvalid(self, steps, message):
+        with self.assertRaises(PlaybookError) as raised:
+            Playbook(steps)
+        self.assertIn(message, str(raised.exception))
+
+    def test_no_steps(self):
+        self.assertInvalid([], 'needs a list of steps')
+        self.assertInvalid({'action': 'info'}, 'needs a list of steps')
+
+    def test_step_not_an_object(self):
+        self.assertInvalid([{'action': 'info'}, 'info'],
+                           'Step 2 is not an object')
+
+    def test_unknown_action(self):
+        self.assertInvalid([{'action': 'reboot'}], "unknown action 'reboot'")
+        self.assertInvalid([{'name': 'x'}], "unknown action 'None'")
+
+    def test_duplicate_names(self):
+        self.assertInvalid([{'name': 'a', 'action': 'info'},
+                            {'name': 'a', 'action': 'health'}],
+                           "Step 2 has the name 'a' of an earlier step")
+        # a name can also clash with the number of a step without one.
+        self.assertInvalid([{'name': '2', 'action': 'info'},
+                            {'action': 'health'}],
+                           "Step 2 has the name '2' of an earlier step")
+
+    def test_default_names(self):
+        book = Playbook([{'action': 'info'}, {'action': 'health'}])
+        self.assertEqual([step['name'] for step in book.steps], ['1', '2'])
+
+    def test_unknown_keys(self):
+        self.assertInvalid([{'action': 'info', 'commands': 'x'}],
+                           'Step 1 has unknown parameters for info: commands')
+        self.assertInvalid([{'action': 'wait', 'seconds': 1, 'sleep': 1,
+                             'check': True}],
+                           'unknown parameters for wait: check, sleep')
+
+    def test_required_parameters(self):
+        for action, params in ACTIONS.items():
+            required = [key for key, value in params.items()
+                        if value is REQUIRED]
+            for missing in required:
+                step = dict((key, 1) for key in required if key != missing)
+                step['action'] = action
+                self.assertInvalid([step], 'needs the %s parameter for %s'
+                                   % (missing, action))
+
+    def test_defaults(self):
+        step = Playbook([{'action': 'operational',
+                          'commands': 'show version'}]).steps[0]
+        self.assertEqual(step['params'], {
+            'commands': 'show version', 'format': 'text', 'xpath': False,
+            'batch': False, 'parallel': 1})
+        self.assertEqual(step['when'], 'ok')
+        self.assertIsNone(step['expect'])
+
+    def test_commit_commands_or_blank(self):
+        self.assertInvalid([{'action': 'commit'}],
+                           'needs commands, or "blank": true')
+        self.assertInvalid([{'action': 'commit', 'blank': False,
+                             'commands': ''}], 'needs commands')
+        Playbook([{'action': 'commit', 'blank': True}])
+        Playbook([{'action': 'commit', 'commands': 'set system x'}])
+
+    def test_wait_seconds(self):
+        self.assertInvalid([{'action': 'wait', 'seconds': '10'}],
+                           'needs a number of seconds')
+        Playbook([{'action': 'wait', 'seconds': 0.5}])
+
+    def test_expressions(self):
+        self.assertInvalid([{'action': 'info', 'expect': '('}],
+                           'invalid expect expression')
+        self.assertInvalid([{'action': 'info', 'refuse': 5}],
+                           'invalid refuse expression')
+
+    def test_when(self):
+        steps = [{'name': 'preview', 'action': 'compare', 'commands': 'x'},
+                 {'action': 'info', 'when': 'preview.changed'},
+                 {'action': 'info', 'when': 'preview.unchanged'},
+                 {'action': 'info', 'when': '2.skipped'},
+                 {'action': 'info', 'when': 'failed'},
+                 {'action': 'info', 'when': 'always'}]
+        self.assertEqual([step['when'] for step in Playbook(steps).steps],
+                         ['ok', 'preview.changed', 'preview.unchanged',
+                          '2.skipped', 'failed', 'always'])
+
+    def test_when_later_step(self):
+        self.assertInvalid([{'action': 'info', 'when': 'later.ok'},
+                            {'name': 'later', 'action': 'info'}],
+                           "Step 1 has the condition 'later.ok'")
+        self.assertInvalid([{'name': 'self', 'action': 'info',
+                             'when': 'self.ok'}], "condition 'self.ok'")
+
+    def test_when_invalid(self):
+        self.assertInvalid([{'name': 'a', 'action': 'info'},
+                            {'action': 'info', 'when': 'a.done'}],
+                           "condition 'a.done'")
+        self.assertInvalid([{'action': 'info', 'when': 'sometimes'}],
+                           "condition 'sometimes'")
+
+    def test_dotted_names(self):
+        book = Playbook([{'name': 'v1.2', 'action': 'info'},
+                         {'action': 'info', 'when': 'v1.2.failed'}])
+        self.assertEqual(book.steps[1]['when'], 'v1.2.failed')
+
+
+class TestShouldRun(unittest.TestCase):
+
+    """ The conditions of steps, against the results so far. """
+
+    results = {'a': {'status': 'ok', 'changed': True},
+               'b': {'status': 'failed', 'changed': None},
+               'c': {'status': 'skipped', 'changed': False}}
+
+    def test_conditions(self):
+        should_run = Playbook._should_run
+        for when, failed, expected in (('ok', False, True),
+                                       ('ok', True, False),
+                                       ('failed', False, False),
+                                       ('failed', True, True),
+                                       ('always', True, True),
+                                       ('a.ok', True, True),
+                                       ('a.changed', False, True),
+                                       ('a.unchanged', False, False),
+                                       ('b.failed', True, True),
+                                       ('b.changed', True, False),
+                                       ('b.unchanged', True, False),
+                                       ('c.skipped', False, True),
+                                       ('c.unchanged', False, True)):
+            self.assertEqual(should_run(when, self.results, failed),
+                             expected, (when, failed))
+
+
+class TestRun(unittest.TestCase):
+
+    """ Steps run in order, and stop running once one has failed. """
+
+    def test_run(self):
+        book = Playbook([
+            {'name': 'first', 'action': 'wait', 'seconds': 0,
+             'expect': '^Waited 0'},
+            {'name': 'second', 'action': 'wait', 'seconds': 0,
+             'refuse': 'Waited'},
+            {'name': 'third', 'action': 'wait', 'seconds': 0},
+            {'name': 'cleanup', 'action': 'wait', 'seconds': 0,
+             'when': 'failed'},
+            {'name': 'after', 'action': 'wait', 'seconds': 0,
+             'when': 'first.ok'}], name='book')
+        output, summary = book.run(FakeJaide())
+        self.assertFalse(summary['ok'])
+        self.assertEqual([(step['name'], step['status'])
+                          for step in summary['steps']],
+                         [('first', 'ok'), ('second', 'failed'),
+                          ('third', 'skipped'), ('cleanup', 'ok'),
+                          ('after', 'ok')])
+        self.assertEqual(summary['counts'], {'ok': 3, 'failed': 1,
+                                             'skipped': 1})
+        self.assertIn('the output matches /Waited/',
+                      summary['steps'][1]['error'])
+        self.assertIn('Playbook book failed on 127.0.0.1', output)
+
+
+class TestLoad(unittest.TestCase):
+
+    """ Playbooks are read from JSON, with paths relative to the file. """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='jaide-test-')
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def write(self, name, content):
+        filename = path.join(self.folder, name)
+        with open(filename, 'w') as fp:
+            fp.write(content if isinstance(content, str) else
+                     json.dumps(content))
+        return filename
+
+    def test_relative_paths(self):
+        commands = self.write('change.set', 'set system host-name x\n')
+        book = Playbook.load(self.write('change.json', {'steps': [
+            {'action': 'compare', 'commands': 'change.set'},
+            {'action': 'operational', 'commands': 'show version'},
+            {'action': 'push', 'source': 'files', 'destination': '/var/tmp'},
+        ]}))
+        self.assertEqual(book.name, 'change')
+        params = [step['params'] for step in book.steps]
+        self.assertEqual(params[0]['commands'], commands)
+        self.assertEqual(params[1]['commands'], 'show version')
+        self.assertEqual(params[2]['source'], path.join(self.folder, 'files'))
+        self.assertEqual(params[2]['destination'], '/var/tmp')
+
+    def test_list_of_steps(self):
+        book = Playbook.load(self.write('steps.json', [{'action': 'info'}]))
+        self.assertEqual(book.name, 'steps')
+        self.assertEqual(len(book.steps), 1)
+
+    def test_invalid_files(self):
+        for name, content in (('missing.json', None), ('bad.json', '{'),
+                              ('string.json', '"steps"'),
+                              ('empty.json', {'name': 'x'})):
+            filename = path.join(self.folder, name)
+            if content is not None:
+                self.write(name, content)
+            with self.assertRaises(PlaybookError):
+                Playbook.load(filename)
+
+
+if __name__ == '__main__':
+    unittest.main()
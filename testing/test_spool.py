@@ -0,0 +1,160 @@
+""" Tests for the buffers of device replies, which need no device.
+
+    $ python -m unittest discover -s testing -p 'test_spool.py'
+"""
+# standard modules
+from os import path
+import pickle
+import random
+import unittest
+# intra-Jaide imports
+from jaide.spool import SpoolBuffer, text
+
+# the chunks written to the buffers, with 26 bytes in total.
+CHUNKS = ['abc', 'defg', 'h', 'ijklmnop', 'qrs', 'tuvwxyz']
+DATA = ''.join(CHUNKS)
+
+
+class SpoolTests(object):
+
+    """ The behaviour of a buffer, whether in memory or spilled. """
+
+    spool_size = None
+
+    def setUp(self):
+        self.buf = SpoolBuffer(self.spool_size)
+        for chunk in CHUNKS:
+            self.buf.write(chunk)
+        self.addCleanup(self.buf.close)
+
+    def test_contents(self):
+        self.assertEqual(len(self.buf), len(DATA))
+        self.assertEqual(self.buf.getvalue(), DATA)
+        self.assertEqual(str(self.buf), DATA)
+        self.assertEqual(''.join(self.buf.chunks(5)), DATA)
+        self.assertEqual(text(self.buf), DATA)
+
+    def test_read_across_chunks(self):
+        for size in range(1, len(DATA) + 2):
+            self.buf.seek(0)
+            pieces = []
+            while True:
+                piece = self.buf.read(size)
+                if not piece:
+                    break
+                self.assertLessEqual(len(piece), size)
+                pieces.append(piece)
+            self.assertEqual(''.join(pieces), DATA, size)
+            self.assertEqual(self.buf.tell(), len(DATA))
+
+    def test_read_rest(self):
+        self.assertEqual(self.buf.read(5), 'abcde')
+        self.assertEqual(self.buf.read(), DATA[5:])
+        self.assertEqual(self.buf.read(), '')
+        self.buf.seek(2)
+        self.assertEqual(self.buf.read(None), DATA[2:])
+
+    def test_seek(self):
+        self.buf.seek(10)
+        self.assertEqual(self.buf.read(4), 'klmn')
+        self.buf.seek(-6, 1)
+        self.assertEqual(self.buf.tell(), 8)
+        self.assertEqual(self.buf.read(3), 'ijk')
+        self.buf.seek(-3, 2)
+        self.assertEqual(self.buf.read(), 'xyz')
+        self.buf.seek(-100)
+        self.assertEqual(self.buf.tell(), 0)
+        self.buf.seek(100)
+        self.assertEqual(self.buf.tell(), len(DATA))
+        self.assertEqual(self.buf.read(1), '')
+
+    def test_random_reads(self):
+        rand = random.Random(42)
+        for _ in range(500):
+            position = rand.randint(0, len(DATA))
+            size = rand.randint(-1, 12)
+            self.buf.seek(position)
+            expected = DATA[position:] if size < 0 else \
+                DATA[position:position + size]
+            self.assertEqual(self.buf.read(size), expected, (position, size))
+            self.assertEqual(self.buf.tell(), position + len(expected))
+
+    def test_write_keeps_position(self):
+        self.assertEqual(self.buf.read(24), DATA[:24])
+        self.buf.write('0123')
+        self.assertEqual(self.buf.tell(), 24)
+        self.assertEqual(self.buf.read(), 'yz0123')
+
+    def test_read_after_getvalue(self):
+        self.assertEqual(self.buf.read(9), DATA[:9])
+        self.buf.getvalue()
+        self.assertEqual(self.buf.read(4), 'jklm')
+
+    def test_tail(self):
+        for size in range(len(DATA) + 2):
+            self.assertEqual(self.buf.tail(size), DATA[-size:] if size else '')
+        self.assertTrue(self.buf.endswith('wxyz'))
+        self.assertTrue(self.buf.endswith('pqrstuvwxyz'))
+        self.assertFalse(self.buf.endswith('xy'))
+
+    def test_write_buffer(self):
+        copy = SpoolBuffer(self.spool_size)
+        copy.write(self.buf)
+        copy.write('')
+        self.assertEqual(copy.getvalue(), DATA)
+        copy.close()
+
+    def test_pickle(self):
+        self.buf.read(3)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            loaded = pickle.loads(pickle.dumps(self.buf, protocol))
+            self.assertEqual(loaded, DATA)
+            self.assertIs(type(loaded), str)
+
+    def test_close(self):
+        name = self.buf.name
+        self.buf.close()
+        self.assertEqual(len(self.buf), 0)
+        self.assertEqual(self.buf.getvalue(), '')
+        self.assertEqual(self.buf.read(), '')
+        self.assertFalse(self.buf.spilled)
+        if name is not None:
+            self.assertFalse(path.exists(name))
+
+
+class TestMemory(SpoolTests, unittest.TestCase):
+
+    def test_not_spilled(self):
+        self.assertFalse(self.buf.spilled)
+        self.assertIsNone(self.buf.name)
+
+
+class TestSpilled(SpoolTests, unittest.TestCase):
+
+    spool_size = 10
+
+    def test_spilled(self):
+        self.assertTrue(self.buf.spilled)
+        with open(self.buf.name) as fp:
+            self.assertEqual(fp.read(), DATA)
+
+
+class TestSpill(unittest.TestCase):
+
+    """ A buffer moves to a file once it passes its spool_size. """
+
+    def test_spill_while_reading(self):
+        buf = SpoolBuffer(8)
+        buf.write('abcd')
+        buf.write('efgh')
+        self.assertFalse(buf.spilled)
+        self.assertEqual(buf.read(6), 'abcdef')
+        buf.write('i')
+        self.assertTrue(buf.spilled)
+        self.assertEqual(buf.read(), 'ghi')
+        self.assertTrue(buf.endswith('ghi'))
+        buf.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
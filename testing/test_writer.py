@@ -0,0 +1,77 @@
+""" Tests for the -w output writer, which need no device.
+
+    $ python -m unittest discover -s testing -p 'test_writer.py'
+"""
+# standard modules
+from os import path
+import shutil
+import tarfile
+import tempfile
+import unittest
+import zipfile
+# intra-Jaide imports
+from jaide.color_utils import color
+from jaide.formats import Formatter
+from jaide.result import DeviceResult
+from jaide.spool import SpoolBuffer
+from jaide.writer import OutputWriter
+
+
+class TestOutputWriter(unittest.TestCase):
+
+    """ Files written in the text format hold no color codes. """
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp(prefix='jaide-test-')
+        self.addCleanup(shutil.rmtree, self.folder)
+
+    def results(self):
+        spooled = SpoolBuffer(spool_size=16)
+        spooled.write(color('> show version', 'yel') + '\n')
+        spooled.write('Hostname: two\n' * 8)
+        return [DeviceResult('127.0.0.1', output=color('> show version',
+                                                       'yel') + '\none\n'),
+                DeviceResult('127.0.0.2', output=spooled),
+                DeviceResult('127.0.0.3').fail('Unable to connect')]
+
+    def write(self, mode, name, formatter=None):
+        dest = path.join(self.folder, name)
+        writer = OutputWriter(mode, dest, echo=False, formatter=formatter)
+        writer.start()
+        for result in self.results():
+            writer.write(result)
+        self.assertEqual(writer.close(), 3)
+        return dest
+
+    def assertPlain(self, text):
+        self.assertNotIn('\x1b[', text)
+        self.assertIn('Results from device:', text)
+
+    def test_single(self):
+        with open(self.write('single', 'out.txt')) as fp:
+            text = fp.read()
+        self.assertPlain(text)
+        self.assertIn('Hostname: two', text)
+        self.assertIn('Unable to connect', text)
+
+    def test_multiple(self):
+        self.write('multiple', 'out.txt', Formatter('text'))
+        for host in ('127.0.0.1', '127.0.0.2', '127.0.0.3'):
+            with open(path.join(self.folder, host + '_out.txt')) as fp:
+                self.assertPlain(fp.read())
+
+    def test_tar(self):
+        archive = tarfile.open(self.write('tar', 'out.tar'))
+        for member in archive.getmembers():
+            self.assertPlain(archive.extractfile(member).read())
+        archive.close()
+
+    def test_zip(self):
+        archive = zipfile.ZipFile(self.write('zip', 'out.zip'))
+        for name in archive.namelist():
+            self.assertPlain(archive.read(name))
+        archive.close()
+
+
+if __name__ == '__main__':
+    unittest.main()